@@ -0,0 +1,100 @@
+import time
+
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components, min_weight_full_bipartite_matching
+
+from .models import OrganMatching
+
+
+# ==================================================
+# Assignment solver
+# ==================================================
+def solve_assignment(patient_idx, donor_idx, weights, n_patients, n_donors):
+    # بيرجع أرقام الـ edges المختارة: كل مريض ياخد متبرع واحد بالكتير والعكس
+    if not len(weights):
+        return np.empty(0, dtype=np.int64), 0
+
+    graph = coo_matrix(
+        (np.ones(len(weights)), (patient_idx, n_patients + donor_idx)),
+        shape=(n_patients + n_donors, n_patients + n_donors),
+    )
+    n_components, _ = connected_components(graph, directed=False)
+
+    # نفس الـ (patient, donor) ممكن يتكرر بأكتر من organ: بناخد الأعلى وزن
+    keys = patient_idx * n_donors + donor_idx
+    order = np.lexsort((-weights, keys))
+    edges = order[np.concatenate(([True], keys[order][1:] != keys[order][:-1]))]
+    patients, donors = patient_idx[edges], donor_idx[edges]
+
+    # the solver needs a full matching, so every patient gets a dummy donor (= unmatched) and every donor a
+    # dummy patient; dummy patient j ↔ dummy donor i for every real edge (i, j) pairs the leftovers up.
+    # All dummy edges cost c and a real edge c - weight: any full matching then costs
+    # c * (n_patients + n_donors) - sum(weights), so the cheapest one is the max-weight assignment.
+    c = max(float(weights.max()), 0.0) + 1
+    patient_range, donor_range = np.arange(n_patients), np.arange(n_donors)
+    rows = np.concatenate([patients, patient_range, n_patients + donor_range, n_patients + donors])
+    cols = np.concatenate([donors, n_donors + patient_range, donor_range, n_donors + patients])
+    costs = np.concatenate([c - weights[edges], np.full(n_patients + n_donors + len(edges), c)])
+    biadjacency = csr_matrix((costs, (rows, cols)), shape=(n_patients + n_donors, n_donors + n_patients))
+
+    row_ind, col_ind = min_weight_full_bipartite_matching(biadjacency)
+    real = (row_ind < n_patients) & (col_ind < n_donors)
+    picked = row_ind[real] * n_donors + col_ind[real]
+    kept_keys = keys[edges]
+    key_order = np.argsort(kept_keys)
+    chosen = edges[key_order[np.searchsorted(kept_keys, picked, sorter=key_order)]]
+    return np.sort(chosen), n_components
+
+
+def priority_weight(match_percentage, priority_score):
+    # المريض الأعلى أولوية بياخد وزن أكبر لنفس الـ match
+    return match_percentage * (1 + (priority_score or 0) / 100)
+
+
+# ==================================================
+# Allocation over stored matches
+# ==================================================
+def allocate(organ_type=None, min_score=0):
+    started = time.perf_counter()
+    queryset = OrganMatching.objects.filter(
+        status='pending',
+        patient__status='approved',
+        donor__status='approved',
+        match_percentage__gt=min_score,
+    )
+    if organ_type:
+        queryset = queryset.filter(organ_type=organ_type)
+    rows = list(queryset.values_list(
+        'id', 'patient_id', 'donor_id', 'organ_type', 'match_percentage', 'patient__priority__score'
+    ))
+
+    patient_ids = sorted({row[1] for row in rows})
+    donor_ids = sorted({row[2] for row in rows})
+    patient_pos = {pk: i for i, pk in enumerate(patient_ids)}
+    donor_pos = {pk: i for i, pk in enumerate(donor_ids)}
+    patient_idx = np.array([patient_pos[row[1]] for row in rows], dtype=np.int64)
+    donor_idx = np.array([donor_pos[row[2]] for row in rows], dtype=np.int64)
+    weights = np.array([priority_weight(row[4], row[5]) for row in rows], dtype=np.float64)
+
+    chosen, n_components = solve_assignment(patient_idx, donor_idx, weights, len(patient_ids), len(donor_ids))
+
+    assignments = [
+        {
+            "match_id": rows[e][0],
+            "patient": rows[e][1],
+            "donor": rows[e][2],
+            "organ_type": rows[e][3],
+            "match_percentage": rows[e][4],
+            "priority_score": rows[e][5] or 0,
+            "weight": round(float(weights[e]), 4),
+        }
+        for e in chosen
+    ]
+    return {
+        "assignments": assignments,
+        "total_weight": round(float(weights[chosen].sum()), 4) if len(chosen) else 0,
+        "candidates": len(rows),
+        "components": int(n_components),
+        "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
@@ -4,6 +4,12 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     name = 'core'
 
+    def ready(self):
+        # table versions للـ ETags (core.versions) و الـ hospital stats rollup (core.rollups)
+        from . import rollups, versions
+        versions.connect_signals()
+        rollups.connect_signals()
+
 from django.apps import AppConfig
 
 class OrganMatchConfig(AppConfig):
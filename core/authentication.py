@@ -0,0 +1,50 @@
+# Hospitals aren't auth users (no Token row), so hospital login hands out a signed, stateless token:
+# Authorization: Hospital <token>. بيبوظ لو الـ password اتغير أو بعد HOSPITAL_TOKEN_MAX_AGE.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core import signing
+from django.utils.crypto import constant_time_compare, salted_hmac
+from rest_framework import authentication, exceptions, permissions
+
+from .models import Hospital
+
+HOSPITAL_TOKEN_SALT = 'core.hospital-token'
+
+
+def password_fingerprint(hospital):
+    return salted_hmac(HOSPITAL_TOKEN_SALT, hospital.password).hexdigest()[:16]
+
+
+def hospital_token(hospital):
+    return signing.dumps([hospital.id, password_fingerprint(hospital)], salt=HOSPITAL_TOKEN_SALT, compress=True)
+
+
+class HospitalTokenAuthentication(authentication.BaseAuthentication):
+    keyword = 'Hospital'
+
+    def authenticate(self, request):
+        auth = authentication.get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed("Invalid hospital token header.")
+        try:
+            hospital_id, fingerprint = signing.loads(
+                auth[1].decode(), salt=HOSPITAL_TOKEN_SALT, max_age=settings.HOSPITAL_TOKEN_MAX_AGE
+            )
+        except (signing.BadSignature, UnicodeError, TypeError, ValueError):
+            raise exceptions.AuthenticationFailed("Invalid or expired hospital token.")
+
+        hospital = Hospital.objects.filter(id=hospital_id).only('id', 'password').first()
+        if hospital is None or not constant_time_compare(password_fingerprint(hospital), fingerprint):
+            raise exceptions.AuthenticationFailed("Invalid or expired hospital token.")
+        # request.user مجهول، والمستشفى في request.auth
+        return AnonymousUser(), hospital
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+class IsHospital(permissions.BasePermission):
+    def has_permission(self, request, view):
+        return isinstance(request.auth, Hospital)
@@ -0,0 +1,206 @@
+import time
+
+import numpy as np
+from scipy.optimize import Bounds, LinearConstraint, milp
+from scipy.sparse import coo_matrix
+
+from .matching import ABO_BITS, ABO_RECEIVES_FROM, ALL_ABO, abo_group
+from .models import DonorMedicalProfile, OrganMatching, OrganType
+
+
+# ==================================================
+# Compatibility graph
+# ==================================================
+def abo_compatible(donor_blood_type, patient_blood_type):
+    donor_group, patient_group = abo_group(donor_blood_type), abo_group(patient_blood_type)
+    if donor_group is None or patient_group is None:
+        return True
+    return bool(ABO_RECEIVES_FROM.get(patient_group, ALL_ABO) & ABO_BITS.get(donor_group, ALL_ABO))
+
+
+class ExchangePool:
+    # pairs[i] = (donor_id, patient_id) اللي مش متوافقين مع بعض
+    # altruistic = donors without a paired patient
+    def __init__(self, min_score=1):
+        profiles = list(
+            DonorMedicalProfile.objects
+            .filter(organ_available=OrganType.KIDNEY, donor__status='approved')
+            .values_list('donor_id', 'donor__blood_type', 'paired_patient_id', 'paired_patient__status',
+                         'paired_patient__blood_type')
+            .order_by('donor_id')
+        )
+        blood = {}
+        candidate_pairs, altruistic = [], []
+        for donor_id, donor_blood, patient_id, patient_status, patient_blood in profiles:
+            blood[donor_id] = donor_blood
+            if patient_id is None:
+                altruistic.append(donor_id)
+            elif patient_status == 'approved':
+                blood[patient_id] = patient_blood
+                candidate_pairs.append((donor_id, patient_id))
+
+        patient_ids = {patient_id for _, patient_id in candidate_pairs}
+        donor_ids = {donor_id for donor_id, _ in candidate_pairs} | set(altruistic)
+        self.scores = {}
+        rows = OrganMatching.objects.filter(
+            organ_type=OrganType.KIDNEY,
+            status='pending',
+            patient_id__in=patient_ids,
+            donor_id__in=donor_ids,
+            match_percentage__gte=min_score,
+        ).values_list('donor_id', 'patient_id', 'match_percentage')
+        for donor_id, patient_id, score in rows:
+            if abo_compatible(blood.get(donor_id), blood.get(patient_id)):
+                self.scores[(donor_id, patient_id)] = score
+
+        # الزوج اللي المتبرع بتاعه يقدر يدي مريضه مباشرة مش محتاج exchange
+        self.pairs = [pair for pair in candidate_pairs if pair not in self.scores]
+        self.altruistic = altruistic
+
+        # الـ edges من الـ scores (صفوف OrganMatching) مباشرة: O(rows) بدل كل donor × كل patient
+        patient_index = {}
+        for i, (_, patient_id) in enumerate(self.pairs):
+            patient_index.setdefault(patient_id, []).append(i)
+        donor_edges = {donor_id: {} for donor_id, _ in self.pairs}
+        donor_edges.update((donor_id, {}) for donor_id in self.altruistic)
+        for (donor_id, patient_id), score in self.scores.items():
+            # donor الزوج بتاعه متوافق مباشرة مش في الـ pool
+            edges = donor_edges.get(donor_id)
+            if edges is not None:
+                for j in patient_index.get(patient_id, ()):
+                    edges[j] = score
+        # بترتيب الـ pair عشان الـ search يمشي بنفس الترتيب كل مرة
+        self.pair_edges = [dict(sorted(donor_edges[donor_id].items())) for donor_id, _ in self.pairs]
+        self.altruistic_edges = [dict(sorted(donor_edges[donor_id].items())) for donor_id in self.altruistic]
+
+
+# ==================================================
+# Cycles & chains
+# ==================================================
+def enumerate_cycles(pool, max_cycle, deadline):
+    out = pool.pair_edges
+    cycles = []
+    for i in range(len(pool.pairs)):
+        if time.perf_counter() > deadline:
+            return cycles, False
+        # cycles are listed once, starting from their smallest pair index
+        for j, w_ij in out[i].items():
+            if j <= i:
+                continue
+            if i in out[j]:
+                cycles.append(((i, j), w_ij + out[j][i]))
+            if max_cycle < 3:
+                continue
+            for k, w_jk in out[j].items():
+                if k <= i or k == j or i not in out[k]:
+                    continue
+                cycles.append(((i, j, k), w_ij + w_jk + out[k][i]))
+    return cycles, True
+
+
+def enumerate_chains(pool, max_chain, deadline):
+    chains = []
+    for a, first_edges in enumerate(pool.altruistic_edges):
+        stack = [((j,), w) for j, w in first_edges.items()]
+        while stack:
+            if time.perf_counter() > deadline:
+                return chains, False
+            path, weight = stack.pop()
+            chains.append((a, path, weight))
+            if len(path) < max_chain:
+                for k, w in pool.pair_edges[path[-1]].items():
+                    if k not in path:
+                        stack.append((path + (k,), weight + w))
+    return chains, True
+
+
+# ==================================================
+# Maximum-weight disjoint selection
+# ==================================================
+def select_disjoint(resources, weights, time_limit):
+    # resources[c] = الحاجات اللي الـ candidate ده بيستخدمها (donors / patients)
+    if not weights:
+        return [], True
+    keys = {}
+    rows, cols = [], []
+    for c, used in enumerate(resources):
+        for key in used:
+            rows.append(keys.setdefault(key, len(keys)))
+            cols.append(c)
+    matrix = coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(keys), len(weights)))
+    result = milp(
+        c=-np.asarray(weights, dtype=np.float64),
+        constraints=LinearConstraint(matrix, -np.inf, 1),
+        integrality=np.ones(len(weights)),
+        bounds=Bounds(0, 1),
+        options={'time_limit': max(time_limit, 0.05)},
+    )
+    if result.x is not None:
+        return [c for c, x in enumerate(result.x) if x > 0.5], result.status == 0
+
+    # الـ solver ملحقش: greedy بالوزن
+    taken, chosen = set(), []
+    for c in sorted(range(len(weights)), key=lambda c: -weights[c]):
+        if not taken & resources[c]:
+            taken |= resources[c]
+            chosen.append(c)
+    return chosen, False
+
+
+def find_exchanges(max_cycle=3, max_chain=3, min_score=1, time_budget=2.0):
+    started = time.perf_counter()
+    deadline = started + time_budget
+    pool = ExchangePool(min_score)
+
+    # لو الوقت خلص بنكمل بالـ candidates اللي اتلقت لحد دلوقتي
+    cycles, complete = enumerate_cycles(pool, max_cycle, deadline)
+    chains, chains_complete = enumerate_chains(pool, max_chain, deadline) if max_chain else ([], True)
+    complete = complete and chains_complete
+
+    def pair_resources(indexes):
+        used = set()
+        for i in indexes:
+            donor_id, patient_id = pool.pairs[i]
+            used |= {('donor', donor_id), ('patient', patient_id)}
+        return used
+
+    candidates = []
+    for path, weight in cycles:
+        candidates.append(('cycle', None, path, weight, pair_resources(path)))
+    for a, path, weight in chains:
+        candidates.append(('chain', a, path, weight, pair_resources(path) | {('donor', pool.altruistic[a])}))
+
+    chosen, optimal = select_disjoint(
+        [c[4] for c in candidates], [c[3] for c in candidates], deadline - time.perf_counter()
+    )
+
+    exchanges = []
+    for c in chosen:
+        kind, a, path, weight, _ = candidates[c]
+        if kind == 'cycle':
+            givers = [pool.pairs[i][0] for i in path]
+            receivers = [pool.pairs[i][1] for i in path[1:] + path[:1]]
+        else:
+            givers = [pool.altruistic[a]] + [pool.pairs[i][0] for i in path[:-1]]
+            receivers = [pool.pairs[i][1] for i in path]
+        exchanges.append({
+            "type": kind,
+            "weight": weight,
+            "transplants": [
+                {"donor": donor_id, "patient": patient_id, "match_percentage": pool.scores[(donor_id, patient_id)]}
+                for donor_id, patient_id in zip(givers, receivers)
+            ],
+        })
+
+    return {
+        "exchanges": exchanges,
+        "total_weight": sum(e["weight"] for e in exchanges),
+        "transplants": sum(len(e["transplants"]) for e in exchanges),
+        "pairs": len(pool.pairs),
+        "altruistic_donors": len(pool.altruistic),
+        "cycles": len(cycles),
+        "chains": len(chains),
+        "complete_search": complete,
+        "optimal": complete and optimal,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
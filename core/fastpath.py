@@ -0,0 +1,169 @@
+# Read-only fast path for the hot list endpoints (users, alerts, vital signs, matches):
+# الصفوف بتيجي من values() وبتتحول بـ mappers متجهزة مرة واحدة لكل serializer، وبتترندر بـ orjson.
+# الـ output لازم يفضل نفس الـ bytes اللي JSONRenderer بيطلعها، فأي قيمة مش متأكدين منها بترجعنا للـ serializer.
+import orjson
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.utils import timezone
+from rest_framework import fields, relations
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+
+class UnsafeValue(Exception):
+    # قيمة orjson هيكتبها بشكل مختلف عن json (floats بـ exponent، NaN...)
+    pass
+
+
+def plain_float(value):
+    # json و orjson بيكتبوا الـ float بنفس الشكل طالما مفيش exponent
+    value = float(value)
+    if value and not 1e-4 <= abs(value) < 1e16:
+        raise UnsafeValue(value)
+    return value
+
+
+def plain_json(value):
+    if isinstance(value, float):
+        plain_float(value)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            if not isinstance(key, str):
+                raise UnsafeValue(key)
+            plain_json(item)
+    elif isinstance(value, list):
+        for item in value:
+            plain_json(item)
+    return value
+
+
+def datetime_value(value):
+    # نفس DateTimeField.to_representation في DRF
+    value = value.astimezone(timezone.get_current_timezone()).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def field_mapper(serializer_class, name, field, model):
+    # (columns, convert) لحقل واحد، أو None لو الحقل محتاج الـ serializer (nested، method...)
+    if isinstance(field, fields.SerializerMethodField):
+        from_row = getattr(serializer_class, f'{name}_from_row', None)
+        sources = getattr(serializer_class, 'field_sources', {}).get(name)
+        if from_row is None or not sources:
+            return None
+        return list(sources), from_row
+
+    if '.' in field.source or field.source == '*':
+        return None
+    try:
+        model_field = model._meta.get_field(field.source)
+    except FieldDoesNotExist:
+        return None
+    if not model_field.concrete or model_field.many_to_many:
+        return None
+    column = model_field.attname
+
+    if isinstance(field, relations.PrimaryKeyRelatedField) and field.pk_field is None:
+        convert = None
+    elif isinstance(field, fields.DateTimeField):
+        convert = datetime_value
+    elif isinstance(field, fields.DateField):
+        convert = lambda value: value.isoformat()  # noqa: E731
+    elif isinstance(field, fields.FloatField):
+        convert = plain_float
+    elif isinstance(field, fields.BooleanField):
+        convert = bool
+    elif isinstance(field, fields.IntegerField):
+        convert = int
+    elif isinstance(field, fields.JSONField) and not field.binary:
+        convert = plain_json
+    elif isinstance(field, (fields.CharField, fields.ChoiceField)):
+        convert = str
+    else:
+        return None
+
+    def from_row(row):
+        value = row[column]
+        return value if value is None or convert is None else convert(value)
+
+    return [column], from_row
+
+
+class RowMapper:
+    def __init__(self, plan, columns):
+        self.plan = plan
+        self.columns = columns
+
+    def __call__(self, row):
+        return {name: from_row(row) for name, from_row in self.plan}
+
+
+_mappers = {}
+
+
+def row_mapper(serializer_class, names):
+    key = (serializer_class, tuple(names))
+    if key not in _mappers:
+        serializer_fields = serializer_class.field_instances()
+        model = serializer_class.Meta.model
+        plan, columns = [], []
+        for name in names:
+            mapped = field_mapper(serializer_class, name, serializer_fields[name], model)
+            if mapped is None:
+                plan = None
+                break
+            plan.append((name, mapped[1]))
+            columns += [column for column in mapped[0] if column not in columns]
+        _mappers[key] = RowMapper(plan, columns) if plan is not None else None
+    return _mappers[key]
+
+
+class FastJSONRenderer(JSONRenderer):
+    # نفس JSONRenderer بالظبط، و orjson بس للـ responses اللي الـ fast path جهزها
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        if (
+            data is None or not getattr(response, 'fast_json', False)
+            or self.get_indent(accepted_media_type, renderer_context or {})
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            content = orjson.dumps(data)
+        except (orjson.JSONEncodeError, TypeError):
+            return super().render(data, accepted_media_type, renderer_context)
+        # JSONRenderer بيعمل escape للـ line / paragraph separators
+        return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class FastListMixin:
+    # GET list بـ JSON: values() + mappers بدل الـ serializer؛ أي حاجة تانية بتعدي على الطريق العادي
+    fast_path = settings.API_FAST_PATH
+
+    def get_row_mapper(self, request):
+        if not self.fast_path or not isinstance(request.accepted_renderer, FastJSONRenderer):
+            return None
+        serializer_class = self.get_serializer_class()
+        names = serializer_class.sparse_field_names(
+            serializer_class.field_instances(), *serializer_class.requested_fields(request)
+        )
+        return row_mapper(serializer_class, names)
+
+    def list(self, request, *args, **kwargs):
+        mapper = self.get_row_mapper(request)
+        if mapper is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        paginator = self.paginator
+        extra = paginator.required_fields(self) if hasattr(paginator, 'required_fields') else []
+        queryset = queryset.values(*mapper.columns, *(f for f in extra if f not in mapper.columns))
+        page = self.paginate_queryset(queryset)
+        try:
+            data = [mapper(row) for row in (page if page is not None else queryset)]
+        except UnsafeValue:
+            return super().list(request, *args, **kwargs)
+
+        response = self.get_paginated_response(data) if page is not None else Response(data)
+        response.fast_json = True
+        return response
@@ -0,0 +1,29 @@
+import re
+
+
+HLA_FIELDS = ['HLA_A_1', 'HLA_A_2', 'HLA_B_1', 'HLA_B_2', 'HLA_DR_1', 'HLA_DR_2']
+HLA_CODE_FIELDS = [f"{field}_code" for field in HLA_FIELDS]
+
+# HLA_A_1 → A, HLA_DR_2 → DR
+HLA_LOCI = {field: field.split('_')[1] for field in HLA_FIELDS}
+
+# الـ locus (DRB1 و DR نفس الـ locus) و بعدين الـ field الأول من الـ allele
+_ALLELE_RE = re.compile(r'^(?:HLA-)?(?:DRB1|DR|A|B)?\*?(?P<digits>\d+)(?P<separator>:)?')
+
+
+def normalize_allele(value, locus):
+    # "A2", "a*02", "HLA-A*02:01", "A*0201" → "A2" و "DR15", "DRB1*15:01", "DRB1*1501" → "DR15"
+    # (بنقارن على مستوى الـ antigen: الـ field الأول بس)
+    if value is None:
+        return None
+    cleaned = str(value).strip().upper().replace(' ', '')
+    if not cleaned:
+        return None
+    match = _ALLELE_RE.match(cleaned)
+    if not match:
+        return cleaned
+    digits = match.group('digits')
+    if match.group('separator') is None and len(digits) >= 4:
+        # الكتابة القديمة من غير ':' (0201، 150101): أول رقمين هما الـ field الأول
+        digits = digits[:2]
+    return f"{locus}{int(digits)}"
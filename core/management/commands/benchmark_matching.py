@@ -0,0 +1,78 @@
+import hashlib
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from core.allocation import solve_assignment
+from core.matching import ABO_BITS, HLA_FIELDS, Population, plan_blocks, score_plan
+from core.models import OrganType
+
+
+def synthetic_population(size, rng, alleles=40):
+    organs = [organ.value for organ in OrganType]
+    return Population(
+        ids=np.arange(1, size + 1),
+        labels=[''] * size,
+        organs=list(rng.choice(organs, size)),
+        abo=list(rng.choice(list(ABO_BITS), size)),
+        bmi=list(np.round(rng.uniform(16, 40, size), 2)),
+        hla=rng.integers(0, alleles, (size, len(HLA_FIELDS)), dtype=np.int32),
+    )
+
+
+class Command(BaseCommand):
+    help = "Time the matching engine and the allocation solver on an in-memory synthetic registry"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=20000)
+        parser.add_argument('--donors', type=int, default=20000)
+        parser.add_argument('--workers', default='1,2,4', help="Comma separated worker counts")
+        parser.add_argument('--top-k', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--allocation', type=int, default=5000, help="Patients/donors in the allocation benchmark (0 = skip)")
+        parser.add_argument('--allocation-degree', type=int, default=20, help="Candidate donors per patient")
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        patients = synthetic_population(options['patients'], rng)
+        donors = synthetic_population(options['donors'], rng)
+        plan = plan_blocks(patients, donors)
+
+        baseline = baseline_digest = None
+        for workers in [int(w) for w in options['workers'].split(',')]:
+            started = time.perf_counter()
+            pairs = kept = 0
+            # النتايج لازم تطلع هي هي مهما كان عدد الـ workers
+            digest = hashlib.blake2b(digest_size=16)
+            for _, _, result in score_plan(patients, donors, plan, options['top_k'], 0, workers):
+                pairs += result.pairs_scored
+                kept += len(result.columns)
+                for array in (result.offsets, result.columns, result.scores, result.mismatches):
+                    digest.update(np.ascontiguousarray(array).tobytes())
+            elapsed = time.perf_counter() - started
+            baseline = baseline or elapsed
+            baseline_digest = baseline_digest or digest.hexdigest()
+            self.stdout.write(
+                f"workers={workers} pairs={pairs} kept={kept} time={elapsed:.2f}s "
+                f"pairs/sec={pairs / elapsed:,.0f} speedup={baseline / elapsed:.2f}x "
+                f"same_result={digest.hexdigest() == baseline_digest}"
+            )
+
+        if options['allocation']:
+            self.benchmark_allocation(rng, options['allocation'], options['allocation_degree'])
+
+    def benchmark_allocation(self, rng, size, degree):
+        patient_idx = np.repeat(np.arange(size), degree)
+        donor_idx = rng.integers(0, size, size * degree)
+        # نشيل الـ edges المكررة
+        edges = np.unique(np.stack([patient_idx, donor_idx], axis=1), axis=0)
+        weights = rng.integers(10, 100, len(edges)) * rng.uniform(1, 2, len(edges))
+
+        started = time.perf_counter()
+        chosen, components = solve_assignment(edges[:, 0], edges[:, 1], weights, size, size)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"allocation patients={size} donors={size} candidates={len(edges)} components={components} "
+            f"assigned={len(chosen)} total_weight={weights[chosen].sum():,.1f} time={elapsed:.2f}s"
+        )
@@ -0,0 +1,231 @@
+import json
+import time
+import tracemalloc
+from io import StringIO
+
+from django.core.management import call_command
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import F
+from django.test import Client
+from rest_framework.test import APIRequestFactory
+
+from core.matching import start_auto_match
+from core.fastpath import FastListMixin
+from core.models import User, OrganMatching
+from core.score_cache import score_cache
+from core.simulation import LatencyTracker, simulate_donor
+from core.snapshot import RegistrySnapshot, patient_snapshot
+from core.views import PatientPriorityViewSet
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(run, trace_memory=True):
+    counter = QueryCounter()
+    started = time.perf_counter()
+    with connection.execute_wrapper(counter):
+        value = run()
+    result = {'seconds': round(time.perf_counter() - started, 3), 'queries': counter.count}
+
+    if trace_memory:
+        # tracemalloc بيبطّأ الكود 4-5 مرات، فالـ peak memory بيتقاس في run تانية لوحدها
+        tracemalloc.start()
+        try:
+            run()
+            result['peak_memory_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        finally:
+            tracemalloc.stop()
+    return value, result
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic registries of growing size in a throw-away test database and time "
+        "the registry snapshot, calculate_match, auto_match and calculate_priority on each"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000', help="Comma separated registry sizes (users)")
+        parser.add_argument('--sample-pairs', type=int, default=100000,
+                            help="Pairs scored one by one with OrganMatching.calculate_match")
+        parser.add_argument('--top-k', type=int, default=10, help="top_k used for auto_match (0 = keep everything)")
+        parser.add_argument('--simulations', type=int, default=200, help="What-if donors per size for the p99 latency")
+        parser.add_argument('--list-requests', type=int, default=200,
+                            help="GETs per list endpoint, with and without the fast path")
+        parser.add_argument('--skip-memory', action='store_true', help="Don't re-run each benchmark under tracemalloc")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        self.trace_memory = not options['skip_memory']
+        # نفس اللي الـ test runner بيعمله: database مؤقتة عشان منلمسش الداتا الحقيقية
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = []
+            for size in sizes:
+                # الـ registry بيكبر تدريجيًا بدل ما يتولد من الأول لكل size
+                missing = size - User.objects.count()
+                if missing > 0:
+                    call_command('generate_registry', users=missing, seed=options['seed'] + size, stdout=StringIO())
+                results += [
+                    self.benchmark_snapshot_build(size),
+                    self.benchmark_orm_load(size),
+                    self.benchmark_calculate_match(size, options['sample_pairs']),
+                    self.benchmark_auto_match(size, options['top_k']),
+                    self.benchmark_auto_match_warm(size, options['top_k']),
+                    self.benchmark_calculate_priority(size),
+                    self.benchmark_simulate(size, options['simulations']),
+                    *self.benchmark_list_endpoints(size, options['list_requests']),
+                ]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+    def report(self, result):
+        rate_key = next(key for key in result if key.endswith('_per_sec'))
+        unit = rate_key.replace('_per_sec', '/sec')
+        self.stdout.write(
+            f"users={result['users']:<7} {result['benchmark']:<34} time={result['seconds']:.2f}s "
+            f"{unit}={result[rate_key]:,.0f} queries={result['queries']}"
+            + (f" p99={result['p99_ms']}ms" if 'p99_ms' in result else '')
+            + (f" peak_memory={result['peak_memory_mb']}MB" if 'peak_memory_mb' in result else '')
+        )
+        return result
+
+    def benchmark_snapshot_build(self, size):
+        # الـ columnar snapshot (values_list واحدة لكل role) ...
+        def build():
+            snapshots = [RegistrySnapshot('patient'), RegistrySnapshot('donor')]
+            for snapshot in snapshots:
+                snapshot.build()
+            return snapshots
+
+        snapshots, result = measure(build, self.trace_memory)
+        result.update(users=size, benchmark='snapshot build')
+        result['rows'] = sum(len(snapshot.population) for snapshot in snapshots)
+        result['rows_per_sec'] = round(result['rows'] / max(result['seconds'], 1e-9))
+        return self.report(result)
+
+    def benchmark_orm_load(self, size):
+        # ... مقارنة بتحميل نفس الـ users كـ model instances زي ما الكود القديم كان بيعمل
+        def load():
+            return list(
+                User.objects.filter(role__in=['patient', 'donor'])
+                .select_related('patient_profile', 'donor_profile')
+            )
+
+        users, result = measure(load, self.trace_memory)
+        result.update(users=size, benchmark='ORM load')
+        result['rows'] = len(users)
+        result['rows_per_sec'] = round(result['rows'] / max(result['seconds'], 1e-9))
+        return self.report(result)
+
+    def benchmark_calculate_match(self, size, sample_pairs):
+        # عينة من المرضى والمتبرعين: كل الأزواج على 100k user مستحيل تتحسب واحد واحد
+        side = max(1, int(sample_pairs ** 0.5))
+        patients = list(User.objects.filter(role='patient', status='approved')[:side])
+        donors = list(User.objects.filter(role='donor', status='approved')[:side])
+
+        def run():
+            for patient in patients:
+                for donor in donors:
+                    OrganMatching.calculate_match(patient, donor)
+
+        _, result = measure(run, self.trace_memory)
+        result.update(users=size, benchmark='calculate_match')
+        result['pairs'] = len(patients) * len(donors)
+        result['pairs_per_sec'] = round(result['pairs'] / max(result['seconds'], 1e-9))
+        return self.report(result)
+
+    def benchmark_auto_match(self, size, top_k):
+        def cold():
+            score_cache.clear()
+            return start_auto_match(top_k=top_k).run()
+
+        stats, result = measure(cold, self.trace_memory)
+        result.update(users=size, benchmark='auto_match', **stats)
+        result['pairs_per_sec'] = round(stats['pairs_scored'] / max(result['seconds'], 1e-9))
+        return self.report(result)
+
+    def benchmark_auto_match_warm(self, size, top_k):
+        # نفس الـ run تاني على registry متغيرش: كل الصفوف من الـ score cache
+        stats, result = measure(lambda: start_auto_match(top_k=top_k).run(), self.trace_memory)
+        result.update(users=size, benchmark='auto_match (warm)', **stats)
+        result['pairs_per_sec'] = round(stats['candidate_pairs'] / max(result['seconds'], 1e-9))
+        return self.report(result)
+
+    def benchmark_calculate_priority(self, size):
+        view = PatientPriorityViewSet.as_view({'post': 'calculate_priority'})
+        factory = APIRequestFactory()
+        response, result = measure(
+            lambda: view(factory.post('/api/patient-priority/calculate_priority/')), self.trace_memory
+        )
+        result.update(users=size, benchmark='calculate_priority')
+        result['patients'] = len(response.data)
+        result['patients_per_sec'] = round(result['patients'] / max(result['seconds'], 1e-9))
+        return self.report(result)
+
+    def benchmark_simulate(self, size, count):
+        # متبرعين افتراضيين بنفس توزيع المتبرعين اللي في الـ registry
+        donors = list(
+            User.objects.filter(role='donor')
+            .values('HLA_A_1', 'HLA_A_2', 'HLA_B_1', 'HLA_B_2', 'HLA_DR_1', 'HLA_DR_2', 'blood_type', 'bmi',
+                    organ=F('donor_profile__organ_available'))[:count]
+        )
+        started = time.perf_counter()
+        patient_snapshot.get()
+        build_seconds = time.perf_counter() - started
+        latency = LatencyTracker(window=len(donors) or 1)
+
+        def run():
+            for donor in donors:
+                started = time.perf_counter()
+                simulate_donor({**donor, 'top': 20})
+                latency.record((time.perf_counter() - started) * 1000)
+
+        _, result = measure(run, self.trace_memory)
+        summary = latency.summary()
+        result.update(users=size, benchmark='simulate', requests=len(donors))
+        result['requests_per_sec'] = round(len(donors) / max(result['seconds'], 1e-9))
+        result.update(p50_ms=summary.get('p50'), p99_ms=summary.get('p99'),
+                      snapshot_build_seconds=round(build_seconds, 3))
+        return self.report(result)
+
+    def benchmark_list_endpoints(self, size, count):
+        # نفس الصفحة بالـ serializers وبالـ fast path (values() + orjson)، والـ bytes لازم تبقى هي هي
+        client = Client()
+        results = []
+        for url in ('/api/users/', '/api/alerts/', '/api/vital-signs/', '/api/organ-matching/'):
+            for fast in (False, True):
+                FastListMixin.fast_path = fast
+                try:
+                    content = client.get(url).content
+
+                    def run():
+                        for _ in range(count):
+                            client.get(url)
+
+                    _, result = measure(run, self.trace_memory)
+                finally:
+                    FastListMixin.fast_path = settings.API_FAST_PATH
+                if fast and content != baseline:
+                    raise CommandError(f"{url}: fast path output differs from the serializer output")
+                baseline = content
+                result.update(users=size, benchmark=f"{url} ({'fast' if fast else 'serializer'})", requests=count)
+                result['requests_per_sec'] = round(count / max(result['seconds'], 1e-9))
+                results.append(self.report(result))
+        return results
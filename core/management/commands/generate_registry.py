@@ -0,0 +1,287 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from faker import Faker
+
+from core.hla import HLA_FIELDS, HLA_LOCI
+from core.rollups import rebuild_hospital_stats
+from core.versions import bump
+from core.models import (
+    User, HLAAllele, OrganType, Hospital, Doctor, ChronicDisease, UserChronicDisease,
+    PatientMedicalProfile, DonorMedicalProfile, OrganMatching, Surgery, SurgeryReport, VitalSign,
+)
+
+# عدد الـ antigens لكل locus (تقريبًا زي الـ serology tables)
+LOCUS_SIZES = {'A': 30, 'B': 60, 'DR': 18}
+BLOOD_TYPES = [code for code, _ in User.BLOOD_TYPE_CHOICES]
+BLOOD_TYPE_WEIGHTS = [30, 4, 15, 2, 35, 5, 8, 1]
+DISEASES = [
+    'Diabetes', 'Hypertension', 'Asthma', 'Chronic Kidney Disease', 'Heart Failure',
+    'Hepatitis C', 'Hepatitis B', 'COPD', 'Lupus', 'Rheumatoid Arthritis',
+]
+
+
+def bulk_insert(model, objects, batch_size, key):
+    # key: الحقول (attnames) اللي بتميز كل صف اتولد هنا، unique في الـ table
+    created = model.objects.bulk_create(objects, batch_size=batch_size)
+    if created and created[0].pk is None:
+        # MySQL مش بيرجع الـ ids من bulk insert: بنجيبها بالـ key، مش "آخر N ids"
+        # (process تاني ممكن يكون كتب في نفس الوقت، والترتيب مش مضمون)
+        for start in range(0, len(created), batch_size):
+            chunk = created[start:start + batch_size]
+            rows = model.objects.filter(
+                **{f"{key[0]}__in": {getattr(obj, key[0]) for obj in chunk}}
+            ).values_list('pk', *key)
+            ids = {tuple(row[1:]): row[0] for row in rows}
+            for obj in chunk:
+                obj.pk = ids[tuple(getattr(obj, field) for field in key)]
+    return created
+
+
+def skewed_choice(rng, size):
+    # الـ antigens الشائعة بتتكرر أكتر (zipf تقريبًا) عشان يبقى فيه matches حقيقية
+    return int(size * rng.random() ** 2.5) + 1
+
+
+class Command(BaseCommand):
+    help = "Fill the database with a synthetic registry (users, HLA typings, profiles, hospitals, vitals...)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--donor-ratio', type=float, default=0.5)
+        parser.add_argument('--approved-ratio', type=float, default=0.8)
+        parser.add_argument('--hospitals', type=int, default=None, help="Default: one per 500 users")
+        parser.add_argument('--doctors-per-hospital', type=int, default=5)
+        parser.add_argument('--surgeries', type=int, default=None, help="Default: one per 100 users")
+        parser.add_argument('--vitals-per-surgery', type=int, default=10)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        self.rng = random.Random(options['seed'])
+        self.fake = Faker()
+        self.fake.seed_instance(options['seed'])
+        self.batch_size = options['batch_size']
+
+        size = options['users']
+        hospitals = options['hospitals'] if options['hospitals'] is not None else max(1, size // 500)
+        surgeries = options['surgeries'] if options['surgeries'] is not None else size // 100
+
+        with transaction.atomic():
+            hospital_objs = self.create_hospitals(hospitals)
+            doctor_objs = self.create_doctors(hospital_objs, options['doctors_per_hospital'])
+            diseases = self.create_diseases()
+            patients, donors = self.create_users(
+                size, options['donor_ratio'], options['approved_ratio'], hospital_objs
+            )
+            self.create_chronic_diseases(patients + donors, diseases)
+            surgeries, vitals = self.create_surgeries(patients, donors, hospital_objs, surgeries,
+                                                      options['vitals_per_surgery'])
+            # bulk_create مش بيبعت post_save، فالـ ETags لازم تتغير هنا
+            bump(Hospital, Doctor, ChronicDisease, User, UserChronicDisease, PatientMedicalProfile,
+                 DonorMedicalProfile, OrganMatching, Surgery, SurgeryReport, VitalSign)
+            rebuild_hospital_stats()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"patients={len(patients)} donors={len(donors)} hospitals={len(hospital_objs)} "
+            f"doctors={len(doctor_objs)} surgeries={surgeries} vitals={vitals} "
+            f"time={time.perf_counter() - started:.2f}s"
+        ))
+
+    # ==========================
+    # Hospitals & doctors
+    # ==========================
+    def create_hospitals(self, count):
+        offset = (Hospital.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        password = make_password(None)
+        return bulk_insert(Hospital, [
+            Hospital(
+                name=f"{self.fake.last_name()} Hospital",
+                city=self.fake.city(),
+                location=self.fake.street_address(),
+                license_number=f"LIC-{offset + i:06d}",
+                phone=self.fake.numerify('02########'),
+                emergency_phone=self.fake.numerify('1##'),
+                email=f"hospital{offset + i}@registry.example.com",
+                working_hours='24/7',
+                hospital_type=self.rng.choice(['public', 'private']),
+                password=password,
+            )
+            for i in range(count)
+        ], self.batch_size, key=['email'])
+
+    def create_doctors(self, hospitals, per_hospital):
+        specialties = ['Nephrology', 'Hepatology', 'Cardiology', 'Transplant Surgery', 'Pulmonology']
+        # المستشفيات لسه متعملة فكل الدكاترة فيها بتوعنا؛ الرقم بيميز الدكتور جوه المستشفى
+        doctors = bulk_insert(Doctor, [
+            Doctor(
+                name=self.fake.name(),
+                specialty=self.rng.choice(specialties),
+                hospital=hospital,
+                phone=f"01{i:09d}",
+            )
+            for hospital in hospitals
+            for i in range(per_hospital)
+        ], self.batch_size, key=['hospital_id', 'phone'])
+        self.doctors_by_hospital = {}
+        for doctor in doctors:
+            self.doctors_by_hospital.setdefault(doctor.hospital_id, []).append(doctor)
+        return doctors
+
+    def doctor_for(self, hospital):
+        doctors = self.doctors_by_hospital.get(hospital.pk)
+        return self.rng.choice(doctors) if doctors else None
+
+    def create_diseases(self):
+        existing = {disease.name: disease for disease in ChronicDisease.objects.filter(name__in=DISEASES)}
+        missing = [ChronicDisease(name=name) for name in DISEASES if name not in existing]
+        return list(existing.values()) + bulk_insert(ChronicDisease, missing, self.batch_size, key=['name'])
+
+    # ==========================
+    # Users & profiles
+    # ==========================
+    def hla_typing(self):
+        # كل مستخدم ليه antigens بالشكل العادي "A2" والـ code بتاعه من HLAAllele
+        typing = {}
+        for field in HLA_FIELDS:
+            locus = HLA_LOCI[field]
+            value = f"{locus}{skewed_choice(self.rng, LOCUS_SIZES[locus])}"
+            typing[field] = value
+            typing[f"{field}_code"] = HLAAllele.intern(value, locus)
+        return typing
+
+    def create_users(self, size, donor_ratio, approved_ratio, hospitals):
+        offset = (User.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        password = make_password(None)
+        organs = [organ.value for organ in OrganType]
+        patients, donors = [], []
+        self.organ_for = {}
+
+        for start in range(0, size, self.batch_size):
+            users, organs_for = [], []
+            for i in range(start, min(start + self.batch_size, size)):
+                role = 'donor' if self.rng.random() < donor_ratio else 'patient'
+                height = round(self.rng.gauss(168, 9), 1)
+                weight = round(self.rng.gauss(75, 15), 1)
+                hospital = self.rng.choice(hospitals)
+                users.append(User(
+                    # الأرقام القومية الحقيقية بتبدأ بـ 2 أو 3 فمفيش تعارض
+                    national_id=f"9{offset + i:013d}",
+                    first_name=self.fake.first_name(),
+                    last_name=self.fake.last_name(),
+                    phone=self.fake.numerify('01#########'),
+                    role=role,
+                    status='approved' if self.rng.random() < approved_ratio else self.rng.choice(
+                        ['pending', 'under_review', 'rejected']),
+                    birthdate=self.fake.date_of_birth(minimum_age=18, maximum_age=70),
+                    height_cm=height,
+                    weight_kg=weight,
+                    # bulk_create مش بيعدي على save فبنحسب الـ BMI هنا
+                    bmi=round(weight / (height / 100) ** 2, 2),
+                    blood_type=self.rng.choices(BLOOD_TYPES, BLOOD_TYPE_WEIGHTS)[0],
+                    gender=self.rng.choice(['male', 'female']),
+                    medical_record_number=f"MRN-{offset + i:08d}",
+                    PRA=round(self.rng.uniform(0, 100), 1),
+                    CMV_status=self.rng.random() < 0.6,
+                    EBV_status=self.rng.random() < 0.9,
+                    hospital=hospital,
+                    supervisor_doctor=self.doctor_for(hospital),
+                    password=password,
+                    **self.hla_typing(),
+                ))
+                organs_for.append(self.rng.choice(organs))
+
+            users = bulk_insert(User, users, self.batch_size, key=['national_id'])
+            patient_profiles, donor_profiles = [], []
+            for user, organ in zip(users, organs_for):
+                self.organ_for[user.pk] = organ
+                if user.role == 'patient':
+                    patients.append(user)
+                    patient_profiles.append(PatientMedicalProfile(patient=user, organ_needed=organ))
+                else:
+                    donors.append(user)
+                    donor_profiles.append(DonorMedicalProfile(donor=user, organ_available=organ))
+            PatientMedicalProfile.objects.bulk_create(patient_profiles, batch_size=self.batch_size)
+            DonorMedicalProfile.objects.bulk_create(donor_profiles, batch_size=self.batch_size)
+
+        return patients, donors
+
+    def create_chronic_diseases(self, users, diseases):
+        rows = []
+        for user in users:
+            for disease in self.rng.sample(diseases, self.rng.choice([0, 0, 0, 1, 1, 2, 3])):
+                rows.append(UserChronicDisease(
+                    user=user, disease=disease, severity=self.rng.choice(['low', 'medium', 'high'])
+                ))
+        UserChronicDisease.objects.bulk_create(rows, batch_size=self.batch_size)
+
+    # ==========================
+    # Surgeries & vitals
+    # ==========================
+    def create_surgeries(self, patients, donors, hospitals, count, vitals_per_surgery):
+        # كل مريض مع متبرع بنفس العضو اللي محتاجه
+        donors_by_organ = {}
+        for donor in self.rng.sample(donors, len(donors)):
+            donors_by_organ.setdefault(self.organ_for[donor.pk], []).append(donor)
+        pairs = []
+        for patient in self.rng.sample(patients, len(patients)):
+            if len(pairs) >= count:
+                break
+            candidates = donors_by_organ.get(self.organ_for[patient.pk])
+            if candidates:
+                pairs.append((patient, candidates.pop()))
+        if not pairs:
+            return 0, 0
+        matches = bulk_insert(OrganMatching, [
+            OrganMatching(
+                patient=patient, donor=donor, organ_type=self.organ_for[patient.pk],
+                match_percentage=self.rng.choice([60, 70, 80, 90, 100]), status='matched',
+            )
+            for patient, donor in pairs
+        ], self.batch_size, key=['patient_id', 'donor_id', 'organ_type'])
+
+        offset = (Surgery.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        now = timezone.now()
+        surgeries = bulk_insert(Surgery, [
+            Surgery(
+                surgery_number=f"SYN-{offset + i:08d}",
+                organ_matching=match,
+                hospital=hospital,
+                doctor=self.doctor_for(hospital),
+                scheduled_date=now - timedelta(days=self.rng.randint(1, 365)),
+                completed=True,
+                duration_minutes=self.rng.randint(120, 480),
+                operation_room=f"OR-{self.rng.randint(1, 12)}",
+            )
+            for i, (match, hospital) in enumerate((m, self.rng.choice(hospitals)) for m in matches)
+        ], self.batch_size, key=['surgery_number'])
+
+        reports = bulk_insert(SurgeryReport, [
+            SurgeryReport(surgery=surgery, result_summary='Synthetic surgery report', **self.vitals())
+            for surgery in surgeries
+        ], self.batch_size, key=['surgery_id'])
+
+        vitals = [
+            VitalSign(surgery_report=report, **self.vitals())
+            for report in reports
+            for _ in range(vitals_per_surgery)
+        ]
+        VitalSign.objects.bulk_create(vitals, batch_size=self.batch_size)
+        return len(surgeries), len(vitals)
+
+    def vitals(self):
+        return {
+            'temperature_c': round(self.rng.gauss(37, 0.6), 1),
+            'heart_rate': max(30, int(self.rng.gauss(80, 15))),
+            'blood_pressure_systolic': max(60, int(self.rng.gauss(125, 18))),
+            'blood_pressure_diastolic': max(40, int(self.rng.gauss(80, 10))),
+            'respiratory_rate': max(8, int(self.rng.gauss(16, 3))),
+            'oxygen_saturation': round(min(100.0, self.rng.gauss(96, 2.5)), 1),
+        }
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.matching import claim_next_job, run_job
+
+
+class Command(BaseCommand):
+    help = "Run queued auto_match jobs from the MatchingJob table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Run the queued jobs and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f"Running matching job {job.id}")
+            job = run_job(job)
+            self.stdout.write(f"Matching job {job.id} {job.status} in {job.duration_seconds}s")
@@ -0,0 +1,625 @@
+import hashlib
+import logging
+from datetime import timedelta
+from functools import cached_property
+
+import numpy as np
+from django.conf import settings
+from django.db import IntegrityError, connections, models, router, transaction
+from django.utils import timezone
+
+from .hla import HLA_FIELDS, HLA_CODE_FIELDS
+from .models import User, OrganMatching, MatchingJob
+from .parallel import score_blocks_parallel
+from .score_cache import score_cache
+from .scoring import SCORING_VERSION, score_and_select
+from .versions import bump
+
+
+logger = logging.getLogger(__name__)
+
+# ABO groups as bits, and for each recipient group the mask of donor groups it can receive from.
+# Rh is ignored for solid organs; an unknown group is never pruned.
+ABO_BITS = {'O': 1, 'A': 2, 'B': 4, 'AB': 8}
+ABO_RECEIVES_FROM = {'O': 1, 'A': 1 | 2, 'B': 1 | 4, 'AB': 1 | 2 | 4 | 8}
+ALL_ABO = 1 | 2 | 4 | 8
+
+# عدد المرضى اللي بيتحسبوا مع كل المتبرعين في خطوة واحدة
+# (patients x donors x 6 booleans per block, so keep it bounded)
+PATIENT_BLOCK_SIZE = 512
+
+
+# ==================================================
+# Population (column arrays for patients or donors)
+# ==================================================
+class MatchingRecord:
+    # صف واحد من الـ population، بنفس أسماء User اللي calculate_match محتاجها
+    __slots__ = ('pk', 'role', 'label', 'organ', 'abo', 'bmi', 'hla_codes', 'matching_revision')
+
+    def __init__(self, pk, role, label, organ, abo, bmi, hla_codes, matching_revision):
+        self.pk = pk
+        self.role = role
+        self.label = label
+        self.organ = organ
+        self.abo = abo
+        self.bmi = bmi
+        self.hla_codes = hla_codes
+        self.matching_revision = matching_revision
+
+    def is_donor_medically_eligible(self):
+        if self.role != 'donor' or self.bmi is None:
+            return True
+        return 18.5 <= self.bmi <= 35
+
+    def __str__(self):
+        return self.label
+
+
+class Population:
+    def __init__(self, ids, labels, organs, abo, bmi, hla, revisions=None, approved=None, role=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.role = role
+        self.labels = labels
+        self.organs = organs
+        self.abo = abo
+        # NaN = BMI مش معروف
+        if isinstance(bmi, np.ndarray):
+            self.bmi = bmi.astype(np.float64, copy=False)
+        else:
+            self.bmi = np.array([np.nan if b is None else b for b in bmi], dtype=np.float64)
+        # HLAAllele codes, 0 = missing typing
+        self.hla = np.asarray(hla, dtype=np.int32).reshape(len(self.ids), len(HLA_FIELDS))
+        # User.matching_revision (مفتاح الـ score cache)
+        if revisions is None:
+            revisions = np.zeros(len(self.ids), dtype=np.int64)
+        self.revisions = np.asarray(revisions, dtype=np.int64)
+        if approved is None:
+            approved = np.ones(len(self.ids), dtype=bool)
+        self.approved = np.asarray(approved, dtype=bool)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def take(self, indexes):
+        indexes = np.asarray(indexes, dtype=np.int64)
+
+        def pick(values):
+            return [values[i] for i in indexes]
+
+        return Population(
+            self.ids[indexes], pick(self.labels), pick(self.organs), pick(self.abo), self.bmi[indexes],
+            self.hla[indexes], self.revisions[indexes], self.approved[indexes], self.role,
+        )
+
+    def merge(self, other):
+        # الترتيب بيفضل بالـ id زي load_population
+        merged = Population(
+            np.concatenate([self.ids, other.ids]),
+            self.labels + other.labels,
+            self.organs + other.organs,
+            self.abo + other.abo,
+            np.concatenate([self.bmi, other.bmi]),
+            np.concatenate([self.hla, other.hla]),
+            np.concatenate([self.revisions, other.revisions]),
+            np.concatenate([self.approved, other.approved]),
+            self.role,
+        )
+        return merged.take(np.argsort(merged.ids, kind='stable'))
+
+    @cached_property
+    def approved_population(self):
+        return self if self.approved.all() else self.take(np.flatnonzero(self.approved))
+
+    @cached_property
+    def buckets(self):
+        return build_buckets(self)
+
+    @cached_property
+    def eligible(self):
+        # نفس شرط User.is_donor_medically_eligible
+        return np.isnan(self.bmi) | ((self.bmi >= 18.5) & (self.bmi <= 35))
+
+    def bmi_value(self, i):
+        return None if np.isnan(self.bmi[i]) else float(self.bmi[i])
+
+    def index_of(self, user_id):
+        i = int(np.searchsorted(self.ids, user_id))
+        return i if i < len(self.ids) and self.ids[i] == user_id else None
+
+    def record(self, i):
+        return MatchingRecord(
+            int(self.ids[i]), self.role, self.labels[i], self.organs[i], self.abo[i], self.bmi_value(i),
+            tuple(self.hla[i].tolist()), int(self.revisions[i]),
+        )
+
+
+def load_population(role, ids=None, approved_only=True):
+    # query واحدة (values_list) بالحقول اللي الـ matching محتاجها بس
+    organ_field = 'patient_profile__organ_needed' if role == 'patient' else 'donor_profile__organ_available'
+    queryset = User.objects.filter(role=role)
+    if approved_only:
+        queryset = queryset.filter(status='approved')
+    if ids is not None:
+        queryset = queryset.filter(id__in=ids)
+    rows = (
+        queryset
+        .order_by('id')
+        .values_list(
+            'id', 'first_name', 'last_name', 'role', 'bmi', organ_field, 'blood_type', 'matching_revision',
+            'status', *HLA_CODE_FIELDS
+        )
+    )
+
+    ids, labels, organs, abo, bmi, hla, revisions, approved = [], [], [], [], [], [], [], []
+    for row in rows:
+        ids.append(row[0])
+        labels.append(f"{row[1]} {row[2]} ({row[3]})")
+        bmi.append(row[4])
+        organs.append(row[5])
+        abo.append(abo_group(row[6]))
+        revisions.append(row[7])
+        approved.append(row[8] == 'approved')
+        hla.append([code or 0 for code in row[9:]])
+    return Population(ids, labels, organs, abo, bmi, hla, revisions, approved, role)
+
+
+def abo_group(blood_type):
+    if not blood_type:
+        return None
+    return blood_type.rstrip('+-')
+
+
+# ==================================================
+# Blocking (organ + ABO buckets)
+# ==================================================
+def build_buckets(population):
+    buckets = {}
+    for i, (organ, abo) in enumerate(zip(population.organs, population.abo)):
+        buckets.setdefault((organ, abo), []).append(i)
+    return {key: np.asarray(indexes, dtype=np.int64) for key, indexes in buckets.items()}
+
+
+def compatible_donors(donor_buckets, organ, abo):
+    mask = ABO_RECEIVES_FROM.get(abo, ALL_ABO)
+    indexes = [
+        donor_buckets[(organ, group)]
+        for group, bit in ABO_BITS.items()
+        if mask & bit and (organ, group) in donor_buckets
+    ]
+    if (organ, None) in donor_buckets:
+        indexes.append(donor_buckets[(organ, None)])
+    if not indexes:
+        return np.empty(0, dtype=np.int64)
+    return np.sort(np.concatenate(indexes))
+
+
+def plan_blocks(patients, donors):
+    # كل bucket مرضى بيتقارن بس مع المتبرعين اللي يقدر ياخد منهم
+    donor_buckets = build_buckets(donors)
+    plan = []
+    for (organ, abo), patient_idx in sorted(build_buckets(patients).items(), key=lambda item: item[1][0]):
+        if organ is None:
+            continue
+        donor_idx = compatible_donors(donor_buckets, organ, abo)
+        if len(donor_idx):
+            plan.append((patient_idx, donor_idx))
+    return plan
+
+
+def pruning_stats(patients, donors, plan):
+    total_pairs = len(patients) * len(donors)
+    candidate_pairs = sum(len(p) * len(d) for p, d in plan)
+    return {
+        "total_pairs": total_pairs,
+        "candidate_pairs": candidate_pairs,
+        "pruning_ratio": round(1 - candidate_pairs / total_pairs, 4) if total_pairs else 0.0,
+    }
+
+
+def plan_to_blocks(plan, block_size=PATIENT_BLOCK_SIZE):
+    return [
+        (patient_idx[start:start + block_size], donor_idx)
+        for patient_idx, donor_idx in plan
+        for start in range(0, len(patient_idx), block_size)
+    ]
+
+
+def score_plan(patients, donors, plan, top_k=0, min_score=0, workers=1):
+    blocks = plan_to_blocks(plan)
+    donor_eligible = donors.eligible
+    if workers > 1 and len(blocks) > 1:
+        results = score_blocks_parallel(patients.hla, donors.hla, donor_eligible, blocks, workers, top_k, min_score)
+    else:
+        results = (
+            score_and_select(patients.hla[p], donors.hla[d], donor_eligible[d], top_k, min_score)
+            for p, d in blocks
+        )
+    for (patient_idx, donor_idx), result in zip(blocks, results):
+        yield patient_idx, donor_idx, result
+
+
+# ==================================================
+# Pruning stale matches
+# ==================================================
+def prune_matches(patient_ids, top_k=0, min_score=0, chunk_size=500):
+    # بنمسح بس الـ pending اللي ملهاش surgery
+    deleted = 0
+    patient_ids = [int(pk) for pk in patient_ids]
+    for start in range(0, len(patient_ids), chunk_size):
+        rows = (
+            OrganMatching.objects
+            .filter(patient_id__in=patient_ids[start:start + chunk_size], status='pending', surgery__isnull=True)
+            .order_by('patient_id', '-match_percentage', 'donor_id')
+            .values_list('id', 'patient_id', 'match_percentage')
+        )
+        stale, kept = [], {}
+        for match_id, patient_id, score in rows:
+            if score < min_score or (top_k and kept.get(patient_id, 0) >= top_k):
+                stale.append(match_id)
+            else:
+                kept[patient_id] = kept.get(patient_id, 0) + 1
+        for i in range(0, len(stale), chunk_size):
+            deleted += OrganMatching.objects.filter(id__in=stale[i:i + chunk_size]).delete()[0]
+    return deleted
+
+
+# ==================================================
+# Persistence (chunked bulk upsert)
+# ==================================================
+class MatchWriter:
+    update_fields = [
+        'match_percentage', 'ai_result', 'status',
+        'hla_mismatch_count', 'hla_a_mismatches', 'hla_b_mismatches', 'hla_dr_mismatches',
+    ]
+    unique_fields = ['patient', 'donor', 'organ_type']
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or settings.MATCHING_BULK_BATCH_SIZE
+        self.pending = []
+        self.written = 0
+
+    def add(self, match):
+        self.pending.append(match)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        db = router.db_for_write(OrganMatching)
+        options = {"update_conflicts": True, "update_fields": self.update_fields}
+        # MySQL upserts on any unique key and rejects an explicit conflict target
+        if connections[db].features.supports_update_conflicts_with_target:
+            options["unique_fields"] = self.unique_fields
+        with transaction.atomic(using=db):
+            OrganMatching.objects.using(db).bulk_create(self.pending, **options)
+            # bulk_create مش بيبعت post_save
+            bump(OrganMatching)
+        self.written += len(self.pending)
+        self.pending = []
+
+
+# ==================================================
+# Auto match
+# ==================================================
+class MatchRun:
+    # بيطلع الـ matches واحد واحد وهو بيكتبها، فالـ caller يقدر يعمل stream أو يجمعها في list
+    def __init__(self, patients, donors, batch_size=None, progress=None, top_k=None, min_score=None, workers=None,
+                 track_keys=False):
+        self.patients = patients
+        self.donors = donors
+        self.progress = progress
+        self.top_k = settings.MATCHING_TOP_K if top_k is None else top_k
+        self.min_score = settings.MATCHING_MIN_SCORE if min_score is None else min_score
+        self.writer = MatchWriter(batch_size)
+        # (patient, donor, organ) لكل match طلع من الـ run (للـ rematch بس، عشان الـ memory)
+        self.kept_keys = set() if track_keys else None
+
+        self.plan = plan_blocks(patients, donors)
+        self.stats = pruning_stats(patients, donors, self.plan)
+        self.stats["pairs_scored"] = 0
+        # the process pool only pays off on big runs
+        workers = settings.MATCHING_WORKERS if workers is None else workers
+        self.workers = workers if self.stats["candidate_pairs"] >= settings.MATCHING_PARALLEL_MIN_PAIRS else 1
+        logger.info(
+            "matching: scoring %(candidate_pairs)s of %(total_pairs)s pairs (pruning ratio %(pruning_ratio)s)",
+            self.stats,
+        )
+
+    def row_keys(self, patient_idx, donor_idx):
+        # row cache: نتيجة مريض واحد قصاد كل المتبرعين المتوافقين معاه، بتفضل صالحة طول ما
+        # الـ revision بتاعه والـ (id, revision) بتوع المتبرعين دول متغيروش
+        donors, patients = self.donors, self.patients
+        digest = hashlib.blake2b(
+            donors.ids[donor_idx].tobytes() + donors.revisions[donor_idx].tobytes(), digest_size=16
+        ).hexdigest()
+        return [
+            ('row', int(patients.ids[p]), int(patients.revisions[p]), patients.organs[p], digest,
+             SCORING_VERSION, self.top_k, self.min_score)
+            for p in patient_idx
+        ]
+
+    def split_cached(self):
+        keys, cached, plan = {}, [], []
+        for patient_idx, donor_idx in self.plan:
+            if not score_cache.enabled:
+                plan.append((patient_idx, donor_idx))
+                continue
+            entry_keys = self.row_keys(patient_idx, donor_idx)
+            found = score_cache.get_many(entry_keys)
+            missing = []
+            for p, key in zip(patient_idx, entry_keys):
+                if key in found:
+                    cached.append((p, donor_idx, found[key]))
+                else:
+                    keys[p] = key
+                    missing.append(p)
+            if missing:
+                plan.append((np.asarray(missing, dtype=np.int64), donor_idx))
+        return keys, cached, plan
+
+    def emit(self, p, donor_idx, columns, scores, mismatches):
+        patients, donors, donor_eligible = self.patients, self.donors, self.donor_eligible
+        organ_type = patients.organs[p]
+        for column, score, (a, b, dr) in zip(columns.tolist(), scores.tolist(), mismatches.tolist()):
+            d = donor_idx[column]
+            if self.kept_keys is not None:
+                self.kept_keys.add((int(patients.ids[p]), int(donors.ids[d]), organ_type))
+            self.writer.add(OrganMatching(
+                patient_id=int(patients.ids[p]),
+                donor_id=int(donors.ids[d]),
+                organ_type=organ_type,
+                match_percentage=score,
+                hla_mismatch_count=a + b + dr,
+                hla_a_mismatches=a,
+                hla_b_mismatches=b,
+                hla_dr_mismatches=dr,
+                ai_result={
+                    "hla_mismatches": a + b + dr,
+                    "bmi": donors.bmi_value(d),
+                    "eligible": bool(donor_eligible[d]),
+                },
+                status='pending',
+            ))
+            yield {
+                "patient": patients.labels[p],
+                "donor": donors.labels[d],
+                "organ_type": organ_type,
+                "match_percentage": score
+            }
+
+    def __iter__(self):
+        patients, donors, stats, writer = self.patients, self.donors, self.stats, self.writer
+        self.donor_eligible = donors.eligible
+        keys, cached, plan = self.split_cached()
+
+        # الـ cache بيوفر الـ scoring بس: الصفوف بتتكتب زي أي row (ممكن تكون اتمسحت أو الـ status اتغير)
+        stats["rows_cached"] = len(cached)
+        for p, donor_idx, (columns, scores, mismatches) in cached:
+            yield from self.emit(p, donor_idx, columns, scores, mismatches)
+
+        scored_patients, new_rows = [], {}
+        blocks = score_plan(patients, donors, plan, self.top_k, self.min_score, self.workers)
+        for patient_idx, donor_idx, result in blocks:
+            scored_patients.extend(patients.ids[patient_idx])
+            for i, p in enumerate(patient_idx):
+                row = slice(result.offsets[i], result.offsets[i + 1])
+                columns, scores, mismatches = result.columns[row], result.scores[row], result.mismatches[row]
+                yield from self.emit(p, donor_idx, columns, scores, mismatches)
+                if p in keys:
+                    new_rows[keys[p]] = (columns.copy(), scores.copy(), mismatches.copy())
+            stats["pairs_scored"] += result.pairs_scored
+            if self.progress:
+                self.progress(stats["pairs_scored"], writer.written, stats["candidate_pairs"])
+        writer.flush()
+        stats["pairs_written"] = writer.written
+        stats["pairs_pruned"] = (
+            prune_matches(scored_patients, self.top_k, self.min_score) if self.top_k or self.min_score else 0
+        )
+        # الـ cache بيتملى بعد ما الكتابة تتأكد بس
+        transaction.on_commit(lambda: score_cache.put_many(new_rows))
+
+    def run(self):
+        for _ in self:
+            pass
+        return self.stats
+
+
+def registry_populations():
+    # approved patients / donors من الـ snapshot المشترك (fresh: بيتأكد من الـ watermark الأول)
+    from .snapshot import patient_snapshot, donor_snapshot  # لتجنب الاستدعاء الدائري
+    return patient_snapshot.approved(fresh=True), donor_snapshot.approved(fresh=True)
+
+
+def run_auto_match(batch_size=None, progress=None, top_k=None, min_score=None):
+    return match_populations(*registry_populations(), batch_size, progress, top_k, min_score)
+
+
+def start_auto_match(batch_size=None, progress=None, top_k=None, min_score=None):
+    return MatchRun(*registry_populations(), batch_size, progress, top_k, min_score)
+
+
+def match_populations(patients, donors, batch_size=None, progress=None, top_k=None, min_score=None):
+    run = MatchRun(patients, donors, batch_size, progress, top_k, min_score)
+    all_matches = list(run)
+    return all_matches, run.stats
+
+
+# ==================================================
+# Incremental re-matching
+# ==================================================
+def schedule_rematch(user_id):
+    # بيتنفذ مرة واحدة بعد الـ commit حتى لو الـ user اتحفظ كذا مرة؛ الـ callbacks المستنية بتتشال مع الـ rollback،
+    # فمفيش user بيفضل "scheduled" للأبد
+    if not settings.MATCHING_INCREMENTAL:
+        return
+    pending = transaction.get_connection().run_on_commit
+    if any(
+        getattr(callback, 'rematch_user_id', None) == user_id and not callback.done
+        for _, callback, *_ in pending
+    ):
+        return
+
+    def run():
+        run.done = True
+        rematch_user(user_id)
+
+    run.rematch_user_id, run.done = user_id, False
+    transaction.on_commit(run)
+
+
+def rematch_user(user_id, batch_size=None):
+    patients, donors = registry_populations()
+    if patients.index_of(user_id) is not None:
+        patients = patients.take([patients.index_of(user_id)])
+    elif donors.index_of(user_id) is not None:
+        donors = donors.take([donors.index_of(user_id)])
+    else:
+        # مبقاش approved (أو مبقاش patient / donor): مفيش candidates خالص
+        return {"pairs_written": 0, "pairs_pruned": prune_user_matches(user_id, set())}
+    run = MatchRun(patients, donors, batch_size, track_keys=True)
+    stats = run.run()
+    # الـ upsert مبيلمسش الـ pairs اللي خرجت من الـ candidates (ABO، organ اتغير، top-K...)
+    stats["pairs_pruned"] += prune_user_matches(user_id, run.kept_keys)
+    return stats
+
+
+def prune_user_matches(user_id, kept_keys, chunk_size=500):
+    # الـ pending matches بتاعة الـ user (مريض أو متبرع) اللي ملهاش surgery ومش في الـ run الجديد
+    rows = (
+        OrganMatching.objects
+        .filter(models.Q(patient_id=user_id) | models.Q(donor_id=user_id), status='pending', surgery__isnull=True)
+        .values_list('id', 'patient_id', 'donor_id', 'organ_type')
+    )
+    stale = [match_id for match_id, *key in rows if tuple(key) not in kept_keys]
+    deleted = 0
+    for start in range(0, len(stale), chunk_size):
+        deleted += OrganMatching.objects.filter(id__in=stale[start:start + chunk_size]).delete()[0]
+    return deleted
+
+
+# ==================================================
+# Background jobs
+# ==================================================
+AUTO_MATCH_LOCK = 'auto_match'
+
+
+def job_cutoff():
+    # running job آخر heartbeat ليها قبل كده يبقى الـ worker بتاعها مات
+    return timezone.now() - timedelta(seconds=settings.MATCHING_JOB_TIMEOUT)
+
+
+def enqueue_auto_match():
+    # لو في job شغالة أو مستنية بنرجعها بدل ما نعمل واحدة جديدة (لو ميتة، claim_next_job هياخدها تاني)
+    for _ in range(3):
+        try:
+            with transaction.atomic():
+                return MatchingJob.objects.create(lock_key=AUTO_MATCH_LOCK), True
+        except IntegrityError:
+            job = MatchingJob.objects.filter(lock_key=AUTO_MATCH_LOCK).first()
+            if job is not None:
+                return job, False
+    raise RuntimeError("Could not enqueue the auto_match job")
+
+
+def lock_auto_match():
+    # الـ auto_match المتزامن بياخد نفس الـ lock: job بـ status running → (job، None)، أو (None، الـ job اللي ماسكاه)
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            job = MatchingJob.objects.create(
+                lock_key=AUTO_MATCH_LOCK, status='running', started_at=now, heartbeat_at=now
+            )
+        return job, None
+    except IntegrityError:
+        return None, MatchingJob.objects.filter(lock_key=AUTO_MATCH_LOCK).first()
+
+
+def claim_next_job():
+    cutoff = job_cutoff()
+    stale = models.Q(heartbeat_at__lt=cutoff) | models.Q(heartbeat_at=None, started_at__lt=cutoff)
+    candidates = (
+        MatchingJob.objects
+        .filter(models.Q(status='queued') | models.Q(stale, status='running'))
+        .order_by('created_at')[:10]
+    )
+    for job in candidates:
+        now = timezone.now()
+        # compare-and-set على الحالة اللي قريناها، فـ worker واحد بس ياخدها
+        claimed = MatchingJob.objects.filter(
+            id=job.id, status=job.status, started_at=job.started_at, heartbeat_at=job.heartbeat_at
+        ).update(status='running', started_at=now, heartbeat_at=now)
+        if claimed:
+            if job.status == 'running':
+                logger.warning("Reclaimed matching job %s (no heartbeat since %s)", job.id, job.heartbeat_at)
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def owned(job):
+    # الكتابة بتعدي بس لو محدش reclaim الـ job (worker قديم رجع بعد ما اتاخدت منه)
+    return MatchingJob.objects.filter(id=job.id, started_at=job.started_at)
+
+
+def job_progress(job):
+    def report(pairs_scored, pairs_written, candidate_pairs):
+        owned(job).update(
+            heartbeat_at=timezone.now(),
+            pairs_scored=pairs_scored,
+            pairs_written=pairs_written,
+            progress=round(pairs_scored / candidate_pairs, 4) if candidate_pairs else 1.0,
+        )
+    return report
+
+
+def finish_job(job, stats=None, error=None):
+    if error is not None:
+        owned(job).update(status='failed', error=error, finished_at=timezone.now(), lock_key=None)
+    else:
+        owned(job).update(
+            status='done',
+            progress=1.0,
+            pairs_scored=stats["pairs_scored"],
+            pairs_written=stats["pairs_written"],
+            stats=stats,
+            finished_at=timezone.now(),
+            lock_key=None,
+        )
+
+
+def run_job(job):
+    try:
+        stats = start_auto_match(progress=job_progress(job)).run()
+    except Exception as exc:
+        logger.exception("Matching job %s failed", job.id)
+        finish_job(job, error=str(exc))
+    else:
+        finish_job(job, stats)
+    job.refresh_from_db()
+    return job
+
+
+def locked_stream(job, run):
+    # الـ NDJSON stream بيمسك الـ lock لحد ما يخلص أو الـ client يقفل
+    error = "stream closed before the run finished"
+    try:
+        yield from run
+        error = None
+    except Exception as exc:
+        error = str(exc)
+        raise
+    finally:
+        finish_job(job, run.stats if error is None else None, error)
+
+
+def match_stats_headers(stats):
+    headers = {
+        "X-Match-Total-Pairs": str(stats["total_pairs"]),
+        "X-Match-Candidate-Pairs": str(stats["candidate_pairs"]),
+        "X-Match-Pruning-Ratio": str(stats["pruning_ratio"]),
+    }
+    # streamed runs send their headers before these are known
+    if "pairs_pruned" in stats:
+        headers["X-Match-Pairs-Pruned"] = str(stats["pairs_pruned"])
+    return headers
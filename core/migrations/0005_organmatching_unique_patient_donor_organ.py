@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_surgeryreport_blood_pressure_diastolic_and_more'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='organmatching',
+            constraint=models.UniqueConstraint(fields=('patient', 'donor', 'organ_type'), name='unique_patient_donor_organ'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_organmatching_unique_patient_donor_organ'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('lock_key', models.CharField(blank=True, max_length=50, null=True, unique=True)),
+                ('progress', models.FloatField(default=0)),
+                ('pairs_scored', models.PositiveBigIntegerField(default=0)),
+                ('pairs_written', models.PositiveBigIntegerField(default=0)),
+                ('stats', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
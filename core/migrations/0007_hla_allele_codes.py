@@ -0,0 +1,69 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:05
+
+from django.db import migrations, models
+
+from core.hla import HLA_FIELDS, HLA_LOCI, normalize_allele
+
+
+def backfill_hla_codes(apps, schema_editor):
+    User = apps.get_model('core', 'User')
+    HLAAllele = apps.get_model('core', 'HLAAllele')
+    codes = {}
+    changed = []
+    for user in User.objects.only('id', *HLA_FIELDS).iterator(chunk_size=2000):
+        for field in HLA_FIELDS:
+            name = normalize_allele(getattr(user, field), HLA_LOCI[field])
+            if name is not None and name not in codes:
+                codes[name] = HLAAllele.objects.get_or_create(name=name, defaults={'locus': HLA_LOCI[field]})[0].id
+            setattr(user, f"{field}_code", codes.get(name))
+        changed.append(user)
+    User.objects.bulk_update(changed, [f"{field}_code" for field in HLA_FIELDS], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_matchingjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HLAAllele',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=20, unique=True)),
+                ('locus', models.CharField(max_length=5)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='HLA_A_1_code',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='HLA_A_2_code',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='HLA_B_1_code',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='HLA_B_2_code',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='HLA_DR_1_code',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='HLA_DR_2_code',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_hla_codes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_hla_allele_codes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='donormedicalprofile',
+            name='paired_patient',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='paired_donors', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
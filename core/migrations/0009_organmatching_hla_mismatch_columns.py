@@ -0,0 +1,59 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:20
+
+from django.db import migrations, models
+
+from core.hla import HLA_CODE_FIELDS, HLA_FIELDS, HLA_LOCI
+
+
+def backfill_hla_mismatches(apps, schema_editor):
+    User = apps.get_model('core', 'User')
+    OrganMatching = apps.get_model('core', 'OrganMatching')
+    codes = {row[0]: row[1:] for row in User.objects.values_list('id', *HLA_CODE_FIELDS).iterator(chunk_size=2000)}
+    loci = [HLA_LOCI[field] for field in HLA_FIELDS]
+    fields = ['hla_mismatch_count', 'hla_a_mismatches', 'hla_b_mismatches', 'hla_dr_mismatches']
+    changed = []
+    for match in OrganMatching.objects.only('id', 'patient_id', 'donor_id').iterator(chunk_size=2000):
+        by_locus = {'A': 0, 'B': 0, 'DR': 0}
+        for locus, p, d in zip(loci, codes.get(match.patient_id, ()), codes.get(match.donor_id, ())):
+            if p and d and p != d:
+                by_locus[locus] += 1
+        match.hla_a_mismatches = by_locus['A']
+        match.hla_b_mismatches = by_locus['B']
+        match.hla_dr_mismatches = by_locus['DR']
+        match.hla_mismatch_count = sum(by_locus.values())
+        changed.append(match)
+        if len(changed) >= 1000:
+            OrganMatching.objects.bulk_update(changed, fields)
+            changed = []
+    OrganMatching.objects.bulk_update(changed, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_donormedicalprofile_paired_patient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organmatching',
+            name='hla_a_mismatches',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='organmatching',
+            name='hla_b_mismatches',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='organmatching',
+            name='hla_dr_mismatches',
+            field=models.PositiveSmallIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='organmatching',
+            name='hla_mismatch_count',
+            field=models.PositiveSmallIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(backfill_hla_mismatches, migrations.RunPython.noop),
+    ]
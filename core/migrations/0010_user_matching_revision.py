@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_organmatching_hla_mismatch_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='matching_revision',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_user_matching_revision'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(fields=['created_at', 'id'], name='alert_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='organmatching',
+            index=models.Index(fields=['match_percentage', 'id'], name='match_percentage_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='organmatching',
+            index=models.Index(fields=['created_at', 'id'], name='match_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vitalsign',
+            index=models.Index(fields=['recorded_at', 'id'], name='vitalsign_recorded_id_idx'),
+        ),
+    ]
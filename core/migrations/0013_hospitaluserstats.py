@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_hospital_stats(apps, schema_editor):
+    User = apps.get_model('core', 'User')
+    HospitalUserStats = apps.get_model('core', 'HospitalUserStats')
+    HospitalUserStats.objects.bulk_create([
+        HospitalUserStats(**row)
+        for row in User.objects.order_by().values('hospital_id', 'role', 'status').annotate(count=Count('id'))
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_tableversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HospitalUserStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('patient', 'Patient'), ('donor', 'Donor'), ('hospital', 'Hospital'), ('admin', 'Admin')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('approved', 'Approved'), ('under_review', 'Under Review'), ('rejected', 'Rejected')], max_length=20)),
+                ('count', models.IntegerField(default=0)),
+                ('hospital', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='user_stats', to='core.hospital')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('hospital', 'role', 'status'), name='unique_hospital_role_status')],
+            },
+        ),
+        migrations.RunPython(backfill_hospital_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('core', '0013_hospitaluserstats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['hospital', 'id'], name='user_hospital_id_idx'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+from django.db import migrations, models
+
+from core.hla import HLA_CODE_FIELDS, HLA_FIELDS, HLA_LOCI, normalize_allele
+
+
+def renormalize_hla_codes(apps, schema_editor):
+    # "A*0201" و "DRB1*1501" كانوا بيبقوا A201 و DR1501: الـ codes والـ mismatch columns بتتحسب تاني
+    User = apps.get_model('core', 'User')
+    HLAAllele = apps.get_model('core', 'HLAAllele')
+    OrganMatching = apps.get_model('core', 'OrganMatching')
+    names = dict(HLAAllele.objects.values_list('name', 'id'))
+    codes, changed = {}, []
+    for user in User.objects.only('id', *HLA_FIELDS, *HLA_CODE_FIELDS).iterator(chunk_size=2000):
+        row = []
+        for field in HLA_FIELDS:
+            name = normalize_allele(getattr(user, field), HLA_LOCI[field])
+            if name is not None and name not in names:
+                names[name] = HLAAllele.objects.get_or_create(name=name, defaults={'locus': HLA_LOCI[field]})[0].id
+            row.append(names.get(name))
+        codes[user.id] = row
+        if row != [getattr(user, field) for field in HLA_CODE_FIELDS]:
+            for field, code in zip(HLA_CODE_FIELDS, row):
+                setattr(user, field, code)
+            changed.append(user)
+    for start in range(0, len(changed), 1000):
+        batch = changed[start:start + 1000]
+        User.objects.bulk_update(batch, HLA_CODE_FIELDS)
+        # الـ score cache متفهرس بالـ revision
+        User.objects.filter(id__in=[user.id for user in batch]).update(
+            matching_revision=models.F('matching_revision') + 1
+        )
+
+    changed_ids = {user.id for user in changed}
+    if not changed_ids:
+        return
+    loci = [HLA_LOCI[field] for field in HLA_FIELDS]
+    fields = ['hla_mismatch_count', 'hla_a_mismatches', 'hla_b_mismatches', 'hla_dr_mismatches']
+    matches = OrganMatching.objects.filter(
+        models.Q(patient_id__in=changed_ids) | models.Q(donor_id__in=changed_ids)
+    ).only('id', 'patient_id', 'donor_id')
+    updated = []
+    for match in matches.iterator(chunk_size=2000):
+        by_locus = {'A': 0, 'B': 0, 'DR': 0}
+        for locus, p, d in zip(loci, codes.get(match.patient_id, ()), codes.get(match.donor_id, ())):
+            if p and d and p != d:
+                by_locus[locus] += 1
+        match.hla_a_mismatches = by_locus['A']
+        match.hla_b_mismatches = by_locus['B']
+        match.hla_dr_mismatches = by_locus['DR']
+        match.hla_mismatch_count = sum(by_locus.values())
+        updated.append(match)
+        if len(updated) >= 1000:
+            OrganMatching.objects.bulk_update(updated, fields)
+            updated = []
+    OrganMatching.objects.bulk_update(updated, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_user_hospital_roster_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(renormalize_hla_codes, migrations.RunPython.noop),
+    ]
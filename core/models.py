@@ -1,10 +1,14 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 from django.contrib.auth.hashers import make_password, check_password
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 import datetime
 
+from .hla import HLA_CODE_FIELDS, HLA_FIELDS, HLA_LOCI, normalize_allele
+from .score_cache import score_cache
+from .scoring import SCORING_VERSION
+
 
 # ==================================================
 # Custom User Manager
@@ -87,6 +91,17 @@ class User(AbstractBaseUser, PermissionsMixin):
     HLA_DR_1 = models.CharField(max_length=10, null=True, blank=True)
     HLA_DR_2 = models.CharField(max_length=10, null=True, blank=True)
 
+    # أرقام الـ alleles من HLAAllele (بتتحدث في save) عشان المقارنة تبقى على integers
+    HLA_A_1_code = models.PositiveIntegerField(null=True, blank=True)
+    HLA_A_2_code = models.PositiveIntegerField(null=True, blank=True)
+    HLA_B_1_code = models.PositiveIntegerField(null=True, blank=True)
+    HLA_B_2_code = models.PositiveIntegerField(null=True, blank=True)
+    HLA_DR_1_code = models.PositiveIntegerField(null=True, blank=True)
+    HLA_DR_2_code = models.PositiveIntegerField(null=True, blank=True)
+
+    # بيزيد مع كل تغيير في الـ MATCHING_FIELDS (جزء من مفتاح الـ score cache)
+    matching_revision = models.PositiveIntegerField(default=0)
+
     PRA = models.FloatField(null=True, blank=True)
     CMV_status = models.BooleanField(null=True, blank=True)
     EBV_status = models.BooleanField(null=True, blank=True)
@@ -111,6 +126,53 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     objects = CustomUserManager()
 
+    class Meta:
+        # roster المستشفى (hospital/users/) بالـ cursor على الـ id
+        indexes = [models.Index(fields=['hospital', 'id'], name='user_hospital_id_idx')]
+
+    # الحقول اللي بتأثر على نتيجة الـ matching
+    MATCHING_FIELDS = [
+        'role', 'status', 'blood_type', 'bmi',
+        'HLA_A_1_code', 'HLA_A_2_code', 'HLA_B_1_code', 'HLA_B_2_code', 'HLA_DR_1_code', 'HLA_DR_2_code',
+    ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._matching_state = instance.get_matching_state()
+        instance._loaded_hla = instance.get_hla_typing()
+        return instance
+
+    # الحقول اللي الـ hospital stats rollup متقسم بيها
+    STATS_FIELDS = ['hospital_id', 'role', 'status']
+
+    def get_stats_key(self):
+        # None لو حقل منهم deferred
+        if any(field not in self.__dict__ for field in self.STATS_FIELDS):
+            return None
+        return tuple(self.__dict__[field] for field in self.STATS_FIELDS)
+
+    def get_hla_typing(self):
+        return tuple(self.__dict__.get(field) for field in HLA_FIELDS)
+
+    def has_unsaved_matching_changes(self):
+        # الـ codes بتتحدث في save بس، فبنقارن الـ HLA strings كمان
+        return self.get_hla_typing() != getattr(self, '_loaded_hla', None) or bool(self.get_matching_changes())
+
+    def get_matching_state(self):
+        # deferred fields are left out instead of being fetched
+        return {field: self.__dict__[field] for field in self.MATCHING_FIELDS if field in self.__dict__}
+
+    def get_matching_changes(self, update_fields=None):
+        old_state = getattr(self, '_matching_state', {})
+        changed = {
+            field for field, value in self.get_matching_state().items()
+            if field not in old_state or old_state[field] != value
+        }
+        if update_fields is not None:
+            changed &= set(update_fields)
+        return changed
+
     # ✅ ONLY calculation – NO medical / status decisions
     def save(self, *args, **kwargs):
         if self.height_cm and self.height_cm > 0 and self.weight_kg:
@@ -118,7 +180,43 @@ class User(AbstractBaseUser, PermissionsMixin):
             self.bmi = round(self.weight_kg / (height_m ** 2), 2)
         else:
             self.bmi = None
-        super().save(*args, **kwargs)
+        self.update_hla_codes(kwargs.get('update_fields'))
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {
+                f"{field}_code" for field in HLA_FIELDS if field in kwargs['update_fields']
+            }
+
+        changed = self.get_matching_changes(kwargs.get('update_fields'))
+        # الزيادة بتحصل في الـ database عشان two saves في نفس الوقت مياخدوش نفس الـ revision
+        adding = self._state.adding
+        bump_revision = changed and not adding
+        if bump_revision:
+            self.matching_revision = models.F('matching_revision') + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'matching_revision'}
+        elif changed:
+            self.matching_revision = 1
+        # الـ hospital stats rollup بيقفل الصف في pre_save لحد الـ commit
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
+        if bump_revision:
+            self.refresh_from_db(fields=['matching_revision'])
+
+        self._matching_state = self.get_matching_state()
+        self._loaded_hla = self.get_hla_typing()
+        if changed:
+            from .snapshot import mark_changed  # لتجنب الاستدعاء الدائري
+            mark_changed(self.id)
+        # مش approved تاني (أو role اتغير): الـ rematch بيمسح الـ pending matches القديمة بتاعته
+        in_matching = self.status == 'approved' and self.role in ('patient', 'donor')
+        if changed and (in_matching or not adding):
+            from .matching import schedule_rematch  # لتجنب الاستدعاء الدائري
+            schedule_rematch(self.id)
+
+    def update_hla_codes(self, update_fields=None):
+        for field in HLA_FIELDS:
+            if field in self.__dict__ and (update_fields is None or field in update_fields):
+                setattr(self, f"{field}_code", HLAAllele.intern(self.__dict__[field], HLA_LOCI[field]))
 
     # ✅ Explicit medical eligibility (used in approval & matching)
     def is_donor_medically_eligible(self):
@@ -130,6 +228,127 @@ class User(AbstractBaseUser, PermissionsMixin):
         return f"{self.first_name} {self.last_name} ({self.role})"
 
 
+def organ_changed(user_id):
+    # تغيير العضو في الـ profile بيأثر على الـ matching زي أي field في User
+    User.objects.filter(id=user_id).update(matching_revision=models.F('matching_revision') + 1)
+    from .matching import schedule_rematch  # لتجنب الاستدعاء الدائري
+    from .snapshot import mark_changed
+    mark_changed(user_id)
+    schedule_rematch(user_id)
+
+
+# ==================================================
+# HLA allele dictionary
+# ==================================================
+class HLAAllele(models.Model):
+    name = models.CharField(max_length=20, unique=True)  # normalized, e.g. "A2", "DR15"
+    locus = models.CharField(max_length=5)
+
+    # name → id لكل process عشان الـ save ميعملش query لكل allele
+    _codes = {}
+
+    @classmethod
+    def remember(cls, name, code):
+        # بعد الـ commit بس: لو الـ transaction اترجعت الـ id ده ممكن يبقى مش موجود
+        # (أو process تاني يعمل نفس الاسم بـ id تاني)
+        transaction.on_commit(lambda: cls._codes.setdefault(name, code))
+
+    @classmethod
+    def intern(cls, value, locus):
+        name = normalize_allele(value, locus)
+        if name is None:
+            return None
+        code = cls._codes.get(name)
+        if code is None:
+            code = cls.objects.get_or_create(name=name, defaults={'locus': locus})[0].id
+            cls.remember(name, code)
+        return code
+
+    @classmethod
+    def lookup(cls, value, locus):
+        # زي intern بس من غير ما يضيف alleles جديدة (None لو مش موجود)
+        name = normalize_allele(value, locus)
+        if name is None:
+            return None
+        code = cls._codes.get(name)
+        if code is None:
+            code = cls.objects.filter(name=name).values_list('id', flat=True).first()
+            if code is not None:
+                cls.remember(name, code)
+        return code
+
+    def __str__(self):
+        return self.name
+
+
+def hla_mismatch_breakdown(patient, donor):
+    mismatches = {'A': 0, 'B': 0, 'DR': 0}
+    for field in HLA_FIELDS:
+        patient_val = normalize_allele(getattr(patient, field, None), HLA_LOCI[field])
+        donor_val = normalize_allele(getattr(donor, field, None), HLA_LOCI[field])
+        if patient_val and donor_val and patient_val != donor_val:
+            mismatches[HLA_LOCI[field]] += 1
+    return mismatches
+
+
+
+def code_mismatches(patient_codes, donor_codes):
+    # نفس hla_mismatch_breakdown بس على الـ HLAAllele codes (code واحد لكل اسم بعد الـ normalize)
+    mismatches = {'A': 0, 'B': 0, 'DR': 0}
+    for field, patient_code, donor_code in zip(HLA_FIELDS, patient_codes, donor_codes):
+        if patient_code and donor_code and patient_code != donor_code:
+            mismatches[HLA_LOCI[field]] += 1
+    return mismatches
+
+
+def matching_identity(user):
+    # (pk, revision, hla codes) لو الـ user محفوظ ومفيش تعديلات matching لسه ما اتحفظتش، غير كده None
+    if isinstance(user, User):
+        if user.pk is None or user.has_unsaved_matching_changes():
+            return None
+        codes = None
+        if all(field in user.__dict__ for field in HLA_CODE_FIELDS):
+            codes = tuple(user.__dict__[field] for field in HLA_CODE_FIELDS)
+        return user.pk, user.matching_revision, codes
+    # صف من الـ registry snapshot (matching.MatchingRecord)
+    if getattr(user, 'hla_codes', None) is not None:
+        return user.pk, user.matching_revision, user.hla_codes
+    return None
+
+
+def match_cache_key(patient, donor, identities=None):
+    patient_id, donor_id = identities or (matching_identity(patient), matching_identity(donor))
+    if patient_id is None or donor_id is None:
+        return None
+    return ('pair', patient_id[0], patient_id[1], donor_id[0], donor_id[1], SCORING_VERSION)
+
+
+def score_pair(patient, donor):
+    identities = matching_identity(patient), matching_identity(donor)
+    cache_key = match_cache_key(patient, donor, identities)
+    cached = score_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        a, b, dr, score = cached
+        return {'A': a, 'B': b, 'DR': dr}, score
+
+    if cache_key and identities[0][2] is not None and identities[1][2] is not None:
+        # الـ codes متخزنة مع الـ user، فمفيش داعي نعمل normalize للـ strings تاني
+        by_locus = code_mismatches(identities[0][2], identities[1][2])
+    else:
+        by_locus = hla_mismatch_breakdown(patient, donor)
+
+    # كل mismatch يقلل الـ score 10 نقطة من 100
+    score = max(0, 100 - sum(by_locus.values()) * 10)
+
+    # فحص صلاحية المتبرع طبيًا (مثلاً BMI، HLA، chronic conditions)
+    if hasattr(donor, 'is_donor_medically_eligible') and not donor.is_donor_medically_eligible():
+        score -= 20
+        score = max(score, 0)
+
+    if cache_key:
+        score_cache.put(cache_key, (by_locus['A'], by_locus['B'], by_locus['DR'], score))
+    return by_locus, score
+
 
 class OrganType(models.TextChoices):
     KIDNEY = 'kidney', 'Kidney'
@@ -220,6 +439,18 @@ class PatientMedicalProfile(models.Model):
         choices=OrganType.choices,default="Kindy"
     )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_organ = instance.__dict__.get('organ_needed')
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if getattr(self, '_loaded_organ', None) != self.organ_needed:
+            organ_changed(self.patient_id)
+        self._loaded_organ = self.organ_needed
+
     def __str__(self):
         return f"{self.patient} needs {self.organ_needed}"
 
@@ -236,6 +467,25 @@ class DonorMedicalProfile(models.Model):
         choices=OrganType.choices,
         default="Kindy"
     )
+    # المريض اللي المتبرع ده جاي عشانه (paired exchange)، فاضي = متبرع altruistic
+    paired_patient = models.ForeignKey(
+        User,
+        null=True, blank=True,
+        on_delete=models.SET_NULL,
+        related_name='paired_donors'
+    )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_organ = instance.__dict__.get('organ_available')
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if getattr(self, '_loaded_organ', None) != self.organ_available:
+            organ_changed(self.donor_id)
+        self._loaded_organ = self.organ_available
 
     def __str__(self):
         return f"{self.donor} donates {self.organ_available}"
@@ -300,29 +550,32 @@ class OrganMatching(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # بتتحسب مع الـ match وبتتخزن عشان الـ filter والـ ordering يبقوا في SQL
+    hla_mismatch_count = models.PositiveSmallIntegerField(null=True, blank=True, db_index=True)
+    hla_a_mismatches = models.PositiveSmallIntegerField(null=True, blank=True)
+    hla_b_mismatches = models.PositiveSmallIntegerField(null=True, blank=True)
+    hla_dr_mismatches = models.PositiveSmallIntegerField(null=True, blank=True, db_index=True)
+
     class Meta:
         ordering = ['-match_percentage']
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'donor', 'organ_type'], name='unique_patient_donor_organ'),
+        ]
+        # الـ cursor pagination (الترتيب + id)
+        indexes = [
+            models.Index(fields=['match_percentage', 'id'], name='match_percentage_id_idx'),
+            models.Index(fields=['created_at', 'id'], name='match_created_id_idx'),
+        ]
 
 
     @staticmethod
     def calculate_match(patient, donor):
-        mismatches = 0
-        hla_fields = ['HLA_A_1','HLA_A_2','HLA_B_1','HLA_B_2','HLA_DR_1','HLA_DR_2']
-        for field in hla_fields:
-            patient_val = getattr(patient, field, None)
-            donor_val = getattr(donor, field, None)
-            if patient_val and donor_val and patient_val != donor_val:
-                mismatches += 1
-
-        score = max(0, 100 - mismatches * 10)
-
-        # التحقق من صلاحية المتبرع طبيًا
-        if hasattr(donor, 'is_donor_medically_eligible') and not donor.is_donor_medically_eligible():
-            score -= 20
-            score = max(score, 0)
+        by_locus, score = score_pair(patient, donor)
+        mismatches = sum(by_locus.values())
 
         return {
             "hla_mismatch_count": mismatches,
+            "hla_mismatches_by_locus": by_locus,
             "match_percentage": score,
             "ai_result": {
                 "hla_mismatches": mismatches,
@@ -335,6 +588,7 @@ class OrganMatching(models.Model):
         result = self.calculate_match(self.patient, self.donor)
         self.match_percentage = result['match_percentage']
         self.ai_result = result['ai_result']
+        self.set_hla_mismatches(result['hla_mismatches_by_locus'])
         self.status = 'pending'
         self.save()
 
@@ -342,42 +596,51 @@ class OrganMatching(models.Model):
         return f"{self.patient} ↔ {self.donor} ({self.match_percentage}%)"
 
     # ==========================
-    # HLA mismatch ديناميكي
+    # HLA mismatch (متخزن في الـ columns)
     # ==========================
-    @property
-    def hla_mismatch_count(self):
-        mismatches = 0
-        hla_fields = ['HLA_A_1','HLA_A_2','HLA_B_1','HLA_B_2','HLA_DR_1','HLA_DR_2']
-        for field in hla_fields:
-            patient_val = getattr(self.patient, field, None)
-            donor_val = getattr(self.donor, field, None)
-            if patient_val and donor_val and patient_val != donor_val:
-                mismatches += 1
-        return mismatches
+    HLA_MISMATCH_FIELDS = ['hla_mismatch_count', 'hla_a_mismatches', 'hla_b_mismatches', 'hla_dr_mismatches']
+
+    def set_hla_mismatches(self, by_locus):
+        self.hla_a_mismatches = by_locus['A']
+        self.hla_b_mismatches = by_locus['B']
+        self.hla_dr_mismatches = by_locus['DR']
+        self.hla_mismatch_count = sum(by_locus.values())
+        self._hla_pair = (self.patient_id, self.donor_id)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._hla_pair = (instance.__dict__.get('patient_id'), instance.__dict__.get('donor_id'))
+        return instance
+
+    def pair_hla_codes(self):
+        # الـ codes متخزنة مع الـ user: query واحدة للاتنين
+        codes = {
+            row[0]: row[1:]
+            for row in User.objects.filter(id__in=(self.patient_id, self.donor_id)).values_list('id', *HLA_CODE_FIELDS)
+        }
+        empty = (None,) * len(HLA_CODE_FIELDS)
+        return codes.get(self.patient_id, empty), codes.get(self.donor_id, empty)
+
+    def save(self, *args, **kwargs):
+        # الـ viewset (POST/PUT/PATCH) وأي save() عادي: الـ columns بتتحسب لو فاضية أو الـ patient/donor اتغيروا
+        if self.hla_mismatch_count is None or getattr(self, '_hla_pair', None) != (self.patient_id, self.donor_id):
+            self.set_hla_mismatches(code_mismatches(*self.pair_hla_codes()))
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], *self.HLA_MISMATCH_FIELDS}
+        super().save(*args, **kwargs)
 
     # ==========================
     # Static method لحساب match لأي patient و donor
     # ==========================
     @staticmethod
     def calculate_match(patient, donor):
-        mismatches = 0
-        hla_fields = ['HLA_A_1','HLA_A_2','HLA_B_1','HLA_B_2','HLA_DR_1','HLA_DR_2']
-        for field in hla_fields:
-            patient_val = getattr(patient, field, None)
-            donor_val = getattr(donor, field, None)
-            if patient_val and donor_val and patient_val != donor_val:
-                mismatches += 1
-
-        # كل mismatch يقلل الـ score 10 نقطة من 100
-        score = max(0, 100 - mismatches * 10)
-
-        # فحص صلاحية المتبرع طبيًا (مثلاً BMI، HLA، chronic conditions)
-        if hasattr(donor, 'is_donor_medically_eligible') and not donor.is_donor_medically_eligible():
-            score -= 20
-            score = max(score, 0)
+        by_locus, score = score_pair(patient, donor)
+        mismatches = sum(by_locus.values())
 
         return {
             "hla_mismatch_count": mismatches,
+            "hla_mismatches_by_locus": by_locus,
             "match_percentage": score,
             "ai_result": {
                 "hla_mismatches": mismatches,
@@ -393,9 +656,48 @@ class OrganMatching(models.Model):
         result = self.calculate_match(self.patient, self.donor)
         self.match_percentage = result['match_percentage']
         self.ai_result = result['ai_result']
+        self.set_hla_mismatches(result['hla_mismatches_by_locus'])
         self.status = 'pending'  # أو تغير حسب الحاجة
         self.save()
 
+class MatchingJob(models.Model):
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    # بيتملى طول ما الـ job queued/running عشان محدش يشغل نفس الـ job مرتين
+    lock_key = models.CharField(max_length=50, unique=True, null=True, blank=True)
+
+    progress = models.FloatField(default=0)
+    pairs_scored = models.PositiveBigIntegerField(default=0)
+    pairs_written = models.PositiveBigIntegerField(default=0)
+    stats = models.JSONField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # بيتحدث مع كل progress؛ running من غير heartbeat أكتر من MATCHING_JOB_TIMEOUT = الـ worker مات
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    @property
+    def duration_seconds(self):
+        if not self.started_at:
+            return None
+        end = self.finished_at or timezone.now()
+        return round((end - self.started_at).total_seconds(), 3)
+
+    def __str__(self):
+        return f"Matching job {self.id} ({self.status})"
+
+
 # ==================================================
 # Surgery
 # ==================================================
@@ -473,6 +775,9 @@ class Alert(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['created_at', 'id'], name='alert_created_id_idx')]
+
     def __str__(self):
         return f"{self.user} - {self.alert_type}"
 
@@ -528,5 +833,39 @@ class VitalSign(models.Model):
 
     recorded_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['recorded_at', 'id'], name='vitalsign_recorded_id_idx')]
+
+    def __str__(self):
+        return f"Vitals for {self.surgery_report.surgery.surgery_number} @ {self.recorded_at}"
+
+# ==================================================
+# Table versions (ETag / Last-Modified)
+# ==================================================
+class TableVersion(models.Model):
+    # بيزيد مع كل كتابة في الـ table (core.versions)، فالـ conditional GET مش محتاج يلمس الـ table نفسها
+    table = models.CharField(max_length=100, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.table} v{self.version}"
+
+
+# ==================================================
+# Hospital statistics rollup
+# ==================================================
+class HospitalUserStats(models.Model):
+    # عدد المستخدمين لكل (مستشفى، role، status)؛ بيتحدث مع كل save / delete للـ User (core.rollups)
+    hospital = models.ForeignKey(Hospital, on_delete=models.CASCADE, null=True, blank=True, related_name='user_stats')
+    role = models.CharField(max_length=20, choices=User.ROLE_CHOICES)
+    status = models.CharField(max_length=20, choices=User.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hospital', 'role', 'status'], name='unique_hospital_role_status')
+        ]
+
     def __str__(self):
-        return f"Vitals for {self.surgery_report.surgery.surgery_number} @ {self.recorded_at}"
\ No newline at end of file
+        return f"{self.hospital_id} / {self.role} / {self.status}: {self.count}"
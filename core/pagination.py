@@ -0,0 +1,185 @@
+import base64
+import binascii
+import json
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+# ==========================
+# Page numbers (COUNT(*) اختياري)
+# ==========================
+class OptionalCountPagination(pagination.PageNumberPagination):
+    # ?count=false → من غير COUNT(*): بنجيب صف زيادة عشان نعرف فيه صفحة بعدها ولا لأ
+    count_query_param = 'count'
+    force_count_free = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_free = self.force_count_free or (
+            request.query_params.get(self.count_query_param) in ('0', 'false', 'False')
+        )
+        if not self.count_free:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        try:
+            self.number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            raise NotFound("Invalid page.")
+        if self.number < 1:
+            raise NotFound("Invalid page.")
+        offset = (self.number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        self.has_next = len(rows) > page_size
+        return rows[:page_size]
+
+    def get_paginated_response(self, data):
+        if not self.count_free:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if not self.count_free:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.page_query_param, self.number + 1)
+
+    def get_previous_link(self):
+        if not self.count_free:
+            return super().get_previous_link()
+        if self.number <= 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.number - 1)
+
+
+# ==========================
+# Keyset / cursor
+# ==========================
+def keyset_filter(ordering, values, forward=True):
+    # (a, id) بعد (a0, id0) → a بعد a0، أو a = a0 و id بعد id0
+    clauses, equal = [], {}
+    for name, value in zip(ordering, values):
+        field = name.lstrip('-')
+        descending = name.startswith('-')
+        lookup = 'lt' if descending == forward else 'gt'
+        clauses.append(Q(**equal, **{f'{field}__{lookup}': value}))
+        equal[field] = value
+    return reduce(or_, clauses)
+
+
+def cursor_value(value):
+    # isoformat كاملة (DjangoJSONEncoder بيقص الـ microseconds فالـ cursor يبوظ)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f"Can't put {type(value).__name__} in a cursor")
+
+
+def reverse_ordering(ordering):
+    return [name[1:] if name.startswith('-') else f'-{name}' for name in ordering]
+
+
+class KeysetPagination(pagination.BasePagination):
+    # الصفحة N بتكلف زي الصفحة الأولى: WHERE على الـ index بدل COUNT(*) و OFFSET
+    # الـ view بيحدد الترتيب (آخره id عشان يبقى unique) في keyset_ordering أو get_keyset_ordering()؛
+    # None → count-free page numbers
+    cursor_query_param = 'cursor'
+    page_size = pagination.api_settings.PAGE_SIZE
+
+    def get_ordering(self, view):
+        if hasattr(view, 'get_keyset_ordering'):
+            return view.get_keyset_ordering()
+        return list(view.keyset_ordering)
+
+    def required_fields(self, view):
+        # الـ columns اللي الـ cursor بيتبني منها (للـ values() في الـ fast path)
+        return [name.lstrip('-') for name in self.get_ordering(view) or []]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(view)
+        if self.ordering is None:
+            self.fallback = OptionalCountPagination()
+            self.fallback.force_count_free = True
+            return self.fallback.paginate_queryset(queryset, request, view)
+        self.fallback = None
+
+        position, reverse = self.decode_cursor(request, queryset.model)
+        forward = not reverse
+        fields = [name.lstrip('-') for name in self.ordering]
+        loaded, deferred = queryset.query.deferred_loading
+        if loaded and not deferred:
+            # only() من الـ sparse fieldsets: الـ cursor محتاج columns الترتيب
+            queryset = queryset.only(*loaded, *fields)
+
+        queryset = queryset.order_by(*(self.ordering if forward else reverse_ordering(self.ordering)))
+        if position is not None:
+            queryset = queryset.filter(keyset_filter(self.ordering, position, forward))
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = has_more if forward else position is not None
+        self.has_previous = (position is not None and bool(rows)) if forward else has_more
+        self.first = self.position(rows[0], fields) if rows else None
+        self.last = self.position(rows[-1], fields) if rows else None
+        return rows
+
+    @staticmethod
+    def position(row, fields):
+        # model instance أو dict من values()
+        if isinstance(row, dict):
+            return [row[field] for field in fields]
+        return [getattr(row, field) for field in fields]
+
+    def decode_cursor(self, request, model):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            fields = [model._meta.get_field(name.lstrip('-')) for name in self.ordering]
+            values = data['p']
+            if len(values) != len(fields):
+                raise ValueError
+            return [field.to_python(value) for field, value in zip(fields, values)], bool(data.get('r'))
+        except (TypeError, ValueError, KeyError, binascii.Error, ValidationError):
+            raise NotFound("Invalid cursor")
+
+    def encode_cursor(self, values, reverse):
+        data = json.dumps({'p': values, 'r': int(reverse)}, default=cursor_value, separators=(',', ':'))
+        cursor = base64.urlsafe_b64encode(data.encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if self.fallback is not None:
+            return self.fallback.get_next_link()
+        return self.encode_cursor(self.last, False) if self.has_next and self.last else None
+
+    def get_previous_link(self):
+        if self.fallback is not None:
+            return self.fallback.get_previous_link()
+        return self.encode_cursor(self.first, True) if self.has_previous and self.first else None
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
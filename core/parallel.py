@@ -0,0 +1,69 @@
+# Process-pool scoring: workers read patient/donor arrays from shared memory
+# and only the block indexes travel through pickling.
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+
+from .scoring import score_and_select
+
+
+# worker side
+_arrays = {}
+_segments = []
+
+
+def share_arrays(arrays):
+    segments, spec = [], {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+        segments.append(segment)
+        spec[name] = (segment.name, array.shape, array.dtype.str)
+    return segments, spec
+
+
+def release_arrays(segments):
+    for segment in segments:
+        segment.close()
+        segment.unlink()
+
+
+def _attach(spec):
+    for name, (segment_name, shape, dtype) in spec.items():
+        # spawned workers share the parent's resource tracker, and the parent unlinks the segment
+        segment = shared_memory.SharedMemory(name=segment_name)
+        _segments.append(segment)
+        _arrays[name] = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+
+
+def _score_task(task):
+    patient_idx, donor_idx, top_k, min_score = task
+    return score_and_select(
+        _arrays['patient_hla'][patient_idx],
+        _arrays['donor_hla'][donor_idx],
+        _arrays['donor_eligible'][donor_idx],
+        top_k,
+        min_score,
+    )
+
+
+def score_blocks_parallel(patient_hla, donor_hla, donor_eligible, blocks, workers, top_k=0, min_score=0):
+    segments, spec = share_arrays({
+        'patient_hla': patient_hla,
+        'donor_hla': donor_hla,
+        'donor_eligible': donor_eligible,
+    })
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context('spawn'),
+            initializer=_attach,
+            initargs=(spec,),
+        ) as pool:
+            tasks = ((patient_idx, donor_idx, top_k, min_score) for patient_idx, donor_idx in blocks)
+            # map بترجع النتايج بنفس ترتيب الـ blocks، فالـ merge ثابت
+            yield from pool.map(_score_task, tasks)
+    finally:
+        release_arrays(segments)
@@ -0,0 +1,51 @@
+# Patient priority ranking over the registry snapshot:
+# query واحدة للـ chronic diseases بدل query (أو اتنين) لكل مريض، وكتابة الـ priorities bulk upsert
+from django.db import connections, router, transaction
+from django.db.models import Count
+
+from .models import PatientPriority, UserChronicDisease
+from .snapshot import patient_snapshot
+from .versions import bump
+
+WRITE_BATCH_SIZE = 2000
+
+
+def priority_level(score):
+    # تحديد المستوى
+    if score >= 50:
+        return 'critical'
+    if score >= 30:
+        return 'high'
+    if score >= 10:
+        return 'medium'
+    return 'low'
+
+
+def calculate_priorities():
+    patients = patient_snapshot.get(fresh=True)
+    disease_counts = dict(
+        UserChronicDisease.objects
+        .filter(user__role='patient')
+        .values('user_id')
+        .annotate(count=Count('id'))
+        .values_list('user_id', 'count')
+    )
+
+    results, priorities = [], []
+    for i, patient_id in enumerate(patients.ids.tolist()):
+        score = disease_counts.get(patient_id, 0) * 10
+        if patients.organs[i]:
+            score += 20
+        level = priority_level(score)
+        priorities.append(PatientPriority(patient_id=patient_id, score=score, level=level))
+        results.append({"patient": patients.labels[i], "score": score, "level": level})
+
+    db = router.db_for_write(PatientPriority)
+    options = {"update_conflicts": True, "update_fields": ['score', 'level', 'updated_at']}
+    # MySQL upserts on any unique key and rejects an explicit conflict target
+    if connections[db].features.supports_update_conflicts_with_target:
+        options["unique_fields"] = ['patient']
+    with transaction.atomic(using=db):
+        PatientPriority.objects.using(db).bulk_create(priorities, batch_size=WRITE_BATCH_SIZE, **options)
+        bump(PatientPriority)
+    return results
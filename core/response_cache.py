@@ -0,0 +1,97 @@
+# Rendered-response cache for the read-mostly reference endpoints (hospitals, doctors, chronic diseases).
+# الـ key هو الـ ETag (table versions + الـ path بالـ query params + الـ media type + الـ user)، فأي create / update /
+# delete بيزود الـ version وبيغير الـ key بعد الـ commit: الـ entries القديمة مبتترجعش تاني وبتخلص بالـ timeout.
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from rest_framework.decorators import action
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .versions import table_label
+
+
+class ResponseCache:
+    def __init__(self, alias, timeout):
+        self.alias = alias
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.counters = defaultdict(lambda: {"hits": 0, "misses": 0, "stores": 0})
+
+    @property
+    def enabled(self):
+        return bool(self.alias)
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def key(etag):
+        return 'api-response:' + etag.strip('"')
+
+    def count(self, resource, counter):
+        with self.lock:
+            self.counters[resource][counter] += 1
+
+    def get(self, resource, etag):
+        cached = self.backend.get(self.key(etag))
+        self.count(resource, "hits" if cached is not None else "misses")
+        return cached
+
+    def put(self, resource, etag, content, content_type):
+        self.backend.set(self.key(etag), (content, content_type), self.timeout)
+        self.count(resource, "stores")
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+
+    def stats(self):
+        with self.lock:
+            resources = {}
+            for resource, counters in sorted(self.counters.items()):
+                lookups = counters["hits"] + counters["misses"]
+                resources[resource] = {
+                    **counters,
+                    "hit_ratio": round(counters["hits"] / lookups, 4) if lookups else 0.0,
+                }
+        return {
+            "cache": self.alias or None,
+            "timeout": self.timeout,
+            "resources": resources,
+        }
+
+
+response_cache = ResponseCache(settings.API_RESPONSE_CACHE_ALIAS, settings.API_RESPONSE_CACHE_TIMEOUT)
+
+
+class CachedResponseMixin:
+    # لازم ييجي مع ConditionalGetMixin (هو اللي بيحسب الـ ETag)؛ JSON بس، الـ browsable API بيعدي على الطريق العادي
+    def full_response(self, request, etag, handler, *args, **kwargs):
+        if not response_cache.enabled or not isinstance(request.accepted_renderer, JSONRenderer):
+            return super().full_response(request, etag, handler, *args, **kwargs)
+
+        resource = table_label(self.get_queryset().model)
+        cached = response_cache.get(resource, etag)
+        if cached is not None:
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = super().full_response(request, etag, handler, *args, **kwargs)
+        if response.status_code == 200:
+            response.add_post_render_callback(
+                lambda rendered: response_cache.put(resource, etag, rendered.content, rendered['Content-Type'])
+            )
+        response['X-Cache'] = 'MISS'
+        return response
+
+    @action(detail=False, methods=['get'])
+    def cache_stats(self, request):
+        # hit / miss counters بتوع الـ response cache في الـ process ده
+        return Response(response_cache.stats())
@@ -0,0 +1,132 @@
+# Per-hospital user counts (HospitalUserStats) kept in step with every User create / update / delete,
+# so the dashboard stats are a read of a few rows instead of COUNTs over the users table.
+# bulk writes (bulk_create، queryset update) مبتبعتش signals: بعدها لازم rebuild_hospital_stats().
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+
+from .models import Hospital, HospitalUserStats, User
+
+
+def apply_deltas(deltas):
+    # {(hospital_id, role, status): +n / -n}
+    for (hospital_id, role, status), delta in sorted(deltas.items(), key=repr):
+        if not delta:
+            continue
+        rows = HospitalUserStats.objects.filter(hospital_id=hospital_id, role=role, status=status)
+        if rows.update(count=F('count') + delta):
+            continue
+        try:
+            with transaction.atomic():
+                HospitalUserStats.objects.create(hospital_id=hospital_id, role=role, status=status, count=delta)
+        except IntegrityError:
+            # process تاني عمل الصف في نفس اللحظة
+            rows.update(count=F('count') + delta)
+
+
+def rebuild_hospital_stats():
+    # من الأول بـ grouped aggregate واحد (بعد الـ bulk writes أو لو الـ rollup اتلخبط)
+    with transaction.atomic():
+        HospitalUserStats.objects.all().delete()
+        HospitalUserStats.objects.bulk_create([
+            HospitalUserStats(**row)
+            for row in User.objects.order_by().values(*User.STATS_FIELDS).annotate(count=Count('id'))
+        ], batch_size=1000)
+
+
+def remember_stats_key(sender, instance, raw=False, update_fields=None, **kwargs):
+    # الـ key القديم من الـ database تحت lock مش من الـ instance: two saves لنفس الـ user مش هيطرحوا من
+    # نفس الـ key، التاني بيستنى الـ commit ويقرا الجديد (User.save و delete بيشتغلوا جوه transaction)
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not {
+        User._meta.get_field(name).attname for name in update_fields
+    } & set(User.STATS_FIELDS):
+        instance._stats_key = None
+        return
+    old = User.objects.select_for_update().filter(pk=instance.pk).values_list(*User.STATS_FIELDS).first()
+    instance._stats_key = tuple(old) if old is not None else None
+
+
+def user_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    old = None if created else getattr(instance, '_stats_key', None)
+    new = instance.get_stats_key()
+    if not created and update_fields is not None:
+        updated = {User._meta.get_field(name).attname for name in update_fields}
+        if not updated & set(User.STATS_FIELDS):
+            return
+        if old is not None:
+            # الحقول اللي مش في update_fields متكتبتش، فقيمتها هي القديمة
+            new = tuple(
+                getattr(instance, field) if field in updated else value
+                for field, value in zip(User.STATS_FIELDS, old)
+            )
+    if new is None:
+        # حقل deferred ومتعدلش: نقرا القيم من الـ database
+        new = tuple(User.objects.filter(pk=instance.pk).values_list(*User.STATS_FIELDS).get())
+    if old != new:
+        deltas = {new: 1}
+        if old is not None:
+            deltas[old] = deltas.get(old, 0) - 1
+        apply_deltas(deltas)
+    instance._stats_key = new
+
+
+def user_deleted(sender, instance, **kwargs):
+    key = getattr(instance, '_stats_key', None)
+    if key is not None:
+        apply_deltas({key: -1})
+
+
+def hospital_deleting(sender, instance, **kwargs):
+    # users.hospital → SET_NULL بـ queryset update من غير signals، فعدد المستشفى بيتنقل لـ "من غير مستشفى"
+    apply_deltas({
+        (None, role, status): count
+        for role, status, count in instance.user_stats.values_list('role', 'status', 'count')
+    })
+
+
+def connect_signals():
+    pre_save.connect(remember_stats_key, sender=User, dispatch_uid='hospital-stats-user-saving')
+    post_save.connect(user_saved, sender=User, dispatch_uid='hospital-stats-user-saved')
+    pre_delete.connect(remember_stats_key, sender=User, dispatch_uid='hospital-stats-user-deleting')
+    post_delete.connect(user_deleted, sender=User, dispatch_uid='hospital-stats-user-deleted')
+    pre_delete.connect(hospital_deleting, sender=Hospital, dispatch_uid='hospital-stats-hospital-deleting')
+
+
+# ==========================
+# Reads
+# ==========================
+def role_counts(prefix, count):
+    # total / patients / donors كـ aggregate expressions، من الـ users أو من الـ rollup
+    def total(**filters):
+        condition = Q(**{f'{prefix}{name}': value for name, value in filters.items()})
+        return Coalesce(count(filter=condition) if filters else count(), Value(0), output_field=IntegerField())
+    return total
+
+
+def hospitals_stats():
+    # query واحدة لكل المستشفيات (حتى اللي مفيهاش users)
+    if settings.HOSPITAL_STATS_ROLLUP:
+        total = role_counts('user_stats__', lambda **kw: Sum('user_stats__count', **kw))
+    else:
+        total = role_counts('users__', lambda **kw: Count('users', **kw))
+    return Hospital.objects.order_by('id').annotate(
+        total_users=total(), total_patients=total(role='patient'), total_donors=total(role='donor'),
+    ).values_list('id', 'name', 'total_users', 'total_patients', 'total_donors')
+
+
+def users_stats(hospital_id=None):
+    if settings.HOSPITAL_STATS_ROLLUP:
+        rows = HospitalUserStats.objects.all()
+        total = role_counts('', lambda **kw: Sum('count', **kw))
+    else:
+        rows = User.objects.all()
+        total = role_counts('', lambda **kw: Count('id', **kw))
+    if hospital_id:
+        rows = rows.filter(hospital_id=hospital_id)
+    return rows.aggregate(total_users=total(), patients=total(role='patient'), donors=total(role='donor'))
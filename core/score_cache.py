@@ -0,0 +1,112 @@
+# Match-score cache keyed by the users' matching revisions.
+# User.matching_revision changes with every matching-relevant save, so an entry never goes stale:
+# it just stops being looked up and falls off the LRU end.
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def entry_weight(value):
+    # pair entries count as one pair; engine row entries (arrays) count every pair they hold
+    first = value[0]
+    return max(len(first), 1) if hasattr(first, '__len__') else 1
+
+
+class ScoreCache:
+    # max_size is in pairs, so a few huge rows can't blow the memory budget
+    def __init__(self, max_size, shared_alias=None, shared_timeout=None):
+        self.max_size = max_size
+        self.shared_alias = shared_alias
+        self.shared_timeout = shared_timeout
+        self.entries = OrderedDict()
+        self.weight = 0
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.shared_hits = self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    @property
+    def shared(self):
+        # optional second layer through Django's cache framework (مثلاً Redis مشترك بين الـ workers)
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    @staticmethod
+    def shared_key(key):
+        return 'match-score:' + ':'.join(str(part) for part in key)
+
+    def get_many(self, keys):
+        if not self.enabled:
+            return {}
+        found = {}
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    found[key] = entry[0]
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.shared is not None:
+            shared_keys = {self.shared_key(key): key for key in missing}
+            from_shared = {shared_keys[k]: v for k, v in self.shared.get_many(list(shared_keys)).items()}
+            self.put_many(from_shared, shared=False)
+            found.update(from_shared)
+            self.shared_hits += len(from_shared)
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, values, shared=True):
+        if not self.enabled or not values:
+            return
+        with self.lock:
+            for key, value in values.items():
+                old = self.entries.pop(key, None)
+                if old is not None:
+                    self.weight -= old[1]
+                weight = entry_weight(value)
+                self.entries[key] = (value, weight)
+                self.weight += weight
+            while self.weight > self.max_size and self.entries:
+                self.weight -= self.entries.popitem(last=False)[1][1]
+                self.evictions += 1
+        if shared and self.shared is not None:
+            self.shared.set_many({self.shared_key(k): v for k, v in values.items()}, self.shared_timeout)
+
+    def put(self, key, value):
+        self.put_many({key: value})
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.weight = 0
+            self.hits = self.misses = self.shared_hits = self.evictions = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "pairs": self.weight,
+            "max_pairs": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_hits": self.shared_hits,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "shared_layer": self.shared_alias or None,
+        }
+
+
+score_cache = ScoreCache(
+    settings.MATCHING_SCORE_CACHE_SIZE,
+    settings.MATCHING_SCORE_CACHE_ALIAS,
+    settings.MATCHING_SCORE_CACHE_TIMEOUT,
+)
@@ -0,0 +1,83 @@
+# Pure NumPy scoring used by the matching engine.
+# No Django imports here: this module is also loaded by the process-pool workers.
+import numpy as np
+
+# زوده لما حسبة الـ score تتغير عشان الـ cache القديم ميتقريش
+SCORING_VERSION = 1
+
+
+# ==================================================
+# Scoring
+# ==================================================
+def score_block(patient_hla, donor_hla, donor_eligible):
+    p = patient_hla[:, None, :]
+    d = donor_hla[None, :, :]
+    mismatches = ((p != d) & (p > 0) & (d > 0)).sum(axis=2)
+
+    # نفس حسبة OrganMatching.calculate_match
+    scores = np.maximum(0, 100 - mismatches * 10)
+    scores = np.where(donor_eligible[None, :], scores, np.maximum(scores - 20, 0))
+    return mismatches, scores
+
+
+# ==================================================
+# Top-K / minimum score retention
+# ==================================================
+def select_candidates(scores, top_k=0, min_score=0):
+    # بيرجع لكل صف أماكن المتبرعين اللي هيتخزنوا، مرتبين من الأعلى للأقل
+    n_rows, n_cols = scores.shape
+    if not top_k and not min_score:
+        return [np.arange(n_cols)] * n_rows
+
+    # higher score first, then the lower donor index, so ties are deterministic
+    ranked = scores.astype(np.int64) * (n_cols + 1) + (n_cols - np.arange(n_cols))
+    ranked[scores < min_score] = -1
+    if top_k and top_k < n_cols:
+        columns = np.argpartition(-ranked, top_k - 1, axis=1)[:, :top_k]
+    else:
+        columns = np.broadcast_to(np.arange(n_cols), (n_rows, n_cols))
+
+    selected = []
+    for i in range(n_rows):
+        row = columns[i][np.argsort(-ranked[i, columns[i]], kind='stable')]
+        selected.append(row[ranked[i, row] >= 0])
+    return selected
+
+
+class BlockResult:
+    # الـ pairs المختارة من block واحد في arrays صغيرة:
+    # row i owns columns[offsets[i]:offsets[i + 1]] and the matching scores / mismatches
+    # (mismatches has one column per locus: A, B, DR)
+    __slots__ = ('offsets', 'columns', 'scores', 'mismatches', 'pairs_scored')
+
+    def __init__(self, offsets, columns, scores, mismatches, pairs_scored):
+        self.offsets = offsets
+        self.columns = columns
+        self.scores = scores
+        self.mismatches = mismatches
+        self.pairs_scored = pairs_scored
+
+
+def score_and_select(patient_hla, donor_hla, donor_eligible, top_k=0, min_score=0):
+    mismatches, scores = score_block(patient_hla, donor_hla, donor_eligible)
+    selected = select_candidates(scores, top_k, min_score)
+
+    counts = np.array([len(columns) for columns in selected], dtype=np.int64)
+    offsets = np.zeros(len(selected) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    columns = np.concatenate(selected) if selected else np.empty(0, dtype=np.int64)
+    rows = np.repeat(np.arange(len(selected)), counts)
+    return BlockResult(
+        offsets,
+        columns.astype(np.int32),
+        scores[rows, columns].astype(np.int16),
+        locus_mismatches(patient_hla[rows], donor_hla[columns]),
+        int(scores.size),
+    )
+
+
+def locus_mismatches(patient_hla, donor_hla):
+    # per-locus breakdown, computed only for the pairs that are kept
+    # (الأعمدة مترتبة A_1, A_2, B_1, B_2, DR_1, DR_2)
+    mismatched = (patient_hla != donor_hla) & (patient_hla > 0) & (donor_hla > 0)
+    return mismatched.reshape(len(mismatched), -1, 2).sum(axis=2).astype(np.int8)
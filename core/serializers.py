@@ -1,6 +1,9 @@
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from .models import *
 from django.contrib.auth import authenticate
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
 
 
 # register users
@@ -86,11 +89,123 @@ class HospitalLoginSerializer(serializers.Serializer):
 
 
 
+# ==========================
+# Sparse fieldsets (?fields= / ?expand=)
+# ==========================
+def parse_field_list(value):
+    if not value:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+def is_single_relation(model, lookup):
+    # FK / one-to-one بس ينفع معاهم select_related، غير كده prefetch
+    for name in lookup.split('__'):
+        if model is None:
+            raise FieldDoesNotExist(lookup)
+        field = model._meta.get_field(name)
+        if field.many_to_many or field.one_to_many:
+            return False
+        model = field.related_model
+    return True
+
+
+class SparseFieldsetMixin:
+    # الـ nested details مش بتظهر غير لو اتطلبت بـ ?expand=، و ?fields= بيختار الحقول (في الـ GET بس)
+    # field → الـ relations اللي محتاجاها (lookup strings أو Prefetch objects)
+    expandable_fields = {}
+    # SerializerMethodFields → الـ columns اللي بتقراها (عشان only())
+    field_sources = {}
+
+    @classmethod
+    def requested_fields(cls, request):
+        params = getattr(request, 'query_params', request.GET)
+        fields = parse_field_list(params.get('fields')) if request.method in SAFE_METHODS else None
+        return fields, parse_field_list(params.get('expand')) or set()
+
+    @classmethod
+    def sparse_field_names(cls, names, fields, expand):
+        return [
+            name for name in names
+            if name in expand or (name in fields if fields is not None else name not in cls.expandable_fields)
+        ]
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        # الـ top-level serializer بس (أو الـ child بتاع الـ list)؛ الـ nested بيفضل زي ما هو
+        if request is None or not (self.root is self or getattr(self.root, 'child', None) is self):
+            return fields
+        names = self.sparse_field_names(fields, *self.requested_fields(request))
+        return {name: fields[name] for name in names}
+
+    @classmethod
+    def field_instances(cls):
+        # الـ fields بتتبني مرة واحدة لكل class (للقراية بس: sources و types)
+        if '_field_instances' not in cls.__dict__:
+            cls._field_instances = cls().fields
+        return cls._field_instances
+
+    @classmethod
+    def shape_queryset(cls, queryset, request):
+        # joins / prefetches للحقول المطلوبة بس، و only() للـ columns اللي هتتقري
+        model = queryset.model
+        fields = cls.field_instances()
+        select, prefetch, columns = [], [], {model._meta.pk.name}
+        for name in cls.sparse_field_names(fields, *cls.requested_fields(request)):
+            if name in cls.expandable_fields:
+                for lookup in cls.expandable_fields[name]:
+                    if isinstance(lookup, str) and is_single_relation(model, lookup):
+                        select.append(lookup)
+                    else:
+                        prefetch.append(lookup)
+                        lookup = lookup.prefetch_through if isinstance(lookup, Prefetch) else lookup
+                    if columns is not None:
+                        columns.add(lookup.split('__')[0])
+                continue
+            if columns is None:
+                continue
+            if name in cls.field_sources:
+                columns.update(cls.field_sources[name])
+                continue
+            parts = fields[name].source.split('.')
+            try:
+                field = model._meta.get_field(parts[0])
+                if len(parts) > 1:
+                    # source='surgery.doctor.name' → select_related('surgery__doctor')
+                    relation = '__'.join(parts[:-1])
+                    if not is_single_relation(model, relation):
+                        raise FieldDoesNotExist(relation)
+                    select.append(relation)
+            except FieldDoesNotExist:
+                field = None
+            if field is None or not field.concrete or field.many_to_many:
+                # property / method / reverse relation: مش عارفين بتقرا إيه، فكل الـ columns
+                columns = None
+                continue
+            columns.add(field.name)
+
+        queryset = queryset.select_related(None).prefetch_related(None)
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        if columns is not None:
+            queryset = queryset.only(*columns)
+        return queryset
+
+
 # ==========================
 # User Serializer
 # ==========================
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     full_name = serializers.SerializerMethodField(read_only=True)
+    field_sources = {'full_name': ['first_name', 'last_name']}
+
+    @staticmethod
+    def full_name_from_row(row):
+        # get_full_name على صف من values() (الـ fast path)
+        return f"{row['first_name']} {row['last_name']}"
 
     class Meta:
         model = User
@@ -110,14 +225,15 @@ class UserSerializer(serializers.ModelSerializer):
 # ==========================
 # Hospital & Doctor
 # ==========================
-class HospitalSerializer(serializers.ModelSerializer):
+class HospitalSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Hospital
         fields = '__all__'
 
 
-class DoctorSerializer(serializers.ModelSerializer):
+class DoctorSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     hospital_detail = HospitalSerializer(source='hospital', read_only=True)
+    expandable_fields = {'hospital_detail': ['hospital']}
 
     class Meta:
         model = Doctor
@@ -131,15 +247,16 @@ class DoctorSerializer(serializers.ModelSerializer):
 # ==========================
 # Chronic Diseases
 # ==========================
-class ChronicDiseaseSerializer(serializers.ModelSerializer):
+class ChronicDiseaseSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = ChronicDisease
         fields = '__all__'
 
 
-class UserChronicDiseaseSerializer(serializers.ModelSerializer):
+class UserChronicDiseaseSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     disease_detail = ChronicDiseaseSerializer(source='disease', read_only=True)
     user_detail = UserSerializer(source='user', read_only=True)
+    expandable_fields = {'disease_detail': ['disease'], 'user_detail': ['user']}
 
     class Meta:
         model = UserChronicDisease
@@ -149,15 +266,23 @@ class UserChronicDiseaseSerializer(serializers.ModelSerializer):
 # ==========================
 # Patient & Donor Profiles
 # ==========================
-class PatientMedicalProfileSerializer(serializers.ModelSerializer):
+class PatientMedicalProfileSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
 
     patient_detail = UserSerializer(source='patient', read_only=True)  # ده حيجيب كل بيانات المريض
     chronic_diseases = serializers.SerializerMethodField()
     hospital_detail = serializers.SerializerMethodField()
     supervisor_doctor_detail = serializers.SerializerMethodField()
+    expandable_fields = {
+        'patient_detail': ['patient'],
+        'chronic_diseases': ['patient', Prefetch(
+            'patient__chronic_diseases', queryset=UserChronicDisease.objects.select_related('disease')
+        )],
+        'hospital_detail': ['patient__hospital'],
+        'supervisor_doctor_detail': ['patient__supervisor_doctor__hospital'],
+    }
     class Meta:
         model = PatientMedicalProfile
-        fields = ['patient_detail', 'organ_needed', 'chronic_diseases', 'hospital_detail', 'supervisor_doctor_detail']  
+        fields = ['id', 'patient', 'patient_detail', 'organ_needed', 'chronic_diseases', 'hospital_detail', 'supervisor_doctor_detail']  
 
 
     def create(self, validated_data):
@@ -187,17 +312,26 @@ class PatientMedicalProfileSerializer(serializers.ModelSerializer):
         return None
     
 
-class DonorMedicalProfileSerializer(serializers.ModelSerializer):
+class DonorMedicalProfileSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     donor_detail = UserSerializer(source='donor', read_only=True)  # ده حيجيب كل بيانات المريض
     chronic_diseases = serializers.SerializerMethodField()
     hospital_detail = serializers.SerializerMethodField()
     supervisor_doctor_detail = serializers.SerializerMethodField()
+    expandable_fields = {
+        'donor_detail': ['donor'],
+        'chronic_diseases': ['donor', Prefetch(
+            'donor__chronic_diseases', queryset=UserChronicDisease.objects.select_related('disease')
+        )],
+        'hospital_detail': ['donor__hospital'],
+        'supervisor_doctor_detail': ['donor__supervisor_doctor__hospital'],
+    }
     class Meta:
         model = DonorMedicalProfile
         fields = [ 'id',
             'donor',
             'donor_detail',
             'organ_available',
+            'paired_patient',
             'chronic_diseases',
             'hospital_detail',
             'supervisor_doctor_detail',]
@@ -205,9 +339,12 @@ class DonorMedicalProfileSerializer(serializers.ModelSerializer):
         donor = validated_data['donor']
         organ_available = validated_data.get('organ_available')
 
+        defaults = {'organ_available': organ_available}
+        if 'paired_patient' in validated_data:
+            defaults['paired_patient'] = validated_data['paired_patient']
         profile, created = DonorMedicalProfile.objects.update_or_create(
             donor=donor,
-            defaults={'organ_available': organ_available}
+            defaults=defaults
         )
         return profile
     def get_chronic_diseases(self, obj):
@@ -232,10 +369,13 @@ class DonorMedicalProfileSerializer(serializers.ModelSerializer):
 # ==========================
 # Appointment
 # ==========================
-class AppointmentSerializer(serializers.ModelSerializer):
+class AppointmentSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     patient_detail = UserSerializer(source='patient', read_only=True)
     doctor_detail = DoctorSerializer(source='doctor', read_only=True)
     hospital_detail = HospitalSerializer(source='hospital', read_only=True)
+    expandable_fields = {
+        'patient_detail': ['patient'], 'doctor_detail': ['doctor__hospital'], 'hospital_detail': ['hospital'],
+    }
 
     class Meta:
         model = Appointment
@@ -272,32 +412,66 @@ class AppointmentSerializer(serializers.ModelSerializer):
 # ==========================
 # Organ & Matching
 # ==========================
-class OrganMatchingSerializer(serializers.ModelSerializer):
+class OrganMatchingSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     patient_detail = UserSerializer(source='patient', read_only=True)
     donor_detail = UserSerializer(source='donor', read_only=True)
-    hla_mismatch_count = serializers.IntegerField(read_only=True)
+    expandable_fields = {'patient_detail': ['patient'], 'donor_detail': ['donor']}
 
     class Meta:
         model = OrganMatching
         fields = [
             'id', 'patient', 'patient_detail', 'donor', 'donor_detail',
             'organ_type', 'match_percentage', 'hla_mismatch_count',
+            'hla_a_mismatches', 'hla_b_mismatches', 'hla_dr_mismatches',
             'ai_result', 'status', 'created_at'
         ]
-        read_only_fields = ['hla_mismatch_count', 'match_percentage', 'ai_result', 'created_at']
+        read_only_fields = [
+            'hla_mismatch_count', 'hla_a_mismatches', 'hla_b_mismatches', 'hla_dr_mismatches',
+            'match_percentage', 'ai_result', 'created_at'
+        ]
         def get_patient_detail(self, obj):
             return {"id": obj.patient.id, "full_name": f"{obj.patient.first_name} {obj.patient.last_name}"}
 
     def get_donor_detail(self, obj):
         return {"id": obj.donor.id, "full_name": f"{obj.donor.first_name} {obj.donor.last_name}"}
 
+class DonorSimulationSerializer(serializers.Serializer):
+    # متبرع افتراضي (مش بيتحفظ)
+    HLA_A_1 = serializers.CharField(max_length=10, required=False, allow_blank=True, allow_null=True)
+    HLA_A_2 = serializers.CharField(max_length=10, required=False, allow_blank=True, allow_null=True)
+    HLA_B_1 = serializers.CharField(max_length=10, required=False, allow_blank=True, allow_null=True)
+    HLA_B_2 = serializers.CharField(max_length=10, required=False, allow_blank=True, allow_null=True)
+    HLA_DR_1 = serializers.CharField(max_length=10, required=False, allow_blank=True, allow_null=True)
+    HLA_DR_2 = serializers.CharField(max_length=10, required=False, allow_blank=True, allow_null=True)
+    blood_type = serializers.ChoiceField(choices=User.BLOOD_TYPE_CHOICES, required=False, allow_null=True)
+    bmi = serializers.FloatField(required=False, allow_null=True, min_value=5, max_value=100)
+    organ = serializers.ChoiceField(choices=OrganType.choices)
+    top = serializers.IntegerField(required=False, default=20, min_value=1, max_value=500)
+
+
+class MatchingJobSerializer(serializers.ModelSerializer):
+    duration_seconds = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = MatchingJob
+        fields = [
+            'id', 'status', 'progress', 'pairs_scored', 'pairs_written', 'stats',
+            'error', 'created_at', 'started_at', 'heartbeat_at', 'finished_at', 'duration_seconds'
+        ]
+        read_only_fields = fields
+
 # ==========================
 # Surgery
 # ==========================
-class SurgerySerializer(serializers.ModelSerializer):
+class SurgerySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     organ_matching_detail = OrganMatchingSerializer(source='organ_matching', read_only=True)
     doctor_detail = DoctorSerializer(source='doctor', read_only=True)
     hospital_detail = HospitalSerializer(source='hospital', read_only=True)
+    expandable_fields = {
+        'organ_matching_detail': ['organ_matching__patient', 'organ_matching__donor'],
+        'doctor_detail': ['doctor__hospital'],
+        'hospital_detail': ['hospital'],
+    }
 
     class Meta:
         model = Surgery
@@ -311,8 +485,9 @@ class SurgerySerializer(serializers.ModelSerializer):
 # ==========================
 # MRI Reports
 # ==========================
-class MRIReportSerializer(serializers.ModelSerializer):
+class MRIReportSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     patient_detail = UserSerializer(source='patient', read_only=True)
+    expandable_fields = {'patient_detail': ['patient']}
 
     class Meta:
         model = MRIReport
@@ -323,8 +498,9 @@ class MRIReportSerializer(serializers.ModelSerializer):
 # ==========================
 # Patient Priority
 # ==========================
-class PatientPrioritySerializer(serializers.ModelSerializer):
+class PatientPrioritySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     patient_detail = serializers.SerializerMethodField()
+    expandable_fields = {'patient_detail': ['patient']}
 
     class Meta:
         model = PatientPriority
@@ -337,8 +513,9 @@ class PatientPrioritySerializer(serializers.ModelSerializer):
 # ==========================
 # Alerts
 # ==========================
-class AlertSerializer(serializers.ModelSerializer):
+class AlertSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     user_detail = serializers.SerializerMethodField()
+    expandable_fields = {'user_detail': ['user']}
 
     class Meta:
         model = Alert
@@ -349,8 +526,9 @@ class AlertSerializer(serializers.ModelSerializer):
 
 
 
-class UserReportSerializer(serializers.ModelSerializer):
+class UserReportSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     patient_detail = serializers.SerializerMethodField()
+    expandable_fields = {'patient_detail': ['patient']}
 
     class Meta:
         model = UserReport
@@ -371,7 +549,7 @@ class UserReportSerializer(serializers.ModelSerializer):
     
 
 
-class SurgeryReportSerializer(serializers.ModelSerializer):
+class SurgeryReportSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     patient_name = serializers.CharField(source='surgery.organ_matching.patient.__str__', read_only=True)
     doctor_name = serializers.CharField(source='surgery.doctor.name', read_only=True)
     hospital_name = serializers.CharField(source='surgery.hospital.name', read_only=True)
@@ -401,7 +579,7 @@ class SurgeryReportSerializer(serializers.ModelSerializer):
 
 
 
-class VitalSignSerializer(serializers.ModelSerializer):
+class VitalSignSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = VitalSign
         fields = [
@@ -415,4 +593,20 @@ class VitalSignSerializer(serializers.ModelSerializer):
             'oxygen_saturation',
             'recorded_at'
         ]
-        read_only_fields = ['recorded_at']
\ No newline at end of file
+        read_only_fields = ['recorded_at']
+
+class VitalSignReadingSerializer(serializers.ModelSerializer):
+    # قراية واحدة في POST vital-signs/batch/؛ الـ surgery reports بتتأكد للـ batch كله في query واحدة
+    surgery_report = serializers.IntegerField(source='surgery_report_id', min_value=1)
+
+    class Meta:
+        model = VitalSign
+        fields = [
+            'surgery_report',
+            'temperature_c',
+            'heart_rate',
+            'blood_pressure_systolic',
+            'blood_pressure_diastolic',
+            'respiratory_rate',
+            'oxygen_saturation',
+        ]
@@ -0,0 +1,124 @@
+# Warm in-process snapshot of the registry (column arrays, see matching.Population), shared by
+# auto_match, re-matching, update_match, priority ranking and the what-if simulation.
+# Saves in this process mark users dirty after commit; saves in other processes are picked up
+# by a cheap watermark query at most every MATCHING_SNAPSHOT_TTL seconds (or right away with fresh=True).
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+
+from .matching import load_population
+from .models import User
+
+REFRESH_CHUNK_SIZE = 500
+
+
+class RegistrySnapshot:
+    def __init__(self, role, ttl=None):
+        self.role = role
+        self.ttl = settings.MATCHING_SNAPSHOT_TTL if ttl is None else ttl
+        self.population = None
+        self.watermark = None
+        self.checked_at = 0
+        self.built_at = None
+        self.build_seconds = None
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.builds = self.refreshes = 0
+
+    def queryset(self):
+        # كل الـ statuses، والـ approved بيتفلتر من الـ population نفسها
+        return User.objects.filter(role=self.role)
+
+    def current_watermark(self):
+        # أي save بيغير الـ matching fields بيزود الـ revision، فالـ sum بيتغير
+        return tuple(self.queryset().aggregate(
+            count=Count('id'), revisions=Sum('matching_revision'), last=Max('id')
+        ).values())
+
+    def mark_dirty(self, user_id):
+        with self.lock:
+            self.dirty.add(user_id)
+
+    def get(self, fresh=False):
+        with self.lock:
+            if self.population is None:
+                self.build()
+                return self.population
+            if self.dirty:
+                # التغييرات اللي حصلت في الـ process ده: بنحمل الصفوف دي بس
+                dirty, self.dirty = self.dirty, set()
+                self.refresh(dirty)
+                if not fresh:
+                    return self.population
+            if fresh or time.monotonic() - self.checked_at >= self.ttl:
+                # fresh: بعد الـ dirty كمان، عشان تغييرات الـ processes التانية متستخباش ورا التغييرات المحلية.
+                # الـ watermark بيتقرا قبل الـ diff، فأي تغيير في النص هيتلقط في المرة الجاية
+                watermark = self.current_watermark()
+                if watermark != self.watermark:
+                    self.refresh(self.changed_ids())
+                    self.watermark = watermark
+                self.checked_at = time.monotonic()
+            return self.population
+
+    def approved(self, fresh=False):
+        return self.get(fresh).approved_population
+
+    def record(self, user_id, fresh=False):
+        population = self.get(fresh)
+        i = population.index_of(user_id)
+        return population.record(i) if i is not None else None
+
+    def build(self):
+        started = time.perf_counter()
+        self.watermark = self.current_watermark()
+        self.population = load_population(self.role, approved_only=False)
+        self.checked_at = time.monotonic()
+        self.built_at = time.time()
+        self.build_seconds = round(time.perf_counter() - started, 3)
+        self.builds += 1
+
+    def changed_ids(self):
+        # (id, revision) بس عشان نعرف مين اتغير من غير ما نحمل الصفوف كلها
+        current = dict(zip(self.population.ids.tolist(), self.population.revisions.tolist()))
+        latest = dict(self.queryset().values_list('id', 'matching_revision'))
+        changed = {pk for pk, revision in latest.items() if current.get(pk) != revision}
+        return changed | (current.keys() - latest.keys())
+
+    def refresh(self, user_ids):
+        if len(user_ids) > REFRESH_CHUNK_SIZE:
+            # تغييرات كتير: أسرع نبني من الأول
+            self.population = load_population(self.role, approved_only=False)
+        elif user_ids:
+            keep = ~np.isin(self.population.ids, list(user_ids))
+            self.population = self.population.take(np.flatnonzero(keep)).merge(
+                load_population(self.role, ids=list(user_ids), approved_only=False)
+            )
+        self.refreshes += 1
+
+    def stats(self):
+        return {
+            "role": self.role,
+            "size": len(self.population) if self.population is not None else 0,
+            "approved": int(self.population.approved.sum()) if self.population is not None else 0,
+            "built_at": self.built_at,
+            "build_seconds": self.build_seconds,
+            "builds": self.builds,
+            "refreshes": self.refreshes,
+        }
+
+
+patient_snapshot = RegistrySnapshot('patient')
+donor_snapshot = RegistrySnapshot('donor')
+
+
+def mark_changed(user_id):
+    # بعد الـ commit بس، عشان الـ refresh يقرا الداتا الجديدة
+    def mark():
+        patient_snapshot.mark_dirty(user_id)
+        donor_snapshot.mark_dirty(user_id)
+
+    transaction.on_commit(mark)
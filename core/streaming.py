@@ -0,0 +1,19 @@
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+
+def iter_ndjson(rows):
+    # نفس الـ encoder بتاع DRF عشان التواريخ والأرقام تطلع زي الـ JSON العادي
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(row) + "\n"
+
+
+def ndjson_response(rows, headers=None, filename=None):
+    response = StreamingHttpResponse(iter_ndjson(rows), content_type=NDJSON_CONTENT_TYPE, headers=headers)
+    if filename:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
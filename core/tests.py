@@ -1,3 +1,1449 @@
+import datetime
+import json
+from io import StringIO
+from itertools import count
+from unittest.mock import patch
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count, F, QuerySet
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
+
+from .models import (
+    User, Hospital, Doctor, ChronicDisease, UserChronicDisease, PatientMedicalProfile, DonorMedicalProfile,
+    OrganMatching, Alert, Surgery, SurgeryReport, VitalSign, HospitalUserStats, PatientPriority, HLAAllele, MatchingJob,
+    TableVersion, hla_mismatch_breakdown,
+)
+from .allocation import allocate, solve_assignment
+from .exchange import find_exchanges
+from .fastpath import FastListMixin
+from .hla import HLA_FIELDS, HLA_LOCI, normalize_allele
+from .matching import (
+    MatchRun, load_population, match_populations, enqueue_auto_match, claim_next_job, run_job, finish_job,
+)
+from .response_cache import response_cache
+from .rollups import rebuild_hospital_stats
+from .score_cache import score_cache
+from .snapshot import donor_snapshot, patient_snapshot
+from .versions import bump
+from .views import PatientMedicalProfileListView, DonorMedicalProfileListView
+
+
+# ==========================
+# Matching engine
+# ==========================
+class RegistryTestMixin:
+    national_ids = count(100000)
+
+    def setUp(self):
+        # الـ snapshots والـ score cache global للـ process، والـ database بيرجع مع كل test
+        patient_snapshot.population = donor_snapshot.population = None
+        patient_snapshot.dirty, donor_snapshot.dirty = set(), set()
+        score_cache.clear()
+
+    def create_user(self, role, organ='kidney', **fields):
+        fields.setdefault('status', 'approved')
+        user = User.objects.create(
+            national_id=f"{next(self.national_ids):014d}", first_name=role, last_name='Test', role=role, **fields
+        )
+        if organ is not None:
+            if role == 'patient':
+                PatientMedicalProfile.objects.create(patient=user, organ_needed=organ)
+            else:
+                DonorMedicalProfile.objects.create(donor=user, organ_available=organ)
+        return user
+
+
+class MatchRunParityTests(RegistryTestMixin, TestCase):
+    # الـ engine لازم يطلع نفس نتيجة OrganMatching.calculate_match لكل pair متوافق (organ + ABO)
+    RECEIVES_FROM = {'O': {'O'}, 'A': {'O', 'A'}, 'B': {'O', 'B'}, 'AB': {'O', 'A', 'B', 'AB'}}
+
+    def setUp(self):
+        super().setUp()
+        typings = [
+            dict(HLA_A_1='A2', HLA_A_2='A24', HLA_B_1='B8', HLA_B_2='B57', HLA_DR_1='DR15', HLA_DR_2='DR4'),
+            dict(HLA_A_1='A*02:01', HLA_B_1='B*08', HLA_DR_1='DRB1*04:01'),
+            dict(HLA_A_1='A1', HLA_A_2='A3', HLA_B_1='B7', HLA_B_2='B44', HLA_DR_1='DR1', HLA_DR_2='DR7'),
+            dict(),
+        ]
+        self.patients = [
+            self.create_user('patient', blood_type='A+', **typings[0]),
+            self.create_user('patient', blood_type='O-', **typings[1]),
+            self.create_user('patient', blood_type='AB+', **typings[2]),
+            self.create_user('patient', blood_type=None, **typings[1]),  # فصيلة مش معروفة
+            self.create_user('patient', organ='liver', blood_type='B+', **typings[0]),
+            self.create_user('patient', organ=None, blood_type='A+', **typings[0]),  # من غير profile
+        ]
+        # BMI على الحدود: 18.5 و 35 eligible، 18.49 و 35.01 لأ، None eligible
+        donors = [
+            ('A+', 18.5, 0), ('O+', 35, 1), ('B-', 18.49, 2), ('AB+', 35.01, 3), (None, None, 0),
+            ('O-', 25, 2), ('A-', None, 1),
+        ]
+        self.donors = []
+        for blood_type, bmi, typing in donors:
+            donor = self.create_user('donor', blood_type=blood_type, **typings[typing])
+            User.objects.filter(id=donor.id).update(bmi=bmi)
+            self.donors.append(donor)
+        self.donors.append(self.create_user('donor', organ='liver', blood_type='O+', **typings[0]))
+        self.donors.append(self.create_user('donor', organ=None, blood_type='O+', **typings[0]))
+
+    def organ(self, user):
+        profile = 'patient_profile' if user.role == 'patient' else 'donor_profile'
+        field = 'organ_needed' if user.role == 'patient' else 'organ_available'
+        return getattr(getattr(user, profile, None), field, None)
+
+    def compatible(self, patient, donor):
+        if self.organ(patient) is None or self.organ(patient) != self.organ(donor):
+            return False
+        if not patient.blood_type or not donor.blood_type:
+            return True
+        return donor.blood_type.rstrip('+-') in self.RECEIVES_FROM[patient.blood_type.rstrip('+-')]
+
+    def test_engine_matches_calculate_match(self):
+        matches, stats = match_populations(load_population('patient'), load_population('donor'), top_k=0, min_score=0)
+
+        score_cache.clear()
+        expected, labels = {}, {}
+        for patient in User.objects.filter(role='patient'):
+            for donor in User.objects.filter(role='donor'):
+                if not self.compatible(patient, donor):
+                    continue
+                result = OrganMatching.calculate_match(patient, donor)
+                by_locus = result['hla_mismatches_by_locus']
+                self.assertEqual(by_locus, hla_mismatch_breakdown(patient, donor))
+                expected[(patient.id, donor.id)] = (
+                    result['match_percentage'], by_locus['A'], by_locus['B'], by_locus['DR'],
+                    result['hla_mismatch_count'], result['ai_result']['eligible'],
+                )
+                labels[(str(patient), str(donor))] = result['match_percentage']
+
+        rows = {
+            (row.patient_id, row.donor_id): (
+                row.match_percentage, row.hla_a_mismatches, row.hla_b_mismatches, row.hla_dr_mismatches,
+                row.hla_mismatch_count, row.ai_result['eligible'],
+            )
+            for row in OrganMatching.objects.all()
+        }
+        self.assertEqual(rows, expected)
+        self.assertEqual({(m['patient'], m['donor']): m['match_percentage'] for m in matches}, labels)
+        self.assertEqual(stats['pairs_written'], len(expected))
+
+        # الحالات اللي الـ registry ده معمول عشانها اتغطت فعلًا
+        eligibility = {donor_id: eligible for (_, donor_id), (*_, eligible) in expected.items()}
+        self.assertEqual([eligibility.get(donor.id) for donor in self.donors[:4]], [True, True, False, False])
+        self.assertIn((self.patients[3].id, self.donors[2].id), expected)
+        self.assertIn((self.patients[0].id, self.donors[4].id), expected)
+        self.assertFalse(any(self.patients[5].id == patient_id for patient_id, _ in expected))
+        self.assertFalse(any(self.donors[8].id == donor_id for _, donor_id in expected))
+        self.assertEqual({donor_id for patient_id, donor_id in expected if patient_id == self.patients[4].id},
+                         {self.donors[7].id})
+
+
+class CandidateBlockingTests(RegistryTestMixin, TestCase):
+    def test_organ_and_abo_pruning(self):
+        patients = {group: self.create_user('patient', blood_type=blood_type)
+                    for group, blood_type in (('O', 'O+'), ('A', 'A-'), ('AB', 'AB+'), (None, None))}
+        donors = {group: self.create_user('donor', blood_type=blood_type)
+                  for group, blood_type in (('O', 'O-'), ('A', 'A+'), ('B', 'B+'), ('AB', 'AB-'))}
+        self.create_user('donor', organ='liver', blood_type='O+')
+
+        _, stats = match_populations(load_population('patient'), load_population('donor'), top_k=0, min_score=0)
+        self.assertEqual(stats['total_pairs'], 20)
+        self.assertEqual(stats['candidate_pairs'], 11)
+        self.assertEqual(stats['pruning_ratio'], 0.45)
+        self.assertEqual(stats['pairs_scored'], 11)
+
+        pairs = set(OrganMatching.objects.values_list('patient_id', 'donor_id'))
+        expected = {
+            'O': ['O'], 'A': ['O', 'A'], 'AB': ['O', 'A', 'B', 'AB'], None: ['O', 'A', 'B', 'AB'],
+        }
+        self.assertEqual(pairs, {(patients[p].id, donors[d].id) for p, groups in expected.items() for d in groups})
+
+
+class MatchUpsertTests(RegistryTestMixin, TestCase):
+    def run_match(self):
+        return match_populations(load_population('patient'), load_population('donor'), batch_size=2, top_k=0,
+                                 min_score=0)
+
+    def rows(self):
+        return {
+            (row[1], row[2]): (row[0], row[3])
+            for row in OrganMatching.objects.values_list('id', 'patient_id', 'donor_id', 'match_percentage')
+        }
+
+    def test_rerun_updates_in_place(self):
+        self.create_user('patient', blood_type='O+', HLA_A_1='A2', HLA_B_1='B8')
+        donors = [self.create_user('donor', blood_type='O+', HLA_A_1='A2', HLA_B_1='B8') for _ in range(3)]
+
+        _, stats = self.run_match()
+        first = self.rows()
+        self.assertEqual((len(first), stats['pairs_written']), (3, 3))
+
+        score_cache.clear()
+        _, stats = self.run_match()
+        self.assertEqual(self.rows(), first)
+        self.assertEqual(stats['pairs_written'], 3)
+
+        donors[0].HLA_A_1 = 'A1'
+        donors[0].save()
+        self.run_match()
+        second = self.rows()
+        self.assertEqual({key: match_id for key, (match_id, _) in second.items()},
+                         {key: match_id for key, (match_id, _) in first.items()})
+        changed = [key for key in first if first[key][1] != second[key][1]]
+        self.assertEqual([donor_id for _, donor_id in changed], [donors[0].id])
+        self.assertEqual(second[changed[0]][1], first[changed[0]][1] - 10)
+
+
+class TopKTests(RegistryTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        typing = dict(HLA_A_1='A2', HLA_B_1='B8', HLA_DR_1='DR15')
+        self.patient = self.create_user('patient', blood_type='O+', **typing)
+        # 100 و 90 و 80
+        self.best, self.second, self.third = [
+            self.create_user('donor', blood_type='O+', **dict(typing, **changes))
+            for changes in ({}, {'HLA_A_1': 'A1'}, {'HLA_A_1': 'A1', 'HLA_B_1': 'B7'})
+        ]
+
+    def run_match(self, top_k, min_score=0):
+        score_cache.clear()
+        return match_populations(load_population('patient'), load_population('donor'), top_k=top_k,
+                                 min_score=min_score)
+
+    def donors(self):
+        return set(OrganMatching.objects.values_list('donor_id', flat=True))
+
+    def test_top_k(self):
+        matches, stats = self.run_match(top_k=2)
+        self.assertEqual([m['match_percentage'] for m in matches], [100, 90])
+        self.assertEqual(stats['pairs_scored'], 3)
+        self.assertEqual(self.donors(), {self.best.id, self.second.id})
+
+    def test_stale_rows_are_pruned(self):
+        self.run_match(top_k=0)
+        self.assertEqual(len(self.donors()), 3)
+
+        # الـ row اللي عليها surgery بتفضل حتى لو برا الـ top-K
+        Surgery.objects.create(
+            surgery_number='S-TOPK', organ_matching=OrganMatching.objects.get(donor=self.third),
+            hospital=Hospital.objects.create(name='Hospital', location='Cairo', email='topk@example.com'),
+            scheduled_date=timezone.now(),
+        )
+        _, stats = self.run_match(top_k=1)
+        self.assertEqual(stats['pairs_pruned'], 1)
+        self.assertEqual(self.donors(), {self.best.id, self.third.id})
+
+        OrganMatching.objects.filter(donor=self.third).update(status='matched')
+        _, stats = self.run_match(top_k=0, min_score=95)
+        self.assertEqual(stats['pairs_pruned'], 0)
+        self.assertEqual(self.donors(), {self.best.id, self.third.id})
+
+
+class AllocationTests(RegistryTestMixin, TestCase):
+    def best_total(self, edges, used_patients=frozenset(), used_donors=frozenset(), start=0):
+        # brute force: كل الـ matchings الممكنة
+        best = 0
+        for e in range(start, len(edges)):
+            patient, donor, weight = edges[e]
+            if patient not in used_patients and donor not in used_donors:
+                best = max(best, weight + self.best_total(edges, used_patients | {patient}, used_donors | {donor}, e + 1))
+        return best
+
+    def test_solver_is_optimal(self):
+        rng = np.random.default_rng(7)
+        for _ in range(60):
+            n_patients, n_donors = rng.integers(1, 6, size=2)
+            mask = rng.random((n_patients, n_donors)) < 0.5
+            patient_idx, donor_idx = np.nonzero(mask)
+            # نفس الـ pair بأكتر من organ
+            repeated = rng.integers(0, len(patient_idx), size=min(len(patient_idx), 2))
+            patient_idx = np.append(patient_idx, patient_idx[repeated])
+            donor_idx = np.append(donor_idx, donor_idx[repeated])
+            weights = rng.integers(1, 100, size=len(patient_idx)).astype(np.float64)
+            chosen, _ = solve_assignment(patient_idx, donor_idx, weights, n_patients, n_donors)
+
+            self.assertEqual(len(set(patient_idx[chosen])), len(chosen))
+            self.assertEqual(len(set(donor_idx[chosen])), len(chosen))
+            edges = list(zip(patient_idx.tolist(), donor_idx.tolist(), weights.tolist()))
+            self.assertEqual(weights[chosen].sum(), self.best_total(edges))
+
+    def test_allocate_beats_greedy_and_weights_priority(self):
+        first, second, urgent = [self.create_user('patient') for _ in range(3)]
+        donor_1, donor_2, donor_3 = [self.create_user('donor') for _ in range(3)]
+        rejected = self.create_user('donor', status='rejected')
+        for patient, donor, score in ((first, donor_1, 90), (first, donor_2, 80), (second, donor_1, 85),
+                                      (urgent, donor_3, 60), (second, donor_3, 70), (first, rejected, 100)):
+            OrganMatching.objects.create(patient=patient, donor=donor, organ_type='kidney', match_percentage=score)
+        PatientPriority.objects.create(patient=urgent, score=50, level='high')
+
+        # greedy كان هياخد first ↔ donor_1 (90)
+        result = allocate()
+        self.assertEqual({(a['patient'], a['donor']) for a in result['assignments']},
+                         {(first.id, donor_2.id), (second.id, donor_1.id), (urgent.id, donor_3.id)})
+        self.assertEqual(result['total_weight'], 80 + 85 + 90)
+        self.assertEqual(result['candidates'], 5)
+
+
+class PairedExchangeTests(RegistryTestMixin, TestCase):
+    def pair(self, donor_blood_type, patient_blood_type):
+        patient = self.create_user('patient', blood_type=patient_blood_type)
+        donor = self.create_user('donor', blood_type=donor_blood_type)
+        DonorMedicalProfile.objects.filter(donor=donor).update(paired_patient=patient)
+        return donor, patient
+
+    def score(self, donor, patient, match_percentage):
+        OrganMatching.objects.create(patient=patient, donor=donor, organ_type='kidney',
+                                     match_percentage=match_percentage)
+
+    def test_cycle_and_chain(self):
+        donor_1, patient_1 = self.pair('A+', 'B+')
+        donor_2, patient_2 = self.pair('B-', 'A-')
+        donor_3, patient_3 = self.pair('AB+', 'O+')
+        altruistic = self.create_user('donor', blood_type='O-')
+        # الزوج ده متوافق مع بعض: مش داخل الـ exchange
+        direct_donor, direct_patient = self.pair('O+', 'A+')
+        self.score(direct_donor, direct_patient, 90)
+
+        self.score(donor_1, patient_2, 80)
+        self.score(donor_2, patient_1, 70)
+        self.score(altruistic, patient_3, 60)
+        # ABO مش متوافق (AB → A): الـ row موجودة بس مش edge
+        self.score(donor_3, patient_2, 95)
+
+        result = find_exchanges()
+        self.assertEqual((result['pairs'], result['altruistic_donors']), (3, 1))
+        self.assertTrue(result['optimal'])
+        self.assertEqual(result['total_weight'], 210)
+        transplants = {
+            (exchange['type'], t['donor'], t['patient'])
+            for exchange in result['exchanges'] for t in exchange['transplants']
+        }
+        self.assertEqual(transplants, {
+            ('cycle', donor_1.id, patient_2.id), ('cycle', donor_2.id, patient_1.id),
+            ('chain', altruistic.id, patient_3.id),
+        })
+
+    def test_pairs_are_used_once(self):
+        donor_1, patient_1 = self.pair('A+', 'B+')
+        donor_2, patient_2 = self.pair('B+', 'A+')
+        donor_3, patient_3 = self.pair('B+', 'A+')
+        self.score(donor_1, patient_2, 50)
+        self.score(donor_2, patient_1, 50)
+        self.score(donor_1, patient_3, 90)
+        self.score(donor_3, patient_1, 90)
+
+        result = find_exchanges(max_chain=0)
+        self.assertEqual(result['cycles'], 2)
+        self.assertEqual(len(result['exchanges']), 1)
+        self.assertEqual(result['total_weight'], 180)
+
+        # الـ rows اللي مبقتش pending مش edges
+        OrganMatching.objects.filter(donor=donor_3, patient=patient_1).update(status='rejected')
+        result = find_exchanges(max_chain=0)
+        self.assertEqual((result['cycles'], result['total_weight']), (1, 100))
+
+
+class ScoreCacheTests(RegistryTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.patients = [self.create_user('patient', HLA_A_1='A2', HLA_B_1='B8') for _ in range(2)]
+        self.donors = [self.create_user('donor', HLA_A_1=allele, HLA_B_1='B8') for allele in ('A2', 'A1')]
+
+    def run_match(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            matches, stats = match_populations(load_population('patient'), load_population('donor'), top_k=0,
+                                               min_score=0)
+        return sorted((m['patient'], m['donor'], m['match_percentage']) for m in matches), stats
+
+    def test_pair_cache_follows_revisions(self):
+        patient, donor = User.objects.get(id=self.patients[0].id), User.objects.get(id=self.donors[1].id)
+        self.assertEqual(OrganMatching.calculate_match(patient, donor)['match_percentage'], 90)
+        hits = score_cache.hits
+        self.assertEqual(OrganMatching.calculate_match(patient, donor)['match_percentage'], 90)
+        self.assertEqual(score_cache.hits, hits + 1)
+
+        donor.HLA_A_1 = 'A2'
+        donor.save()
+        self.assertEqual(OrganMatching.calculate_match(patient, User.objects.get(id=donor.id))['match_percentage'], 100)
+        # تعديل لسه ما اتحفظش مبيتقراش من الـ cache
+        donor.HLA_B_1 = 'B7'
+        self.assertEqual(OrganMatching.calculate_match(patient, donor)['match_percentage'], 90)
+
+    def test_engine_row_cache(self):
+        first, stats = self.run_match()
+        self.assertEqual((stats['rows_cached'], stats['pairs_scored']), (0, 4))
+
+        second, stats = self.run_match()
+        self.assertEqual(second, first)
+        self.assertEqual((stats['rows_cached'], stats['pairs_scored'], stats['pairs_written']), (2, 0, 4))
+
+        # revision المتبرع اتغيرت: كل الصفوف اللي فيها المتبرع ده بتتحسب تاني
+        self.donors[1].HLA_A_1 = 'A2'
+        self.donors[1].save()
+        third, stats = self.run_match()
+        self.assertEqual((stats['rows_cached'], stats['pairs_scored']), (0, 4))
+        self.assertEqual({score for *_, score in third}, {100})
+
+    def test_cached_rows_are_still_written(self):
+        self.run_match()
+        # الـ rows اتمسحت أو الـ status اتغير من غير ما الـ users يتغيروا: الـ cache لسه صالح
+        OrganMatching.objects.filter(patient=self.patients[0]).delete()
+        OrganMatching.objects.filter(patient=self.patients[1], donor=self.donors[0]).update(status='rejected')
+
+        _, stats = self.run_match()
+        self.assertEqual((stats['rows_cached'], stats['pairs_scored'], stats['pairs_written']), (2, 0, 4))
+        self.assertEqual(
+            sorted(OrganMatching.objects.values_list('patient_id', 'donor_id', 'match_percentage', 'status')),
+            sorted((patient.id, donor.id, 100 if donor == self.donors[0] else 90, 'pending')
+                   for patient in self.patients for donor in self.donors),
+        )
+
+    def test_rolled_back_run_is_not_cached(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                match_populations(load_population('patient'), load_population('donor'), top_k=0, min_score=0)
+                raise RuntimeError
+        _, stats = self.run_match()
+        self.assertEqual(stats['rows_cached'], 0)
+
+
+class DonorSimulationTests(RegistryTestMixin, TestCase):
+    def test_simulation_matches_calculate_match(self):
+        typing = dict(HLA_A_1='A2', HLA_A_2='A24', HLA_B_1='B8', HLA_DR_1='DR15')
+        patients = [
+            self.create_user('patient', blood_type='A+', **typing),
+            self.create_user('patient', blood_type='O+', **dict(typing, HLA_A_2='A3')),
+            self.create_user('patient', blood_type='AB-', HLA_A_1='A1', HLA_B_1='B7'),
+            self.create_user('patient', blood_type='A-', organ='liver', **typing),
+        ]
+        self.create_user('patient', blood_type='A+', status='pending', **typing)
+        donor = dict(typing, HLA_DR_2='DRB1*99:01', blood_type='A+', bmi=40)
+
+        response = APIClient().post('/api/organ-matching/simulate/', dict(donor, organ='kidney'), format='json')
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        # O مبياخدش من A، والـ liver والـ pending برا
+        self.assertEqual(response.data['candidates'], 2)
+        self.assertEqual([r['patient'] for r in results], [patients[0].id, patients[2].id])
+
+        hypothetical = User(role='donor', **donor)
+        for result, patient in zip(results, (patients[0], patients[2])):
+            expected = OrganMatching.calculate_match(User.objects.get(id=patient.id), hypothetical)
+            self.assertEqual(result['match_percentage'], expected['match_percentage'])
+            self.assertEqual(result['hla_mismatch_count'], expected['hla_mismatch_count'])
+        self.assertFalse(OrganMatching.objects.exists())
+
+        response = APIClient().post('/api/organ-matching/simulate/', dict(donor, organ='kidney', top=1),
+                                    format='json')
+        self.assertEqual([r['patient'] for r in response.data['results']], [patients[0].id])
+
+
+class RegistrySnapshotTests(RegistryTestMixin, TestCase):
+    def test_refresh(self):
+        snapshot = patient_snapshot
+        first, second = self.create_user('patient', blood_type='A+'), self.create_user('patient', blood_type='B+')
+        self.assertEqual(snapshot.approved().ids.tolist(), [first.id, second.id])
+        builds, refreshes = snapshot.builds, snapshot.refreshes
+
+        # save في الـ process ده: بيتعلم dirty بعد الـ commit وبيتحمل لوحده
+        with self.captureOnCommitCallbacks(execute=True):
+            first.blood_type = 'O+'
+            first.save()
+        population = snapshot.get()
+        self.assertEqual(population.abo[population.index_of(first.id)], 'O')
+        self.assertEqual((snapshot.builds, snapshot.refreshes), (builds, refreshes + 1))
+
+        # تغيير من process تاني (مفيش signal): بيتلقط من الـ watermark مع fresh=True بس
+        third = self.create_user('patient')
+        User.objects.filter(id=second.id).update(status='rejected', matching_revision=F('matching_revision') + 1)
+        self.assertEqual(snapshot.approved().ids.tolist(), [first.id, second.id])
+        self.assertEqual(snapshot.approved(fresh=True).ids.tolist(), [first.id, third.id])
+        self.assertEqual(len(snapshot.get()), 3)
+
+        User.objects.filter(id=third.id).delete()
+        self.assertEqual(snapshot.approved(fresh=True).ids.tolist(), [first.id])
+        self.assertEqual(snapshot.builds, builds)
+
+        # نفس الـ columns اللي load_population بيرجعها من الأول
+        rebuilt = load_population('patient', approved_only=False)
+        population = snapshot.get()
+        self.assertEqual(population.ids.tolist(), rebuilt.ids.tolist())
+        self.assertEqual(population.abo, rebuilt.abo)
+        self.assertEqual(population.revisions.tolist(), rebuilt.revisions.tolist())
+        self.assertEqual(population.approved.tolist(), rebuilt.approved.tolist())
+
+    def test_fresh_read_with_local_dirty_ids(self):
+        first, second = self.create_user('patient', blood_type='A+'), self.create_user('patient', blood_type='B+')
+        self.assertEqual(patient_snapshot.approved().ids.tolist(), [first.id, second.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.blood_type = 'O+'
+            first.save()
+        self.assertEqual(patient_snapshot.dirty, {first.id})
+        # process تاني رفض المريض التاني (مفيش signal)
+        User.objects.filter(id=second.id).update(status='rejected', matching_revision=F('matching_revision') + 1)
+
+        population = patient_snapshot.approved(fresh=True)
+        self.assertEqual(population.ids.tolist(), [first.id])
+        self.assertEqual(population.abo, ['O'])
+        self.assertEqual(patient_snapshot.watermark, patient_snapshot.current_watermark())
+
+
+class ParallelScoringTests(RegistryTestMixin, TestCase):
+    def test_process_pool_matches_in_process(self):
+        rng = np.random.default_rng(11)
+        alleles = {'A': ['A1', 'A2', 'A3', 'A24'], 'B': ['B7', 'B8', 'B44', 'B57'], 'DR': ['DR1', 'DR4', 'DR15']}
+        for i in range(60):
+            typing = {field: str(rng.choice(alleles[HLA_LOCI[field]])) for field in HLA_FIELDS}
+            self.create_user('patient' if i % 2 else 'donor', organ=['kidney', 'Liver'][i % 3 == 0],
+                             blood_type=str(rng.choice(['A+', 'B-', 'O+', 'AB+'])), **typing)
+        patients, donors = load_population('patient'), load_population('donor')
+
+        for top_k in (0, 3):
+            results = {}
+            for workers, min_pairs in ((1, 1000000), (2, 0)):
+                with self.subTest(top_k=top_k, workers=workers):
+                    score_cache.clear()
+                    OrganMatching.objects.all().delete()
+                    with self.settings(MATCHING_WORKERS=workers, MATCHING_PARALLEL_MIN_PAIRS=min_pairs):
+                        run = MatchRun(patients, donors, top_k=top_k, min_score=0)
+                        matches = list(run)
+                    self.assertEqual(run.workers, workers)
+                    self.assertGreater(len(run.plan), 1)
+                    rows = OrganMatching.objects.order_by('patient_id', 'donor_id', 'organ_type').values_list(
+                        'patient_id', 'donor_id', 'organ_type', 'match_percentage', 'hla_mismatch_count',
+                    )
+                    results[workers] = (matches, run.stats, list(rows))
+            self.assertEqual(results[2], results[1])
+
+
+class HLANormalizationTests(RegistryTestMixin, TestCase):
+    def test_spellings(self):
+        cases = [
+            ('A2', 'A', 'A2'), ('a*02', 'A', 'A2'), ('A*02:01', 'A', 'A2'), ('HLA-A*02:01:01', 'A', 'A2'),
+            ('A*0201', 'A', 'A2'), ('A*020101', 'A', 'A2'), ('A24', 'A', 'A24'), ('B*5701', 'B', 'B57'),
+            ('B*57:01', 'B', 'B57'), ('DR15', 'DR', 'DR15'), ('DRB1*15:01', 'DR', 'DR15'),
+            ('DRB1*1501', 'DR', 'DR15'), ('DR*04', 'DR', 'DR4'), (' b 8 ', 'B', 'B8'),
+            ('', 'A', None), (None, 'A', None),
+        ]
+        for value, locus, expected in cases:
+            with self.subTest(value=value):
+                self.assertEqual(normalize_allele(value, locus), expected)
+
+    def test_equivalent_typings_are_not_mismatches(self):
+        patient_typing = dict(HLA_A_1='A*0201', HLA_A_2='A24', HLA_B_1='B*5701', HLA_B_2='B8',
+                              HLA_DR_1='DRB1*1501', HLA_DR_2='DR4')
+        donor_typing = dict(HLA_A_1='A2', HLA_A_2='A*24:02', HLA_B_1='B57', HLA_B_2='B*08:01',
+                            HLA_DR_1='DR15', HLA_DR_2='DRB1*04:01')
+        patient = self.create_user('patient', **patient_typing)
+        donor = self.create_user('donor', **donor_typing)
+        self.assertEqual([getattr(patient, f"{field}_code") for field in HLA_FIELDS],
+                         [getattr(donor, f"{field}_code") for field in HLA_FIELDS])
+
+        # الـ codes، والـ strings (users مش محفوظين)، والـ engine
+        self.assertEqual(OrganMatching.calculate_match(patient, donor)['hla_mismatch_count'], 0)
+        unsaved = OrganMatching.calculate_match(User(role='patient', **patient_typing),
+                                                User(role='donor', **donor_typing))
+        self.assertEqual(unsaved['hla_mismatch_count'], 0)
+        matches, _ = match_populations(load_population('patient'), load_population('donor'))
+        self.assertEqual(matches[0]['match_percentage'], 100)
+        self.assertEqual(OrganMatching.objects.get().hla_mismatch_count, 0)
+
+
+class HLAAlleleInternTests(TestCase):
+    def setUp(self):
+        HLAAllele._codes.clear()
+
+    def test_rolled_back_code_is_not_cached(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                HLAAllele.intern('A*68:01', 'A')
+                raise RuntimeError
+        self.assertNotIn('A68', HLAAllele._codes)
+        self.assertFalse(HLAAllele.objects.filter(name='A68').exists())
+
+        # بعد الـ commit بس
+        with self.captureOnCommitCallbacks(execute=True):
+            code = HLAAllele.intern('A68', 'A')
+        self.assertEqual(HLAAllele._codes['A68'], code)
+        self.assertEqual(HLAAllele.objects.get(name='A68').id, code)
+
+
+class IncrementalRematchTests(RegistryTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # كل user جديد approved بيتعمله rematch بعد الـ commit
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient = self.create_user('patient', blood_type='A+')
+            # A و O بيدوا A، و B لأ
+            self.donor_a, self.donor_o, self.donor_b = [
+                self.create_user('donor', blood_type=blood_type) for blood_type in ('A+', 'O-', 'B+')
+            ]
+
+    def pairs(self):
+        return set(OrganMatching.objects.values_list('patient_id', 'donor_id', 'organ_type'))
+
+    def save(self, instance):
+        with self.captureOnCommitCallbacks(execute=True):
+            instance.save()
+
+    def test_initial_pairs(self):
+        self.assertEqual(self.pairs(), {(self.patient.id, self.donor_a.id, 'kidney'),
+                                        (self.patient.id, self.donor_o.id, 'kidney')})
+
+    def test_blood_type_change_drops_incompatible_pairs(self):
+        self.patient.blood_type = 'B+'
+        self.save(self.patient)
+        self.assertEqual(self.pairs(), {(self.patient.id, self.donor_o.id, 'kidney'),
+                                        (self.patient.id, self.donor_b.id, 'kidney')})
+
+    def test_no_longer_approved(self):
+        self.donor_a.status = 'rejected'
+        self.save(self.donor_a)
+        self.assertEqual(self.pairs(), {(self.patient.id, self.donor_o.id, 'kidney')})
+
+        self.patient.status = 'pending'
+        self.save(self.patient)
+        self.assertEqual(self.pairs(), set())
+
+    def test_organ_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            liver_donor = self.create_user('donor', organ='liver', blood_type='O+')
+        profile = self.patient.patient_profile
+        profile.organ_needed = 'liver'
+        self.save(profile)
+        self.assertEqual(self.pairs(), {(self.patient.id, liver_donor.id, 'liver')})
+
+    def test_rows_with_surgery_are_kept(self):
+        match = OrganMatching.objects.get(donor=self.donor_a)
+        Surgery.objects.create(surgery_number='S-1', organ_matching=match, hospital=Hospital.objects.create(
+            name='Hospital', location='Cairo', email='h@example.com'), scheduled_date=timezone.now())
+        self.patient.status = 'rejected'
+        self.save(self.patient)
+        self.assertEqual(self.pairs(), {(self.patient.id, self.donor_a.id, 'kidney')})
+
+
+class MatchingJobLockTests(RegistryTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # من غير rematch: الـ auto_match هو اللي يكتب الـ pair
+        self.create_user('patient', blood_type='A+')
+        self.create_user('donor', blood_type='O+')
+
+    def test_dead_worker_job_is_reclaimed(self):
+        job, created = enqueue_auto_match()
+        self.assertTrue(created)
+        claimed = claim_next_job()
+        self.assertEqual(claimed.id, job.id)
+
+        # الـ worker مات: مفيش worker تاني ياخدها لحد الـ timeout
+        self.assertIsNone(claim_next_job())
+        stale = timezone.now() - datetime.timedelta(seconds=settings.MATCHING_JOB_TIMEOUT + 1)
+        MatchingJob.objects.filter(id=job.id).update(heartbeat_at=stale)
+        self.assertEqual(enqueue_auto_match(), (job, False))
+
+        reclaimed = claim_next_job()
+        self.assertEqual(reclaimed.id, job.id)
+        self.assertGreater(reclaimed.started_at, claimed.started_at)
+
+        # الـ worker القديم لو رجع مبيكتبش على الـ job
+        finish_job(claimed, error="late")
+        self.assertEqual(MatchingJob.objects.get(id=job.id).status, 'running')
+
+        run_job(reclaimed)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.lock_key, job.pairs_written), ('done', None, 1))
+        self.assertIsNotNone(job.heartbeat_at)
+        self.assertTrue(enqueue_auto_match()[1])
+
+    def test_sync_auto_match_takes_the_lock(self):
+        client = APIClient()
+        job, _ = enqueue_auto_match()
+        response = client.post('/api/organ-matching/auto_match/')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['job_id'], job.id)
+        self.assertEqual(OrganMatching.objects.count(), 0)
+
+        MatchingJob.objects.filter(id=job.id).update(status='done', lock_key=None)
+        response = client.post('/api/organ-matching/auto_match/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+        sync_job = MatchingJob.objects.latest('created_at')
+        self.assertEqual((sync_job.status, sync_job.lock_key, sync_job.pairs_written), ('done', None, 1))
+
+        # الـ stream بيسيب الـ lock بعد ما يخلص
+        response = client.post('/api/organ-matching/auto_match/?output=ndjson')
+        self.assertEqual(len(b"".join(response.streaming_content).splitlines()), 1)
+        self.assertFalse(MatchingJob.objects.filter(lock_key__isnull=False).exists())
+
+
+class OrganMatchingMismatchColumnTests(RegistryTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.patient = self.create_user('patient', HLA_A_1='A2', HLA_B_1='B8', HLA_DR_1='DR15')
+        self.donor = self.create_user('donor', HLA_A_1='A*02:01', HLA_B_1='B7', HLA_DR_1='DR4')
+        self.other_donor = self.create_user('donor', HLA_A_1='A1', HLA_B_1='B7', HLA_DR_1='DR4')
+
+    def columns(self, match_id):
+        return OrganMatching.objects.filter(id=match_id).values_list(*OrganMatching.HLA_MISMATCH_FIELDS).get()
+
+    def test_viewset_writes(self):
+        client = APIClient()
+        response = client.post('/api/organ-matching/', {
+            'patient': self.patient.id, 'donor': self.donor.id, 'organ_type': 'kidney',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['hla_mismatch_count'], 2)
+        self.assertEqual(self.columns(response.data['id']), (2, 0, 1, 1))
+
+        response = client.patch(f"/api/organ-matching/{response.data['id']}/",
+                                {'donor': self.other_donor.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.columns(response.data['id']), (3, 1, 1, 1))
+
+    def test_plain_save(self):
+        match = OrganMatching.objects.create(patient=self.patient, donor=self.donor, organ_type='kidney')
+        self.assertEqual(self.columns(match.id), (2, 0, 1, 1))
+
+        # status بس: مفيش query زيادة للـ codes
+        match = OrganMatching.objects.get(id=match.id)
+        match.status = 'matched'
+        with CaptureQueriesContext(connection) as queries:
+            match.save(update_fields=['status'])
+        self.assertFalse([query for query in queries.captured_queries if 'core_user' in query['sql']])
+
+        match.donor_id = self.other_donor.id
+        match.save(update_fields=['donor'])
+        self.assertEqual(self.columns(match.id), (3, 1, 1, 1))
+
+
+class GenerateRegistryTests(TestCase):
+    def test_ids_without_returning_bulk_insert(self):
+        # زي MySQL: bulk_create مبيرجعش ids، و process تاني بيكتب hospitals في نفس الوقت
+        bulk_create = QuerySet.bulk_create
+
+        def without_ids(queryset, objs, *args, **kwargs):
+            created = bulk_create(queryset, objs, *args, **kwargs)
+            if queryset.model is Hospital:
+                bulk_create(Hospital.objects.all(), [
+                    Hospital(name='Other', location='Giza', email=f"other{len(created)}@example.com")
+                ])
+            for obj in created:
+                obj.pk = None
+            return created
+
+        with patch.object(QuerySet, 'bulk_create', without_ids):
+            call_command('generate_registry', users=120, hospitals=3, surgeries=10, vitals_per_surgery=1,
+                         stdout=StringIO())
+
+        generated = set(Hospital.objects.filter(email__startswith='hospital').values_list('id', flat=True))
+        self.assertEqual(len(generated), 3)
+        self.assertEqual(set(Doctor.objects.values_list('hospital_id', flat=True)), generated)
+        self.assertTrue(set(User.objects.values_list('hospital_id', flat=True)) <= generated)
+        self.assertFalse(User.objects.exclude(supervisor_doctor__hospital=F('hospital')).exists())
+        self.assertEqual(PatientMedicalProfile.objects.exclude(patient__role='patient').count(), 0)
+        self.assertEqual(DonorMedicalProfile.objects.exclude(donor__role='donor').count(), 0)
+
+        matches = OrganMatching.objects.all()
+        self.assertEqual(matches.count(), 10)
+        self.assertEqual(Surgery.objects.filter(organ_matching__in=matches).count(), 10)
+        self.assertEqual(SurgeryReport.objects.count(), 10)
+        # العضو بتاع المريض، والمتبرع بيدي نفس العضو
+        self.assertFalse(matches.exclude(organ_type=F('patient__patient_profile__organ_needed')).exists())
+        self.assertFalse(matches.exclude(organ_type=F('donor__donor_profile__organ_available')).exists())
+
+
+# ==========================
+# Patient & Donor Profiles
+# ==========================
+class ProfileQueryCountTests(TestCase):
+    # table versions (ETag) + count + page + chronic diseases prefetch، مهما كان عدد الصفوف
+    LIST_QUERIES = 4
+    EXPAND = 'expand=patient_detail,donor_detail,chronic_diseases,hospital_detail,supervisor_doctor_detail'
+    national_ids = count(1)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hospitals = [
+            Hospital.objects.create(name=f"Hospital {i}", location='Cairo', email=f"h{i}@example.com")
+            for i in range(3)
+        ]
+        cls.doctors = [
+            Doctor.objects.create(name=f"Doctor {i}", specialty='Nephrology', hospital=hospital, phone='0100')
+            for i, hospital in enumerate(cls.hospitals)
+        ]
+        cls.diseases = [ChronicDisease.objects.create(name=name) for name in ['Diabetes', 'Hypertension', 'Asthma']]
+
+    def create_users(self, count, role):
+        users = []
+        for i in range(count):
+            user = User.objects.create(
+                national_id=f"{next(self.national_ids):014d}",
+                first_name=f"{role}{i}", last_name='Test', role=role, status='approved',
+                hospital=self.hospitals[i % 3], supervisor_doctor=self.doctors[i % 3],
+            )
+            for disease in self.diseases[:i % 4]:
+                UserChronicDisease.objects.create(user=user, disease=disease, severity='low')
+            if role == 'patient':
+                PatientMedicalProfile.objects.create(patient=user, organ_needed='kidney')
+            else:
+                DonorMedicalProfile.objects.create(donor=user, organ_available='kidney')
+            users.append(user)
+        return users
+
+    def assert_constant_queries(self, url, role):
+        client = APIClient()
+        self.create_users(5, role)
+        with self.assertNumQueries(self.LIST_QUERIES):
+            response = client.get(f"{url}?{self.EXPAND}")
+        self.assertEqual(response.data['count'], 5)
+
+        self.create_users(25, role)
+        with self.assertNumQueries(self.LIST_QUERIES):
+            response = client.get(f"{url}?{self.EXPAND}")
+        self.assertEqual(len(response.data['results']), 30)
+        return response.data['results']
+
+    def test_patient_profiles_list(self):
+        results = self.assert_constant_queries('/api/patient-profiles/', 'patient')
+        row = results[2]
+        self.assertEqual([disease['name'] for disease in row['chronic_diseases']], ['Diabetes', 'Hypertension'])
+        self.assertEqual(row['hospital_detail']['name'], 'Hospital 2')
+        self.assertEqual(row['supervisor_doctor_detail']['hospital_detail']['name'], 'Hospital 2')
+
+    def test_donor_profiles_list(self):
+        results = self.assert_constant_queries('/api/donor-profiles/', 'donor')
+        row = results[3]
+        self.assertEqual(len(row['chronic_diseases']), 3)
+        self.assertEqual(row['supervisor_doctor_detail']['name'], 'Doctor 0')
+
+    def test_profile_detail(self):
+        user = self.create_users(4, 'patient')[3]
+        with self.assertNumQueries(3):
+            response = APIClient().get(f"/api/patient-profiles/{user.patient_profile.id}/?{self.EXPAND}")
+        self.assertEqual(len(response.data['chronic_diseases']), 3)
+
+    def test_profile_list_views(self):
+        self.create_users(10, 'patient')
+        self.create_users(10, 'donor')
+        factory = APIRequestFactory()
+        for view in (PatientMedicalProfileListView.as_view(), DonorMedicalProfileListView.as_view()):
+            with self.assertNumQueries(self.LIST_QUERIES):
+                response = view(factory.get(f"/?{self.EXPAND}"))
+                response.render()
+            self.assertEqual(response.data['count'], 10)
+
+    def test_compact_by_default(self):
+        user = self.create_users(3, 'patient')[2]
+        # versions + count + page: مفيش joins ولا prefetch لو مفيش ?expand=
+        with self.assertNumQueries(3):
+            response = APIClient().get('/api/patient-profiles/')
+        self.assertEqual(response.data['results'][2], {'id': user.patient_profile.id, 'patient': user.id,
+                                                       'organ_needed': 'kidney'})
+
+
+# ==========================
+# Sparse fieldsets
+# ==========================
+class SparseFieldsetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        hospital = Hospital.objects.create(name='Hospital', location='Cairo', email='h@example.com')
+        cls.users = [
+            User.objects.create(
+                national_id=f"{i:014d}", first_name=f"User{i}", last_name='Test', hospital=hospital,
+                role='patient' if i % 2 else 'donor', status='approved',
+            )
+            for i in range(1, 11)
+        ]
+        for patient, donor in zip(cls.users[::2], cls.users[1::2]):
+            OrganMatching.objects.create(patient=patient, donor=donor, organ_type='kidney', match_percentage=80)
+
+    def test_fields_selects_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get('/api/users/?fields=id,full_name')
+        self.assertEqual(response.data['results'][0], {'id': self.users[0].id, 'full_name': 'User1 Test'})
+        page_query = queries.captured_queries[-1]['sql']
+        self.assertIn('first_name', page_query)
+        self.assertNotIn('national_id', page_query)
+
+    def test_expand_nested_detail(self):
+        client = APIClient()
+        response = client.get('/api/organ-matching/')
+        self.assertNotIn('patient_detail', response.data['results'][0])
+
+        # versions + cursor pagination (مفيش COUNT) + الـ joins في نفس الـ query
+        with self.assertNumQueries(2):
+            response = client.get('/api/organ-matching/?expand=patient_detail,donor_detail')
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(response.data['results'][0]['donor_detail']['hospital'], self.users[0].hospital_id)
+
+    def test_export_ndjson(self):
+        client = APIClient()
+        response = client.get('/api/organ-matching/export/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('application/x-ndjson'))
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertTrue(all(isinstance(row, dict) for row in rows))
+        self.assertEqual({row['id'] for row in rows}, set(OrganMatching.objects.values_list('id', flat=True)))
+
+        response = client.get('/api/organ-matching/export/?fields=id,match_percentage')
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 5)
+        for row in rows:
+            self.assertEqual(set(row), {'id', 'match_percentage'})
+
+    def test_fields_ignored_on_write(self):
+        response = APIClient().post('/api/chronic-diseases/?fields=id', {'name': 'Asthma'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['name'], 'Asthma')
+
+
+# ==========================
+# Pagination
+# ==========================
+class CursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create(national_id=f"{i:014d}", first_name=f"User{i}", last_name='Test',
+                                role='patient' if i % 2 else 'donor')
+            for i in range(1, 21)
+        ]
+        Alert.objects.bulk_create([
+            Alert(user=cls.users[i % 20], message=f"alert {i}", alert_type='info') for i in range(75)
+        ])
+        # نص الـ alerts بنفس الوقت عشان الـ id هو اللي يفرق بينهم
+        same_time = Alert.objects.order_by('id')[0].created_at
+        Alert.objects.filter(id__in=list(Alert.objects.values_list('id', flat=True)[:40])).update(created_at=same_time)
+        OrganMatching.objects.bulk_create([
+            OrganMatching(patient=patient, donor=donor, organ_type='kidney', match_percentage=(i % 3) * 10,
+                          hla_mismatch_count=i % 4)
+            for i, (patient, donor) in enumerate(
+                (p, d) for p in cls.users[::2] for d in cls.users[1::2]
+            )
+        ])
+
+    def walk(self, url):
+        client, ids, previous = APIClient(), [], []
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids += [row['id'] for row in response.data['results']]
+            previous.append(response.data['previous'])
+            url = response.data['next']
+        return ids, previous
+
+    def test_alerts_walk_every_row_once(self):
+        ids, previous = self.walk('/api/alerts/')
+        expected = list(Alert.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertIsNone(previous[0])
+
+        # رجوع صفحة من الصفحة التالتة
+        page = APIClient().get(previous[2]).data
+        self.assertEqual([row['id'] for row in page['results']], expected[30:60])
+
+    def test_alerts_page_queries(self):
+        # مفيش COUNT(*): query واحدة للصفحة (+ الـ table versions بتاعة الـ ETag)
+        with self.assertNumQueries(2):
+            APIClient().get('/api/alerts/')
+
+    def test_matches_ordering(self):
+        ids, _ = self.walk('/api/organ-matching/?ordering=match_percentage')
+        self.assertEqual(ids, list(OrganMatching.objects.order_by('match_percentage', 'id').values_list('id', flat=True)))
+
+        # mismatch columns ممكن تبقى null → page numbers من غير COUNT(*)
+        ids, _ = self.walk('/api/organ-matching/?ordering=-hla_mismatch_count')
+        self.assertEqual(sorted(ids), sorted(OrganMatching.objects.values_list('id', flat=True)))
+
+    def test_invalid_cursor(self):
+        self.assertEqual(APIClient().get('/api/alerts/?cursor=abc').status_code, 404)
+
+    def test_count_free_page_numbers(self):
+        with self.assertNumQueries(2):
+            response = APIClient().get('/api/users/?count=false&page_size=30')
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertEqual(APIClient().get('/api/users/').data['count'], 20)
+
+
+# ==========================
+# Fast path rendering
+# ==========================
+class FastPathTests(TestCase):
+    URLS = [
+        '/api/users/', '/api/users/?fields=id,full_name,birthdate,CMV_status&count=false',
+        '/api/alerts/', '/api/vital-signs/', '/api/organ-matching/', '/api/organ-matching/?ordering=created_at',
+        '/api/organ-matching/?ordering=hla_mismatch_count',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        hospital = Hospital.objects.create(name='Hospital', location='Cairo', email='h@example.com')
+        cls.users = [
+            User.objects.create(
+                national_id=f"{i:014d}", first_name=f"نور {i}", last_name='Test', hospital=hospital,
+                role='patient' if i % 2 else 'donor', status='approved', height_cm=150 + i, weight_kg=60.5,
+                birthdate=datetime.date(1990, 1, i), CMV_status=None if i % 3 else bool(i % 2), PRA=i * 7.3,
+                HLA_A_1='A2',
+            )
+            for i in range(1, 13)
+        ]
+        for user in cls.users:
+            Alert.objects.create(user=user, message=f"رسالة {user.id}\u2028", alert_type='medical')
+        for i, (patient, donor) in enumerate(zip(cls.users[::2], cls.users[1::2])):
+            OrganMatching.objects.create(
+                patient=patient, donor=donor, organ_type='kidney', match_percentage=70 + i * 0.5,
+                ai_result={"hla_mismatches": i, "bmi": 22.75, "eligible": True, "notes": None},
+                hla_mismatch_count=i if i % 2 else None,
+            )
+        surgery = Surgery.objects.create(
+            surgery_number='S-1', organ_matching=OrganMatching.objects.first(), hospital=hospital,
+            scheduled_date=timezone.now(),
+        )
+        report = SurgeryReport.objects.create(surgery=surgery, result_summary='ok')
+        VitalSign.objects.bulk_create([
+            VitalSign(surgery_report=report, temperature_c=36.6 + i / 10, heart_rate=70 + i, oxygen_saturation=97.5)
+            for i in range(40)
+        ])
+
+    def get_both(self, url):
+        client = APIClient()
+        fast = client.get(url)
+        with patch.object(FastListMixin, 'fast_path', False):
+            slow = client.get(url)
+        return fast, slow
+
+    def test_byte_compatible(self):
+        for url in self.URLS:
+            with self.subTest(url=url):
+                fast, slow = self.get_both(url)
+                self.assertEqual(fast.status_code, 200)
+                self.assertTrue(getattr(fast, 'fast_json', False))
+                self.assertEqual(fast.content, slow.content)
+                self.assertEqual(fast['Content-Type'], slow['Content-Type'])
+
+    def test_next_page_byte_compatible(self):
+        fast, slow = self.get_both('/api/vital-signs/')
+        fast, slow = self.get_both(fast.data['next'])
+        self.assertEqual(len(fast.data['results']), 10)
+        self.assertEqual(fast.content, slow.content)
+
+    def test_unsafe_float_falls_back(self):
+        VitalSign.objects.update(temperature_c=1e-7)
+        fast, slow = self.get_both('/api/vital-signs/')
+        self.assertFalse(getattr(fast, 'fast_json', False))
+        self.assertEqual(fast.content, slow.content)
+
+    def test_expand_uses_serializer(self):
+        fast, slow = self.get_both('/api/organ-matching/?expand=patient_detail')
+        self.assertFalse(getattr(fast, 'fast_json', False))
+        self.assertEqual(fast.content, slow.content)
+
+
+# ==========================
+# Conditional GET
+# ==========================
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # الـ versions بتتزود بعد الـ commit بس
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.user = User.objects.create(national_id='00000000000001', first_name='Test', last_name='User')
+            Alert.objects.create(user=cls.user, message='alert', alert_type='info')
+
+    def test_not_modified(self):
+        client = APIClient()
+        response = client.get('/api/alerts/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        # query واحدة على TableVersion، من غير ما نلمس الـ alerts
+        with self.assertNumQueries(1):
+            response = client.get('/api/alerts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_write_changes_etag(self):
+        client = APIClient()
+        etag = client.get('/api/alerts/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Alert.objects.create(user=self.user, message='new', alert_type='info')
+        response = client.get('/api/alerts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_related_table_changes_etag(self):
+        # الـ expand بيقرا من users، فأي تعديل فيهم لازم يغير الـ ETag
+        client = APIClient()
+        etag = client.get('/api/alerts/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Changed'
+            self.user.save()
+        self.assertEqual(client.get('/api/alerts/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_bulk_write_bumps_version(self):
+        client = APIClient()
+        etag = client.get('/api/alerts/')['ETag']
+        Alert.objects.bulk_create([Alert(user=self.user, message='bulk', alert_type='info')])
+        self.assertEqual(client.get('/api/alerts/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            bump(Alert)
+        self.assertEqual(client.get('/api/alerts/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_bump_runs_after_commit(self):
+        def version():
+            return TableVersion.objects.get(table='core.alert').version
+
+        before = version()
+        with self.captureOnCommitCallbacks() as callbacks:
+            with CaptureQueriesContext(connection) as queries:
+                for i in range(3):
+                    Alert.objects.create(user=self.user, message=f'alert {i}', alert_type='info')
+        # مفيش UPDATE على صف الـ version جوه الـ transaction، وcallback واحد للـ writes كلها
+        self.assertFalse([query for query in queries.captured_queries if 'core_tableversion' in query['sql']])
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(version(), before)
+        callbacks[0]()
+        self.assertEqual(version(), before + 1)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    Alert.objects.create(user=self.user, message='rolled back', alert_type='info')
+                    raise RuntimeError
+        self.assertEqual((len(callbacks), version()), (0, before + 1))
+
+    def test_if_modified_since(self):
+        client = APIClient()
+        response = client.get(f'/api/alerts/{Alert.objects.get().id}/')
+        self.assertIn('Last-Modified', response)
+        response = client.get(f'/api/alerts/{Alert.objects.get().id}/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_query_string_in_etag(self):
+        client = APIClient()
+        self.assertNotEqual(client.get('/api/alerts/')['ETag'], client.get('/api/alerts/?fields=id')['ETag'])
+
+
+# ==========================
+# Reference data cache
+# ==========================
+class ResponseCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.hospital = Hospital.objects.create(name='Hospital', location='Cairo', email='h@example.com')
+            Doctor.objects.create(name='Doctor', specialty='Nephrology', hospital=cls.hospital, phone='0100')
+            ChronicDisease.objects.create(name='Diabetes')
+
+    def setUp(self):
+        # الـ versions بتتكرر بين الـ tests (rollback)، فالـ cache لازم يبدأ فاضي
+        caches['default'].clear()
+        response_cache.clear()
+
+    def test_hit_after_miss(self):
+        client = APIClient()
+        for url in ['/api/hospitals/', '/api/doctors/?expand=hospital_detail', '/api/chronic-diseases/']:
+            with self.subTest(url=url):
+                first = client.get(url)
+                self.assertEqual(first['X-Cache'], 'MISS')
+                # الـ table versions بس
+                with self.assertNumQueries(1):
+                    second = client.get(url)
+                self.assertEqual(second['X-Cache'], 'HIT')
+                self.assertEqual(second.content, first.content)
+                self.assertEqual(second['Content-Type'], first['Content-Type'])
+                self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_keyed_by_query_params(self):
+        client = APIClient()
+        client.get('/api/doctors/')
+        response = client.get(f'/api/doctors/?hospital={self.hospital.id}&fields=id,name')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(list(response.data['results'][0]), ['id', 'name'])
+
+    def test_invalidated_on_write(self):
+        client = APIClient()
+        client.get('/api/doctors/?expand=hospital_detail')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hospital.name = 'Renamed'
+            self.hospital.save()
+        response = client.get('/api/doctors/?expand=hospital_detail')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['hospital_detail']['name'], 'Renamed')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post('/api/chronic-diseases/', {'name': 'Asthma'}, format='json')
+        client.get('/api/chronic-diseases/')
+        with self.captureOnCommitCallbacks(execute=True):
+            ChronicDisease.objects.get(name='Asthma').delete()
+        response = client.get('/api/chronic-diseases/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['count'], 1)
+
+    def test_stats(self):
+        client = APIClient()
+        client.get('/api/hospitals/')
+        client.get('/api/hospitals/')
+        client.get('/api/hospitals/?format=api')
+        stats = client.get('/api/hospitals/cache_stats/').data['resources']['core.hospital']
+        self.assertEqual((stats['hits'], stats['misses'], stats['stores']), (1, 1, 1))
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+
+# ==========================
+# Hospital statistics
+# ==========================
+class HospitalStatsTests(TestCase):
+    national_ids = count(1)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hospitals = [
+            Hospital.objects.create(name=f"Hospital {i}", location='Cairo', email=f"h{i}@example.com")
+            for i in range(3)
+        ]
+
+    def create_user(self, **fields):
+        return User.objects.create(
+            national_id=f"{next(self.national_ids):014d}", first_name='Test', last_name='User', **fields
+        )
+
+    def rollup(self):
+        return {
+            (row.hospital_id, row.role, row.status): row.count
+            for row in HospitalUserStats.objects.exclude(count=0)
+        }
+
+    def expected(self):
+        return {
+            (row['hospital_id'], row['role'], row['status']): row['count']
+            for row in User.objects.values('hospital_id', 'role', 'status').annotate(count=Count('id'))
+        }
+
+    def test_rollup_follows_writes(self):
+        users = [
+            self.create_user(hospital=self.hospitals[i % 2], role='patient' if i % 3 else 'donor')
+            for i in range(6)
+        ]
+        self.create_user(role='patient')
+        self.assertEqual(self.rollup(), self.expected())
+
+        users[0].status = 'approved'
+        users[0].save()
+        users[1].hospital = self.hospitals[2]
+        users[1].save(update_fields=['hospital'])
+        # deferred / من غير ما يتحمل
+        user = User.objects.only('id', 'first_name').get(id=users[2].id)
+        user.role = 'donor'
+        user.save()
+        User(id=users[3].id, role='donor', status='rejected').save(update_fields=['role', 'status'])
+        users[4].first_name = 'Renamed'
+        users[4].save()
+        self.assertEqual(self.rollup(), self.expected())
+
+        users[5].delete()
+        User.objects.filter(id=users[0].id).delete()
+        User.objects.only('id').get(id=users[1].id).delete()
+        self.assertEqual(self.rollup(), self.expected())
+
+        # الـ users بيبقوا من غير مستشفى (SET_NULL)
+        self.hospitals[0].delete()
+        self.assertEqual(self.rollup(), self.expected())
+
+        HospitalUserStats.objects.update(count=0)
+        rebuild_hospital_stats()
+        self.assertEqual(self.rollup(), self.expected())
+
+    def test_stale_instances(self):
+        # two requests حملوا نفس الـ user وكل واحد غير الـ status: التاني لازم يطرح من الـ key اللي الأول كتبه
+        user = self.create_user(hospital=self.hospitals[0], role='patient')
+        first, second = User.objects.get(id=user.id), User.objects.get(id=user.id)
+        first.status = 'approved'
+        first.save()
+        second.status = 'rejected'
+        second.save()
+        third = User.objects.get(id=user.id)
+        first.hospital = self.hospitals[1]
+        first.save(update_fields=['hospital'])
+        third.status = 'approved'
+        third.save(update_fields=['status'])
+        self.assertEqual(self.rollup(), self.expected())
+        self.assertEqual(self.rollup(), {(self.hospitals[1].id, 'patient', 'approved'): 1})
+
+    def test_endpoints(self):
+        for i in range(9):
+            self.create_user(hospital=self.hospitals[i % 2], role=['patient', 'donor', 'hospital'][i % 3])
+        client = APIClient()
+        responses = {}
+        for rollup in (True, False):
+            with self.settings(HOSPITAL_STATS_ROLLUP=rollup):
+                # query واحدة مهما كان عدد المستشفيات
+                with self.assertNumQueries(1):
+                    stats_all = client.get('/api/hospitals/stats_all/').data
+                with self.assertNumQueries(1):
+                    by_hospital = client.get(f'/api/users/stats_by_hospital/?hospital={self.hospitals[0].id}').data
+                responses[rollup] = (stats_all, by_hospital, client.get('/api/users/stats/').data)
+
+        self.assertEqual(responses[True], responses[False])
+        stats_all, by_hospital, stats = responses[True]
+        self.assertEqual(
+            [(row['hospital_id'], row['total_users'], row['total_patients'], row['total_donors']) for row in stats_all],
+            [(self.hospitals[0].id, 5, 2, 1), (self.hospitals[1].id, 4, 1, 2), (self.hospitals[2].id, 0, 0, 0)],
+        )
+        self.assertEqual(by_hospital, {'total_users': 5, 'patients': 2, 'donors': 1})
+        self.assertEqual(stats, {'total_users': 9, 'patients_count': 3, 'donors_count': 3})
+
+
+# ==========================
+# Hospital Login
+# ==========================
+class HospitalRosterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.hospital = Hospital.objects.create(name='Hospital', location='Cairo', email='h@example.com')
+        cls.hospital.set_password('secret')
+        other = Hospital.objects.create(name='Other', location='Giza', email='o@example.com')
+        User.objects.bulk_create([
+            User(national_id=f"{i:014d}", first_name=f"User{i}", last_name='Test',
+                 hospital=cls.hospital if i % 5 else other,
+                 role='patient' if i % 2 else 'donor', status='approved' if i % 3 else 'pending')
+            for i in range(1, 81)
+        ])
+
+    def login(self):
+        response = APIClient().post('/api/hospital/login/', {'email': 'h@example.com', 'password': 'secret'},
+                                    format='json')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def roster_client(self, token):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Hospital {token}')
+        return client
+
+    def test_login_is_slim(self):
+        # query واحدة للمستشفى، مهما كان عدد الـ users
+        with self.assertNumQueries(1):
+            response = self.login()
+        self.assertEqual(set(response.data), {'hospital_id', 'hospital_name', 'hospital_type', 'token'})
+
+    def test_roster_pages(self):
+        client = self.roster_client(self.login().data['token'])
+        url, ids = '/api/hospital/users/', []
+        while url:
+            # الـ hospital + الصفحة
+            with self.assertNumQueries(2):
+                response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, list(User.objects.filter(hospital=self.hospital).order_by('id').values_list('id', flat=True)))
+        self.assertEqual(set(response.data['results'][0]),
+                         {'id', 'first_name', 'last_name', 'role', 'status', 'national_id'})
+
+    def test_roster_filters(self):
+        client = self.roster_client(self.login().data['token'])
+        response = client.get('/api/hospital/users/?role=patient&status=pending')
+        expected = User.objects.filter(hospital=self.hospital, role='patient', status='pending').order_by('id')
+        self.assertEqual([row['id'] for row in response.data['results']], list(expected.values_list('id', flat=True)))
+
+    def test_roster_needs_hospital_token(self):
+        self.assertEqual(APIClient().get('/api/hospital/users/').status_code, 401)
+        self.assertEqual(self.roster_client('garbage').get('/api/hospital/users/').status_code, 401)
+
+        token = self.login().data['token']
+        self.hospital.set_password('changed')
+        self.assertEqual(self.roster_client(token).get('/api/hospital/users/').status_code, 401)
+
+
+# ==========================
+# Vital Signs
+# ==========================
+class VitalSignBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        hospital = Hospital.objects.create(name='Hospital', location='Cairo', email='h@example.com')
+        cls.reports, cls.patients = [], []
+        for i in range(3):
+            patient = User.objects.create(national_id=f"{i + 1:014d}", first_name='P', last_name='T', role='patient')
+            donor = User.objects.create(national_id=f"{i + 11:014d}", first_name='D', last_name='T', role='donor')
+            match = OrganMatching.objects.create(patient=patient, donor=donor, organ_type='kidney')
+            surgery = Surgery.objects.create(surgery_number=f'S-{i}', organ_matching=match, hospital=hospital,
+                                             scheduled_date=timezone.now())
+            cls.reports.append(SurgeryReport.objects.create(surgery=surgery, result_summary='ok'))
+            cls.patients.append(patient)
+
+    def readings(self, count):
+        # كل رابع قراية أكسجين واطي (critical +15)، وكل خامس حرارة عالية (+10)
+        return [
+            {
+                'surgery_report': self.reports[i % 3].id,
+                'oxygen_saturation': 90 if i % 4 == 0 else 98,
+                'temperature_c': 38.5 if i % 5 == 0 else 36.8,
+                'heart_rate': 80,
+            }
+            for i in range(count)
+        ]
+
+    def test_batch(self):
+        readings = self.readings(300)
+        response = APIClient().post('/api/vital-signs/batch/', readings, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        alerting = [i for i in range(300) if i % 4 == 0 or i % 5 == 0]
+        self.assertEqual(response.data, {'created': 300, 'alerts': len(alerting), 'priority_updates': 3})
+        self.assertEqual(VitalSign.objects.count(), 300)
+        self.assertEqual(Alert.objects.filter(alert_type='critical').count(), len(range(0, 300, 4)))
+
+        for j, patient in enumerate(self.patients):
+            score = sum(15 * (i % 4 == 0) + 10 * (i % 5 == 0) for i in range(j, 300, 3))
+            priority = PatientPriority.objects.get(patient=patient)
+            self.assertEqual(priority.score, score)
+            self.assertEqual(priority.level, 'critical')
+
+    def test_queries_do_not_grow_with_batch(self):
+        client = APIClient()
+        # أول batch بيعمل صفوف الـ priorities والـ table versions
+        client.post('/api/vital-signs/batch/', self.readings(3), format='json')
+        with CaptureQueriesContext(connection) as small:
+            client.post('/api/vital-signs/batch/', self.readings(10), format='json')
+        with CaptureQueriesContext(connection) as large:
+            client.post('/api/vital-signs/batch/', self.readings(100), format='json')
+        # (sqlite بيقسم الـ INSERTs الأكبر على حسب عدد الـ parameters)
+        self.assertEqual(len(small), len(large))
+
+    def test_unknown_report_writes_nothing(self):
+        readings = self.readings(5) + [{'surgery_report': 999999, 'heart_rate': 130}]
+        response = APIClient().post('/api/vital-signs/batch/', readings, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(VitalSign.objects.count(), 0)
+        self.assertEqual(Alert.objects.count(), 0)
+
+    def test_batch_limits(self):
+        client = APIClient()
+        self.assertEqual(client.post('/api/vital-signs/batch/', [], format='json').status_code, 400)
+        with self.settings(VITALS_BATCH_MAX_SIZE=5):
+            self.assertEqual(client.post('/api/vital-signs/batch/', self.readings(6), format='json').status_code, 400)
 
-# Create your tests here.
+    def test_single_reading_same_rules(self):
+        response = APIClient().post('/api/vital-signs/', {
+            'surgery_report': self.reports[0].id, 'oxygen_saturation': 90, 'blood_pressure_systolic': 170,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        alert = Alert.objects.get()
+        self.assertEqual((alert.user_id, alert.alert_type), (self.patients[0].id, 'critical'))
+        self.assertEqual(PatientPriority.objects.get(patient=self.patients[0]).score, 25)
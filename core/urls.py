@@ -55,4 +55,5 @@ urlpatterns = [
     path('logout/', LogoutUserView.as_view(), name='logout-user'),
     path('hospital/register/', HospitalRegisterView.as_view(), name='hospital-register'),
     path('hospital/login/', HospitalLoginView.as_view(), name='hospital-login'),
+    path('hospital/users/', HospitalUsersView.as_view(), name='hospital-users'),
 ]
@@ -0,0 +1,165 @@
+# Per-table version counters for conditional GETs.
+# كل كتابة (save / delete، و bump() صريح بعد الـ bulk writes) بتزود الـ version بعد الـ commit،
+# فالـ ETag بيتحسب من query صغيرة على TableVersion بس، و 304 مبيلمسش الـ tables ولا الـ serializers.
+# The bump is a short autocommit UPDATE run from on_commit, so writers never hold the hot version row
+# locked for the rest of their transaction; a reader in the gap between the commit and the bump can
+# see the new rows under the old ETag until the bump lands.
+import hashlib
+
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist
+from django.db import IntegrityError, transaction
+from django.db.models import F, Prefetch
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import TableVersion
+
+
+def table_label(model):
+    return model._meta.label_lower
+
+
+def bump(*models):
+    # tables كتير في نفس الـ transaction → callback واحد بعد الـ commit (بره transaction بيتنفذ على طول)
+    labels = {table_label(model) for model in models}
+    pending = transaction.get_connection().run_on_commit
+    for _, callback, *_ in pending:
+        if getattr(callback, 'version_labels', None) is not None and not callback.done:
+            callback.version_labels |= labels
+            return
+
+    def run():
+        run.done = True
+        bump_tables(run.version_labels)
+
+    run.version_labels, run.done = labels, False
+    transaction.on_commit(run)
+
+
+def bump_tables(labels):
+    now = timezone.now()
+    for label in sorted(labels):
+        updated = TableVersion.objects.filter(table=label).update(version=F('version') + 1, updated_at=now)
+        if not updated:
+            try:
+                with transaction.atomic():
+                    TableVersion.objects.create(table=label, version=1, updated_at=now)
+            except IntegrityError:
+                # process تاني عمل الصف في نفس اللحظة
+                TableVersion.objects.filter(table=label).update(version=F('version') + 1, updated_at=now)
+
+
+def current_versions(models):
+    labels = sorted({table_label(model) for model in models})
+    rows = dict(
+        (table, (version, updated_at))
+        for table, version, updated_at in
+        TableVersion.objects.filter(table__in=labels).values_list('table', 'version', 'updated_at')
+    )
+    return [(label, *rows.get(label, (0, None))) for label in labels]
+
+
+def record_write(sender, **kwargs):
+    bump(sender)
+
+
+def connect_signals():
+    for model in apps.get_app_config('core').get_models():
+        if model is not TableVersion:
+            post_save.connect(record_write, sender=model, dispatch_uid=f'version-save-{table_label(model)}')
+            post_delete.connect(record_write, sender=model, dispatch_uid=f'version-delete-{table_label(model)}')
+
+
+# ==========================
+# Serializer → tables
+# ==========================
+def lookup_models(model, lookup):
+    found = []
+    for name in lookup.split('__'):
+        if model is None:
+            break
+        try:
+            model = model._meta.get_field(name).related_model
+        except FieldDoesNotExist:
+            break
+        if model is not None:
+            found.append(model)
+    return found
+
+
+def select_related_models(model, tree):
+    found = []
+    for name, children in (tree or {}).items():
+        related = model._meta.get_field(name).related_model
+        found += [related, *select_related_models(related, children)]
+    return found
+
+
+def serializer_models(serializer_class):
+    # كل الـ tables اللي ممكن الـ serializer يقرا منها (الـ expand كله، حتى لو مش مطلوب: أمان أكتر من اللازم)
+    model = serializer_class.Meta.model
+    found = {model}
+    for lookups in getattr(serializer_class, 'expandable_fields', {}).values():
+        for lookup in lookups:
+            if isinstance(lookup, Prefetch):
+                found.update(lookup_models(model, lookup.prefetch_through))
+                if lookup.queryset is not None:
+                    related = lookup.queryset.model
+                    found.add(related)
+                    tree = lookup.queryset.query.select_related
+                    found.update(select_related_models(related, tree if isinstance(tree, dict) else {}))
+            else:
+                found.update(lookup_models(model, lookup))
+    for field in serializer_class.field_instances().values():
+        parts = field.source.split('.')
+        if len(parts) > 1:
+            found.update(lookup_models(model, '__'.join(parts[:-1])))
+    return found
+
+
+class ConditionalGetMixin:
+    # ETag / Last-Modified للـ list و retrieve من الـ table versions؛ If-None-Match / If-Modified-Since → 304
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().retrieve, *args, **kwargs)
+
+    def version_models(self):
+        serializer_class = self.get_serializer_class()
+        if '_version_models' not in serializer_class.__dict__:
+            serializer_class._version_models = serializer_models(serializer_class)
+        return serializer_class._version_models | {self.get_queryset().model}
+
+    def get_validators(self, request):
+        versions = current_versions(self.version_models())
+        user = getattr(request, 'user', None)
+        key = repr((
+            versions, request.get_full_path(), request.accepted_media_type,
+            # الـ querysets اللي بتفلتر بالـ user (UserReport مثلاً)
+            user.pk if user is not None and user.is_authenticated else None,
+        ))
+        etag = '"%s"' % hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+        updated = [updated_at for _, _, updated_at in versions]
+        last_modified = int(max(updated).timestamp()) if updated and None not in updated else None
+        return etag, last_modified
+
+    def full_response(self, request, etag, handler, *args, **kwargs):
+        # 200 عادي؛ CachedResponseMixin بيجيبه من الـ cache بالـ ETag
+        return handler(request, *args, **kwargs)
+
+    def conditional_response(self, request, handler, *args, **kwargs):
+        # الـ versions بتتقرا قبل الـ data: لو حصلت كتابة في النص الـ ETag بيبقى أقدم، فالـ poll الجاي يجيب الجديد
+        etag, last_modified = self.get_validators(request)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = self.full_response(request, etag, handler, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
@@ -5,11 +5,30 @@ from rest_framework.response import Response
 from django.core.exceptions import ValidationError
 from .models import *
 from .serializers import *
+from .matching import (
+    run_auto_match, start_auto_match, match_stats_headers, enqueue_auto_match, lock_auto_match, job_progress,
+    finish_job, locked_stream,
+)
+from .streaming import ndjson_response
+from .allocation import allocate
+from .exchange import find_exchanges
+from .score_cache import score_cache
+from .simulation import simulate_donor
+from .priority import calculate_priorities
+from .rollups import hospitals_stats, users_stats
+from .vitals import apply_vital_signs, ingest_vital_signs, report_patients
+from .pagination import KeysetPagination
+from .fastpath import FastListMixin
+from .versions import ConditionalGetMixin
+from .authentication import HospitalTokenAuthentication, IsHospital, hospital_token
+from .response_cache import CachedResponseMixin
 from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate
+from django.conf import settings
+from django.db import transaction
 from django.db.models import Count, Q
 
 
@@ -17,12 +36,24 @@ from django.db.models import Count, Q
 
 
 
-class PatientMedicalProfileListView(generics.ListAPIView):
-    queryset = PatientMedicalProfile.objects.all()
+class SparseFieldsetViewMixin:
+    # ?fields= / ?expand=: الـ serializer بيحدد الـ joins والـ columns اللي الصفحة محتاجاها
+    sparse_actions = ('list', 'retrieve')
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request.method == 'GET' and getattr(self, 'action', 'list') in self.sparse_actions:
+            queryset = self.get_serializer_class().shape_queryset(queryset, self.request)
+        return queryset
+
+
+# الـ joins والـ prefetch بتاعة الأمراض بتيجي من الـ serializer حسب ?expand=، فالصفحة بعدد queries ثابت
+class PatientMedicalProfileListView(ConditionalGetMixin, SparseFieldsetViewMixin, generics.ListAPIView):
+    queryset = PatientMedicalProfile.objects.order_by('id')
     serializer_class = PatientMedicalProfileSerializer
 
-class DonorMedicalProfileListView(generics.ListAPIView):
-    queryset = DonorMedicalProfile.objects.all()
+class DonorMedicalProfileListView(ConditionalGetMixin, SparseFieldsetViewMixin, generics.ListAPIView):
+    queryset = DonorMedicalProfile.objects.order_by('id')
     serializer_class = DonorMedicalProfileSerializer
 
 # register 
@@ -137,54 +168,65 @@ class HospitalLoginView(generics.GenericAPIView):
         if not hospital.check_password(password):
             return Response({"Message": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
 
-        users = User.objects.filter(hospital=hospital)
-        users_data = [
-            {
-                "id": u.id,
-                "first_name": u.first_name,
-                "last_name": u.last_name,
-                "role": u.role,
-                "national_id": u.national_id
-            } for u in users
-        ]
-
+        # الـ users مبقوش في الـ login: GET hospital/users/ بالـ token ده
         return Response({
             "hospital_id": hospital.id,
             "hospital_name": hospital.name,
             "hospital_type": hospital.hospital_type,
-            "users": users_data
+            "token": hospital_token(hospital),
         })
 
 
+class HospitalUsersView(generics.ListAPIView):
+    # roster المستشفى اللي عاملة login، صفحة صفحة من values() (cursor على الـ id)، ?role= / ?status=
+    authentication_classes = [HospitalTokenAuthentication]
+    permission_classes = [IsHospital]
+    pagination_class = KeysetPagination
+    keyset_ordering = ['id']
+    roster_fields = ['id', 'first_name', 'last_name', 'role', 'status', 'national_id']
+
+    def get_queryset(self):
+        queryset = User.objects.filter(hospital=self.request.auth)
+        for name in ('role', 'status'):
+            value = self.request.query_params.get(name)
+            if value:
+                queryset = queryset.filter(**{name: value})
+        return queryset.values(*self.roster_fields)
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        response = self.get_paginated_response(page)
+        # ints و strings بس، فـ orjson بيطلع نفس الـ bytes
+        response.fast_json = True
+        return response
+
 
 
 
 # ==========================
 # Hospital & Doctor
 # ==========================
-class HospitalViewSet(viewsets.ModelViewSet):
+class HospitalViewSet(CachedResponseMixin, ConditionalGetMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = Hospital.objects.all()
     serializer_class = HospitalSerializer
 
     @action(detail=False, methods=['get'])
     def stats_all(self, request):
-        hospitals = Hospital.objects.all()
-
-        data = []
-        for hospital in hospitals:
-            users = User.objects.filter(hospital=hospital)
-            data.append({
-                "hospital_id": hospital.id,
-                "hospital_name": hospital.name,
-                "total_users": users.count(),
-                "total_patients": users.filter(role='patient').count(),
-                "total_donors": users.filter(role='donor').count()
-            })
+        data = [
+            {
+                "hospital_id": hospital_id,
+                "hospital_name": name,
+                "total_users": total_users,
+                "total_patients": total_patients,
+                "total_donors": total_donors,
+            }
+            for hospital_id, name, total_users, total_patients, total_donors in hospitals_stats()
+        ]
 
         return Response(data)
 
 
-class DoctorViewSet(viewsets.ModelViewSet):
+class DoctorViewSet(CachedResponseMixin, ConditionalGetMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = Doctor.objects.all()
     serializer_class = DoctorSerializer
     def get_queryset(self):
@@ -198,12 +240,12 @@ class DoctorViewSet(viewsets.ModelViewSet):
 # ==========================
 # Chronic Diseases
 # ==========================
-class ChronicDiseaseViewSet(viewsets.ModelViewSet):
+class ChronicDiseaseViewSet(CachedResponseMixin, ConditionalGetMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = ChronicDisease.objects.all()
     serializer_class = ChronicDiseaseSerializer
 
 
-class UserChronicDiseaseViewSet(viewsets.ModelViewSet):
+class UserChronicDiseaseViewSet(ConditionalGetMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = UserChronicDisease.objects.all()
     serializer_class = UserChronicDiseaseSerializer
 
@@ -211,20 +253,20 @@ class UserChronicDiseaseViewSet(viewsets.ModelViewSet):
 # ==========================
 # Patient & Donor Profiles
 # ==========================
-class PatientMedicalProfileViewSet(viewsets.ModelViewSet):
-    queryset = PatientMedicalProfile.objects.all()
+class PatientMedicalProfileViewSet(ConditionalGetMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
+    queryset = PatientMedicalProfile.objects.order_by('id')
     serializer_class = PatientMedicalProfileSerializer
 
 
-class DonorMedicalProfileViewSet(viewsets.ModelViewSet):
-    queryset = DonorMedicalProfile.objects.all()
+class DonorMedicalProfileViewSet(ConditionalGetMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
+    queryset = DonorMedicalProfile.objects.order_by('id')
     serializer_class = DonorMedicalProfileSerializer
 
 
 # ==========================
 # Appointments
 # ==========================
-class AppointmentViewSet(viewsets.ModelViewSet):
+class AppointmentViewSet(ConditionalGetMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = Appointment.objects.all()
     serializer_class = AppointmentSerializer
 
@@ -247,42 +289,144 @@ class AppointmentViewSet(viewsets.ModelViewSet):
 # ==========================
 # Organ & Matching
 # ==========================
-class OrganMatchingViewSet(viewsets.ModelViewSet):
+EXPORT_CHUNK_SIZE = 2000
+
+
+class OrganMatchingViewSet(ConditionalGetMixin, FastListMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = OrganMatching.objects.all()
     serializer_class = OrganMatchingSerializer
 
+    # ?hla_dr_mismatches=0&max_hla_mismatches=2&ordering=hla_mismatch_count
+    MISMATCH_FIELDS = OrganMatching.HLA_MISMATCH_FIELDS
+    ORDERING_FIELDS = ['match_percentage', 'created_at', *MISMATCH_FIELDS]
+    sparse_actions = ('list', 'retrieve', 'export')
+    pagination_class = KeysetPagination
+    # الـ columns اللي مش null وعليها index (الترتيب + id)
+    KEYSET_FIELDS = ['match_percentage', 'created_at']
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        params = self.request.query_params
+        for field in ('patient', 'donor', 'organ_type', 'status'):
+            if params.get(field):
+                queryset = queryset.filter(**{field: params[field]})
+        for field in self.MISMATCH_FIELDS:
+            if params.get(field, '').isdigit():
+                queryset = queryset.filter(**{field: int(params[field])})
+        if params.get('max_hla_mismatches', '').isdigit():
+            queryset = queryset.filter(hla_mismatch_count__lte=int(params['max_hla_mismatches']))
+
+        ordering = params.get('ordering')
+        if ordering and ordering.lstrip('-') in self.ORDERING_FIELDS:
+            queryset = queryset.order_by(ordering, 'id')
+        return queryset
+
+    def get_keyset_ordering(self):
+        ordering = self.request.query_params.get('ordering') or '-match_percentage'
+        if ordering.lstrip('-') not in self.KEYSET_FIELDS:
+            # الـ mismatch columns ممكن تبقى null: page numbers من غير COUNT(*)
+            return None if ordering.lstrip('-') in self.ORDERING_FIELDS else ['-match_percentage', '-id']
+        return [ordering, '-id' if ordering.startswith('-') else 'id']
+
     @action(detail=False, methods=['post'])
     def auto_match(self, request):
-        patients = User.objects.filter(role='patient', status='approved')
-        all_matches = []
-        for patient in patients:
-            donors = User.objects.filter(role='donor', status='approved')
-            for donor in donors:
-                result = OrganMatching.calculate_match(patient, donor)
-                # تخزين الـ match
-                match, created = OrganMatching.objects.update_or_create(
-                    patient=patient,
-                    donor=donor,
-                    defaults={
-                        "organ_type": getattr(patient.patient_profile, 'organ_needed', 'N/A'),
-                        "match_percentage": result['match_percentage'],
-                        "ai_result": result['ai_result'],
-                        "status": 'pending'
-                    }
-                )
-                all_matches.append({
-                    "patient": str(patient),
-                    "donor": str(donor),
-                    "organ_type": getattr(patient.patient_profile, 'organ_needed', 'N/A'),
-                    "match_percentage": result['match_percentage']
-                })
-        return Response(all_matches)
+        # ?async=1 → يرجع job id فورًا والـ worker هو اللي يشغل الـ matching
+        if request.query_params.get('async') in ('1', 'true', 'True'):
+            job, created = enqueue_auto_match()
+            return Response({
+                "job_id": job.id,
+                "status": job.status,
+                "created": created,
+            }, status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK)
+
+        try:
+            top_k = int(request.query_params['top_k']) if 'top_k' in request.query_params else None
+            min_score = float(request.query_params['min_score']) if 'min_score' in request.query_params else None
+        except ValueError:
+            return Response({"Message": "top_k and min_score must be numbers"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # نفس الـ lock بتاع الـ jobs: مفيش run متزامن جنب job شغالة أو مستنية
+        job, holder = lock_auto_match()
+        if job is None:
+            return Response({
+                "Message": "auto_match is already running",
+                "job_id": holder.id if holder else None,
+                "status": holder.status if holder else None,
+            }, status=status.HTTP_409_CONFLICT)
+
+        # ?output=ndjson → كل match بيتبعت سطر لوحده أول ما يتحسب
+        if request.query_params.get('output') == 'ndjson':
+            try:
+                run = start_auto_match(progress=job_progress(job), top_k=top_k, min_score=min_score)
+            except Exception as exc:
+                finish_job(job, error=str(exc))
+                raise
+            return ndjson_response(locked_stream(job, run), headers=match_stats_headers(run.stats))
+
+        try:
+            all_matches, stats = run_auto_match(progress=job_progress(job), top_k=top_k, min_score=min_score)
+        except Exception as exc:
+            finish_job(job, error=str(exc))
+            raise
+        finish_job(job, stats)
+        return Response(all_matches, headers=match_stats_headers(stats))
+
+    @action(detail=False, methods=['get'])
+    def allocate(self, request):
+        # توزيع المتبرعين على المرضى (مفيش كتابة، مجرد اقتراح)
+        try:
+            min_score = float(request.query_params.get('min_score', 0))
+        except ValueError:
+            return Response({"Message": "min_score must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(allocate(request.query_params.get('organ_type'), min_score))
+
+    @action(detail=False, methods=['get'])
+    def paired_exchange(self, request):
+        # kidney paired exchange: cycles بين الأزواج + chains من متبرع altruistic
+        try:
+            max_cycle = min(max(int(request.query_params.get('max_cycle', 3)), 2), 3)
+            max_chain = min(max(int(request.query_params.get('max_chain', 3)), 0), 6)
+            min_score = float(request.query_params.get('min_score', 1))
+            time_budget = min(float(request.query_params.get('time_budget', 2)), 30)
+        except ValueError:
+            return Response(
+                {"Message": "max_cycle, max_chain, min_score and time_budget must be numbers"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response(find_exchanges(max_cycle, max_chain, min_score, time_budget))
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_serializer()
+        rows = (serializer.to_representation(match) for match in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE))
+        return ndjson_response(rows, filename='organ-matching.ndjson')
+
+    @action(detail=False, methods=['post'])
+    def simulate(self, request):
+        # "what-if": ترتيب المرضى لمتبرع افتراضي من الـ snapshot اللي في الـ memory، من غير أي كتابة
+        serializer = DonorSimulationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(simulate_donor(serializer.validated_data))
+
+    @action(detail=False, methods=['get'])
+    def score_cache(self, request):
+        # hit / miss counters بتوع الـ score cache في الـ process ده
+        return Response(score_cache.stats())
+
+    @action(detail=False, methods=['get'], url_path=r'jobs/(?P<job_id>\d+)')
+    def job_status(self, request, job_id=None):
+        try:
+            job = MatchingJob.objects.get(id=job_id)
+        except MatchingJob.DoesNotExist:
+            return Response({"Message": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(MatchingJobSerializer(job).data)
 
 
 # ==========================
 # Surgery
 # ==========================
-class SurgeryViewSet(viewsets.ModelViewSet):
+class SurgeryViewSet(ConditionalGetMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = Surgery.objects.all()
     serializer_class = SurgerySerializer
 
@@ -290,7 +434,7 @@ class SurgeryViewSet(viewsets.ModelViewSet):
 # ==========================
 # MRI Reports
 # ==========================
-class MRIReportViewSet(viewsets.ModelViewSet):
+class MRIReportViewSet(ConditionalGetMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = MRIReport.objects.all()
     serializer_class = MRIReportSerializer
 
@@ -298,49 +442,23 @@ class MRIReportViewSet(viewsets.ModelViewSet):
 # ==========================
 # Patient Priority
 # ==========================
-class PatientPriorityViewSet(viewsets.ModelViewSet):
+class PatientPriorityViewSet(ConditionalGetMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = PatientPriority.objects.all()
     serializer_class = PatientPrioritySerializer
 
     @action(detail=False, methods=['post'])
     def calculate_priority(self, request):
-        patients = User.objects.filter(role='patient')
-        results = []
-        for patient in patients:
-            score = 0
-            if patient.chronic_diseases.exists():
-                score += patient.chronic_diseases.count() * 10
-            if hasattr(patient, 'patient_profile') and patient.patient_profile.organ_needed:
-                score += 20
-
-            # تحديد المستوى
-            level = 'low'
-            if score >= 50:
-                level = 'critical'
-            elif score >= 30:
-                level = 'high'
-            elif score >= 10:
-                level = 'medium'
-
-            # حفظ أو تحديث
-            priority, _ = PatientPriority.objects.update_or_create(
-                patient=patient,
-                defaults={'score': score, 'level': level}
-            )
-
-            results.append({
-                "patient": str(patient),
-                "score": score,
-                "level": level
-            })
-
+        # كل المرضى من الـ registry snapshot + query واحدة للـ chronic diseases
+        results = calculate_priorities()
         return Response(results)
 # ==========================
 # Alerts
 # ==========================
-class AlertViewSet(viewsets.ModelViewSet):
+class AlertViewSet(ConditionalGetMixin, FastListMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = Alert.objects.all()
     serializer_class = AlertSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ['-created_at', '-id']
 
     def get_queryset(self):
             return Alert.objects.all().order_by('-created_at')  # مؤقتًا بدون auth
@@ -353,37 +471,27 @@ class AlertViewSet(viewsets.ModelViewSet):
             return Response({"detail": "Alert marked as read"})
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ConditionalGetMixin, FastListMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
     # 🔹 /api/users/stats/
     @action(detail=False, methods=['get'])
     def stats(self, request):
-        stats = User.objects.aggregate(
-            total_users=Count('id'),
-            patients_count=Count('id', filter=Q(role='patient')),
-            donors_count=Count('id', filter=Q(role='donor')),
-        )
+        stats = users_stats()
 
-        return Response(stats)
+        return Response({
+            "total_users": stats['total_users'],
+            "patients_count": stats['patients'],
+            "donors_count": stats['donors'],
+        })
     
     @action(detail=False, methods=['get'])
     def stats_by_hospital(self, request):
-        hospital_id = request.query_params.get('hospital')
-
-        qs = User.objects.all()
-        if hospital_id:
-            qs = qs.filter(hospital_id=hospital_id)
+        return Response(users_stats(request.query_params.get('hospital')))
 
-        return Response({
-            "total_users": qs.count(),
-            "patients": qs.filter(role='patient').count(),
-            "donors": qs.filter(role='donor').count(),
-        })
 
-
-class UserReportViewSet(viewsets.ModelViewSet):
+class UserReportViewSet(ConditionalGetMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = UserReport.objects.all()
     serializer_class = UserReportSerializer
 
@@ -406,7 +514,7 @@ class UserReportViewSet(viewsets.ModelViewSet):
 
 
 
-class SurgeryReportViewSet(viewsets.ModelViewSet):
+class SurgeryReportViewSet(ConditionalGetMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = SurgeryReport.objects.select_related(
         'surgery__organ_matching__patient',
         'surgery__doctor'
@@ -444,6 +552,31 @@ class SurgeryReportViewSet(viewsets.ModelViewSet):
 
 
 
-class VitalSignViewSet(viewsets.ModelViewSet):
+class VitalSignViewSet(ConditionalGetMixin, FastListMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = VitalSign.objects.all().order_by('-recorded_at')
-    serializer_class = VitalSignSerializer
\ No newline at end of file
+    serializer_class = VitalSignSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ['-recorded_at', '-id']
+
+    def perform_create(self, serializer):
+        # نفس الـ alerts / priority بتوع الـ batch
+        with transaction.atomic():
+            reading = serializer.save()
+            apply_vital_signs([reading], report_patients([reading.surgery_report_id]))
+
+    # 🔹 POST /api/vital-signs/batch/ : list من الـ readings (لحد VITALS_BATCH_MAX_SIZE)
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        serializer = VitalSignReadingSerializer(
+            data=request.data, many=True, allow_empty=False, max_length=settings.VITALS_BATCH_MAX_SIZE
+        )
+        serializer.is_valid(raise_exception=True)
+        readings = [VitalSign(**item) for item in serializer.validated_data]
+
+        patients = report_patients(reading.surgery_report_id for reading in readings)
+        missing = sorted({reading.surgery_report_id for reading in readings} - patients.keys())
+        if missing:
+            return Response({"surgery_report": [f"Surgery reports not found: {missing}"]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(ingest_vital_signs(readings, patients), status=status.HTTP_201_CREATED)
@@ -0,0 +1,98 @@
+# Post-operative vital signs: threshold alerts and priority deltas for a whole batch of readings.
+# الـ patients بيتجابوا بـ join واحد، والـ readings والـ alerts والـ priorities بيتكتبوا bulk في transaction واحدة.
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Alert, PatientPriority, SurgeryReport, VitalSign
+from .versions import bump
+
+WRITE_BATCH_SIZE = 1000
+
+# (الحقل، الشرط، الرسالة، الـ score، critical)
+VITAL_RULES = [
+    ('oxygen_saturation', lambda value: value < 92, "انخفاض نسبة الأكسجين", 15, True),
+    ('temperature_c', lambda value: value >= 38, "ارتفاع درجة الحرارة", 10, False),
+    ('heart_rate', lambda value: value > 120, "ارتفاع ضربات القلب", 10, False),
+    ('blood_pressure_systolic', lambda value: value > 160, "ارتفاع ضغط الدم", 10, False),
+]
+
+
+def evaluate_reading(reading):
+    # (الرسائل، critical، الزيادة في الـ score) لقراية واحدة
+    messages, critical, score_delta = [], False, 0
+    for field, breached, message, score, is_critical in VITAL_RULES:
+        value = getattr(reading, field)
+        if value is not None and breached(value):
+            messages.append(message)
+            critical = critical or is_critical
+            score_delta += score
+    return messages, critical, score_delta
+
+
+def vital_priority_level(score):
+    # مقياس الـ vital signs (أعلى من priority.priority_level)
+    if score >= 70:
+        return 'critical'
+    if score >= 40:
+        return 'high'
+    if score >= 20:
+        return 'medium'
+    return 'low'
+
+
+def report_patients(report_ids):
+    # {surgery_report_id: patient_id} بـ join واحد (report → surgery → organ_matching)
+    return dict(
+        SurgeryReport.objects.filter(id__in=set(report_ids))
+        .values_list('id', 'surgery__organ_matching__patient_id')
+    )
+
+
+def apply_vital_signs(readings, patients):
+    # alerts و priority deltas لـ readings اتكتبت خلاص؛ patients = report_patients(...)
+    alerts, deltas = [], defaultdict(int)
+    for reading in readings:
+        patient_id = patients.get(reading.surgery_report_id)
+        if patient_id is None:
+            continue
+        messages, critical, score_delta = evaluate_reading(reading)
+        if messages:
+            alerts.append(Alert(
+                user_id=patient_id,
+                message="تحذير بعد العملية: " + "، ".join(messages),
+                alert_type="critical" if critical else "medical",
+            ))
+        deltas[patient_id] += score_delta
+
+    Alert.objects.bulk_create(alerts, batch_size=WRITE_BATCH_SIZE)
+
+    # كل مريض ليه priority (زي get_or_create)، والـ rows بتتقفل عشان batches في نفس الوقت ميضيعوش deltas بعض
+    PatientPriority.objects.bulk_create(
+        [PatientPriority(patient_id=patient_id, score=0, level='low') for patient_id in deltas],
+        batch_size=WRITE_BATCH_SIZE, ignore_conflicts=True,
+    )
+    changed, now = [], timezone.now()
+    for priority in PatientPriority.objects.select_for_update().filter(
+        patient_id__in=[patient_id for patient_id, delta in deltas.items() if delta]
+    ).order_by('patient_id'):
+        priority.score += deltas[priority.patient_id]
+        priority.level = vital_priority_level(priority.score)
+        priority.updated_at = now  # bulk_update مبيشغلش auto_now
+        changed.append(priority)
+    PatientPriority.objects.bulk_update(changed, ['score', 'level', 'updated_at'], batch_size=WRITE_BATCH_SIZE)
+
+    # bulk writes مبتبعتش post_save (ETags / response cache)
+    bump(VitalSign, Alert, PatientPriority)
+    return {"alerts": len(alerts), "priority_updates": len(changed)}
+
+
+def ingest_vital_signs(readings, patients=None):
+    # readings: VitalSign objects مش محفوظة؛ patients لو الـ view جابها وهو بيتأكد من الـ surgery reports
+    if patients is None:
+        patients = report_patients(reading.surgery_report_id for reading in readings)
+    with transaction.atomic():
+        VitalSign.objects.bulk_create(readings, batch_size=WRITE_BATCH_SIZE)
+        result = apply_vital_signs(readings, patients)
+    return {"created": len(readings), **result}
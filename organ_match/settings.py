@@ -92,10 +92,56 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.TokenAuthentication',
         
     ],
-     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+     # ?count=false بيلغي الـ COUNT(*)؛ alerts / vital signs / matches بتستخدم cursor (core.pagination)
+     'DEFAULT_PAGINATION_CLASS': 'core.pagination.OptionalCountPagination',
+    # نفس JSONRenderer، بس بيستخدم orjson للـ list endpoints اللي عليها الـ fast path (core.fastpath)
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.fastpath.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'PAGE_SIZE': 30,
 }
 
+# Organ matching
+MATCHING_BULK_BATCH_SIZE = int(os.environ.get('MATCHING_BULK_BATCH_SIZE', 1000))
+# re-score only the changed user's pairs after a matching-relevant save
+MATCHING_INCREMENTAL = os.environ.get('MATCHING_INCREMENTAL', 'True') == 'True'
+# keep only the best K donors per patient and/or matches above a score (0 = keep everything)
+MATCHING_TOP_K = int(os.environ.get('MATCHING_TOP_K', 0))
+MATCHING_MIN_SCORE = float(os.environ.get('MATCHING_MIN_SCORE', 0))
+# process-pool scoring for runs with at least MATCHING_PARALLEL_MIN_PAIRS candidate pairs (1 = in-process)
+MATCHING_WORKERS = int(os.environ.get('MATCHING_WORKERS', 1))
+MATCHING_PARALLEL_MIN_PAIRS = int(os.environ.get('MATCHING_PARALLEL_MIN_PAIRS', 1000000))
+# LRU score cache keyed by users' matching revisions, size in pairs (0 = off), optionally backed by a CACHES alias
+MATCHING_SCORE_CACHE_SIZE = int(os.environ.get('MATCHING_SCORE_CACHE_SIZE', 1000000))
+MATCHING_SCORE_CACHE_ALIAS = os.environ.get('MATCHING_SCORE_CACHE_ALIAS', '')
+MATCHING_SCORE_CACHE_TIMEOUT = int(os.environ.get('MATCHING_SCORE_CACHE_TIMEOUT', 86400))
+# seconds between checks for changes made by other processes to the in-memory registry snapshot
+MATCHING_SNAPSHOT_TTL = float(os.environ.get('MATCHING_SNAPSHOT_TTL', 5))
+# seconds without a progress heartbeat after which a running matching job counts as dead and is reclaimed
+MATCHING_JOB_TIMEOUT = int(os.environ.get('MATCHING_JOB_TIMEOUT', 900))
+
+# API
+# users / alerts / vital signs / matches lists من values() + orjson بدل الـ serializers
+API_FAST_PATH = os.environ.get('API_FAST_PATH', 'True') == 'True'
+# rendered hospitals / doctors / chronic diseases responses keyed by their ETag, in a CACHES alias ('' = off)
+API_RESPONSE_CACHE_ALIAS = os.environ.get('API_RESPONSE_CACHE_ALIAS', 'default')
+API_RESPONSE_CACHE_TIMEOUT = int(os.environ.get('API_RESPONSE_CACHE_TIMEOUT', 3600))
+# dashboard user counts from the HospitalUserStats rollup instead of COUNTs over users
+HOSPITAL_STATS_ROLLUP = os.environ.get('HOSPITAL_STATS_ROLLUP', 'True') == 'True'
+# lifetime in seconds of the signed token returned by hospital/login/
+HOSPITAL_TOKEN_MAX_AGE = int(os.environ.get('HOSPITAL_TOKEN_MAX_AGE', 7 * 24 * 3600))
+# max readings per POST to vital-signs/batch/
+VITALS_BATCH_MAX_SIZE = int(os.environ.get('VITALS_BATCH_MAX_SIZE', 1000))
+
+# local memory by default؛ CACHE_BACKEND / CACHE_LOCATION لـ cache مشترك بين الـ workers (Redis مثلاً)
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'organ-match'),
+    }
+}
+
 WSGI_APPLICATION = 'organ_match.wsgi.application'
 
 